@@ -25,13 +25,18 @@ setup(
     keywords='security,usb,fuzzing,kitty',
     entry_points={
         'console_scripts': [
+            'umap2bench=umap2.fuzz.benchmark:main',
             'umap2detect=umap2.apps.detect_os:main',
             'umap2emulate=umap2.apps.emulate:main',
             'umap2fuzz=umap2.apps.fuzz:main',
             'umap2list=umap2.apps.list_classes:main',
+            'umap2multi=umap2.apps.multi:main',
             'umap2kitty=umap2.fuzz.fuzz_engine:main',
+            'umap2minimize=umap2.fuzz.minimizer:main',
+            'umap2results=umap2.fuzz.results:main',
             'umap2scan=umap2.apps.scan:main',
             'umap2vsscan=umap2.apps.vsscan:main',
+            'umap2vsdb=umap2.utils.vid_pid_db:main',
             'umap2stages=umap2.apps.makestages:main',
         ]
     },
@@ -11,9 +11,14 @@ class EventHandler(object):
 
     def __init__(self):
         self.events = []
+        self.setup_packets = 0
 
     def reset(self):
         self.events = []
+        self.setup_packets = 0
+
+    def signal_setup_packet_received(self, app):
+        self.setup_packets += 1
 
     def handle_event(self, event):
         self.events.append(event)
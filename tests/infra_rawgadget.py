@@ -0,0 +1,141 @@
+'''
+Mock ioctl layer for testing the raw gadget physical layer
+'''
+import struct
+from six.moves.queue import Queue
+from umap2.phy.rawgadget import raw_gadget as rg
+
+
+class MockRawGadgetLayer(object):
+    '''
+    Emulates the raw_gadget kernel module.
+    Tests inject events (e.g. control requests) and inspect the operations
+    that were performed by the phy.
+    '''
+
+    MOCK_FD = 0x1337
+
+    def __init__(self):
+        self.events = Queue()
+        self.is_open = False
+        self.initialized = None
+        self.running = False
+        self.configured = False
+        self.vbus_power = None
+        self.ep0_out_data = b''
+        self.ep0_writes = []
+        self.ep0_reads = []
+        self.ep0_stalls = 0
+        self.enabled_eps = {}
+        self.ep_writes = []
+        self.ep_out_data = {}
+
+    def inject_event(self, event_type, data=b''):
+        self.events.put((event_type, data))
+
+    def inject_control(self, setup, data=b''):
+        '''
+        :param setup: 8 bytes of setup packet
+        :param data: data stage of OUT requests (default: '')
+        '''
+        self.ep0_out_data = data
+        self.inject_event(rg.USB_RAW_EVENT_CONTROL, setup)
+
+    def open(self, path):
+        self.is_open = True
+        return self.MOCK_FD
+
+    def close(self, fd):
+        self.is_open = False
+        self.events.put(None)
+        for queue in self.ep_out_data.values():
+            queue.put(None)
+
+    def ioctl(self, fd, request, arg=0):
+        if fd != self.MOCK_FD or not self.is_open:
+            raise OSError(9, 'Bad file descriptor')
+        handlers = {
+            rg.USB_RAW_IOCTL_INIT: self._init,
+            rg.USB_RAW_IOCTL_RUN: self._run,
+            rg.USB_RAW_IOCTL_EVENT_FETCH: self._event_fetch,
+            rg.USB_RAW_IOCTL_EP0_WRITE: self._ep0_write,
+            rg.USB_RAW_IOCTL_EP0_READ: self._ep0_read,
+            rg.USB_RAW_IOCTL_EP0_STALL: self._ep0_stall,
+            rg.USB_RAW_IOCTL_EP_ENABLE: self._ep_enable,
+            rg.USB_RAW_IOCTL_EP_WRITE: self._ep_write,
+            rg.USB_RAW_IOCTL_EP_READ: self._ep_read,
+            rg.USB_RAW_IOCTL_CONFIGURE: self._configure,
+            rg.USB_RAW_IOCTL_VBUS_DRAW: self._vbus_draw,
+        }
+        if request not in handlers:
+            raise OSError(22, 'Invalid argument')
+        return handlers[request](arg)
+
+    def _init(self, arg):
+        driver, device, speed = struct.unpack('128s128sB', bytes(arg))
+        self.initialized = (driver.rstrip(b'\x00'), device.rstrip(b'\x00'), speed)
+        return 0
+
+    def _run(self, arg):
+        self.running = True
+        self.inject_event(rg.USB_RAW_EVENT_CONNECT)
+        return 0
+
+    def _event_fetch(self, arg):
+        event = self.events.get()
+        if event is None:
+            raise OSError(108, 'Cannot send after transport endpoint shutdown')
+        event_type, data = event
+        max_length = struct.unpack('<I', bytes(arg[4:8]))[0]
+        data = data[:max_length]
+        arg[0:8] = struct.pack('<II', event_type, len(data))
+        arg[8:8 + len(data)] = data
+        return 0
+
+    def _ep_io(self, arg):
+        ep, flags, length = struct.unpack('<HHI', bytes(arg[:8]))
+        return ep, bytes(arg[8:8 + length])
+
+    def _ep0_write(self, arg):
+        _, data = self._ep_io(arg)
+        self.ep0_writes.append(data)
+        return len(data)
+
+    def _ep0_read(self, arg):
+        _, buff = self._ep_io(arg)
+        self.ep0_reads.append(len(buff))
+        data = self.ep0_out_data[:len(buff)]
+        self.ep0_out_data = b''
+        arg[8:8 + len(data)] = data
+        return len(data)
+
+    def _ep0_stall(self, arg):
+        self.ep0_stalls += 1
+        return 0
+
+    def _ep_enable(self, arg):
+        handle = len(self.enabled_eps)
+        self.enabled_eps[handle] = bytes(arg)
+        return handle
+
+    def _ep_write(self, arg):
+        handle, data = self._ep_io(arg)
+        self.ep_writes.append((handle, data))
+        return len(data)
+
+    def _ep_read(self, arg):
+        handle, _ = self._ep_io(arg)
+        queue = self.ep_out_data.setdefault(handle, Queue())
+        data = queue.get()
+        if data is None:
+            raise OSError(108, 'Cannot send after transport endpoint shutdown')
+        arg[8:8 + len(data)] = data
+        return len(data)
+
+    def _configure(self, arg):
+        self.configured = True
+        return 0
+
+    def _vbus_draw(self, arg):
+        self.vbus_power = arg
+        return 0
@@ -0,0 +1,58 @@
+import threading
+import time
+from umap2.fuzz.coordinator import CoordinatorClient
+
+
+class SimulatedWorker(threading.Thread):
+    '''
+    A fuzzing worker without a phy or a target host,
+    "runs" the tests it gets from the coordinator
+    '''
+
+    def __init__(self, address, name, fail_every=None, die_after=None, slow_tests=(), test_time=0.0,
+                 heartbeat_interval=0.02):
+        '''
+        :param address: address of the coordinator
+        :param name: worker name
+        :param fail_every: report a failure in every test that is divisible by this number (default: None)
+        :param die_after: stop responding (without releasing the lease) after this number of tests (default: None)
+        :param slow_tests: tests that take 10 times longer (e.g. the host is rebooting)
+        :param test_time: time of each test (default: 0.0)
+        :param heartbeat_interval: time between heartbeats during a test (default: 0.02)
+        '''
+        super(SimulatedWorker, self).__init__(name=name)
+        self.client = CoordinatorClient(address)
+        self.fail_every = fail_every
+        self.die_after = die_after
+        self.slow_tests = slow_tests
+        self.test_time = test_time
+        self.heartbeat_interval = heartbeat_interval
+        self.worker_id = None
+        self.completed = []
+        self.abandoned = None
+
+    def run(self):
+        self.worker_id = self.client.register(name=self.name, model_hash='model')
+        while True:
+            index = self.client.next_test(worker_id=self.worker_id)
+            if index is None:
+                break
+            if self.die_after is not None and len(self.completed) == self.die_after:
+                self.abandoned = index
+                break
+            self.run_test(index)
+            self.completed.append(index)
+        self.client.close()
+
+    def run_test(self, index):
+        end = time.time() + self.test_time * (10 if index in self.slow_tests else 1)
+        while time.time() < end:
+            time.sleep(self.heartbeat_interval)
+            self.client.heartbeat(worker_id=self.worker_id)
+        if self.fail_every and index % self.fail_every == 0:
+            self.client.report_failure(
+                worker_id=self.worker_id,
+                test=index,
+                report={'status': 'failed', 'reason': 'host crashed'},
+                mutations=[['device_descriptor', b'\x12\x01' + bytes(bytearray([index % 256]))]]
+            )
@@ -0,0 +1,99 @@
+'''
+Tests for the asyncio based physical interface
+'''
+
+import asyncio
+import struct
+import unittest
+from common import get_test_logger
+from infra_event_handler import EventHandler
+from infra_app import TestApp
+from umap2.phy.aphy import AsyncPhyInterface, PhyEvent
+
+
+class AsyncTestPhy(AsyncPhyInterface):
+    '''
+    Async phy that records the operations and stops when the events are consumed
+    '''
+
+    def __init__(self, app):
+        super(AsyncTestPhy, self).__init__(app, 'AsyncTestPhy')
+        self.ops = []
+
+    async def send_on_endpoint(self, ep_num, data):
+        self.ops.append(('send', ep_num, data))
+
+    async def stall_ep0(self):
+        self.ops.append(('stall',))
+
+    async def ack_status_stage(self):
+        self.ops.append(('ack',))
+
+    async def poll_buffers(self):
+        if not self.tasks:
+            self.stop = True
+
+
+class AsyncEchoDevice(object):
+    '''
+    Native async device: echoes OUT data after a delay, without blocking EP0
+    '''
+
+    name = 'AsyncEchoDevice'
+
+    def __init__(self, phy):
+        self.phy = phy
+
+    async def handle_request(self, buf):
+        await self.phy.send_on_endpoint(0, buf[:2])
+
+    async def handle_data_available(self, ep_num, data):
+        async def echo():
+            await asyncio.sleep(0.05)
+            await self.phy.send_on_endpoint(ep_num, data)
+        self.phy.spawn(echo())
+
+    async def handle_buffer_available(self, ep_num):
+        pass
+
+
+def setup_packet(request_type, request, value, index, length):
+    return struct.pack('<BBHHH', request_type, request, value, index, length)
+
+
+class AsyncPhyTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+        self.events = EventHandler()
+        self.app = TestApp(event_handler=self.events)
+        self.phy = AsyncTestPhy(self.app)
+
+    def testSyncDeviceAdapter(self):
+        device = self.app.load_device('keyboard', self.phy.sync_phy())
+        device.connect()
+        self.phy.put_event(PhyEvent(PhyEvent.setup, 0, setup_packet(0x80, 6, 0x0100, 0, 18)))
+        self.phy.put_event(PhyEvent(PhyEvent.setup, 0, setup_packet(0x00, 5, 0x0003, 0, 0)))
+        self.phy.put_event(PhyEvent(PhyEvent.setup, 0, setup_packet(0x80, 6, 0x0b00, 0, 0xff)))
+        device.run()
+        device.disconnect()
+        self.assertEqual(self.events.setup_packets, 3)
+        self.assertEqual(len(self.phy.ops), 3)
+        op, ep_num, desc = self.phy.ops[0]
+        self.assertEqual((op, ep_num), ('send', 0))
+        self.assertEqual(struct.unpack('<HH', desc[8:12]), (0x610b, 0x4653))
+        self.assertEqual(self.phy.ops[1], ('ack',))
+        self.assertEqual(self.phy.ops[2], ('stall',))
+
+    def testAsyncDevice(self):
+        self.phy.connect(AsyncEchoDevice(self.phy))
+        self.phy.put_event(PhyEvent(PhyEvent.data, 1, b'ping'))
+        self.phy.put_event(PhyEvent(PhyEvent.setup, 0, setup_packet(0x80, 6, 0x0100, 0, 18)))
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.phy.run())
+        finally:
+            loop.close()
+        # EP0 was serviced while the echo was still in progress
+        self.assertEqual(self.phy.ops, [('send', 0, b'\x80\x06'), ('send', 1, b'ping')])
@@ -0,0 +1,106 @@
+'''
+Tests for the helpers of the throughput benchmark
+'''
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from common import get_test_logger
+from umap2.fuzz.benchmark import FAMILY_DEVICES, PhaseTimer, percentile
+from umap2.fuzz.templates import get_template
+
+
+def can_build_templates():
+    try:
+        get_template('device_descriptor')
+    except Exception:
+        return False
+    return True
+
+
+class Triggers(object):
+
+    def trigger(self):
+        self.trigger_disconnect()
+        self.trigger_connect()
+
+    def trigger_disconnect(self):
+        pass
+
+    def trigger_connect(self):
+        pass
+
+
+class BenchmarkTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+
+    def testPercentile(self):
+        samples = [float(i) for i in range(100, 0, -1)]
+        self.assertEqual(percentile(samples, 50), 50.0)
+        self.assertEqual(percentile(samples, 99), 99.0)
+        self.assertEqual(percentile(samples[:1], 99), 100.0)
+        self.assertIsNone(percentile([], 50))
+
+    def testNestedCallsCountedOnce(self):
+        phases = PhaseTimer()
+        triggers = Triggers()
+        for name in ['trigger', 'trigger_connect', 'trigger_disconnect']:
+            phases.wrap(triggers, name, 'reconnect')
+        triggers.trigger()
+        triggers.trigger_disconnect()
+        self.assertEqual(phases.get_stats()['reconnect']['count'], 2)
+
+
+@unittest.skipUnless(can_build_templates(), 'the kitty templates cannot be built in this environment')
+class BenchmarkSmokeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def run_benchmark(self, args, timeout, to_file=True):
+        # the fuzzer sets signal handlers, so it has to run in the main thread of its process
+        output = os.path.join(self.workdir, 'results.json')
+        if to_file:
+            args = ['-o', output] + args
+        with open(os.devnull, 'w') as devnull:
+            proc = subprocess.Popen(
+                [sys.executable, '-m', 'umap2.fuzz.benchmark', '-n', '3'] + args,
+                stdout=subprocess.PIPE, stderr=devnull
+            )
+            timer = threading.Timer(timeout, proc.kill)
+            timer.start()
+            try:
+                stdout = proc.communicate()[0]
+            finally:
+                timer.cancel()
+        self.assertEqual(proc.returncode, 0, 'benchmark %s did not end' % (' '.join(args)))
+        if to_file:
+            with open(output) as f:
+                return json.load(f)['families']
+        return json.loads(stdout.decode('utf-8'))['families']
+
+    def testFamilies(self):
+        results = self.run_benchmark([], timeout=300)
+        self.assertEqual(sorted(results), sorted(FAMILY_DEVICES))
+        for family, result in results.items():
+            if 'skipped' not in result:
+                self.assertEqual(result['tests'], 3, family)
+
+    def testTransports(self):
+        # without -o, the results are the only output on stdout
+        for transport in ['rpc', 'binary', 'local']:
+            results = self.run_benchmark(['-f', 'enum', '-t', transport], timeout=60, to_file=False)
+            self.assertEqual(results['enum']['tests'], 3, transport)
@@ -0,0 +1,182 @@
+'''
+Tests for the control channel between the fuzzer and the stack
+'''
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from common import get_test_logger
+from umap2.apps.fuzz import Umap2FuzzApp
+from umap2.fuzz.channel import ControlChannelServer, ControlChannelClient, LocalChannelServer
+from umap2.fuzz.channel import CMD_CONNECT, CMD_DISCONNECT, CMD_STAGES
+from umap2.fuzz.prefetch import PrefetchingMutationClient
+
+
+class RecordingPhy(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def connect(self, dev):
+        self.calls.append('connect')
+
+    def disconnect(self):
+        self.calls.append('disconnect')
+
+
+class RecordingFuzzer(object):
+
+    def __init__(self):
+        self.stages = []
+
+    def get_mutation(self, stage, data):
+        self.stages.append(stage)
+        return None
+
+    def get_test_mutations(self):
+        return None
+
+
+class ControlChannelTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'control.sock')
+        self.server = ControlChannelServer(self.path, self.logger)
+        self.server.start()
+        self.client = ControlChannelClient(self.path)
+        self.assertTrue(self.client.connect())
+        self.wait_for(self.server.is_connected)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def wait_for(self, condition):
+        evt = threading.Event()
+        for _ in range(100):
+            if condition():
+                return
+            evt.wait(0.01)
+        self.fail('condition was not met')
+
+    def send_command_async(self, cmd, payload=''):
+        result = []
+        t = threading.Thread(target=lambda: result.append(self.server.send_command(cmd, timeout=2, payload=payload)))
+        t.start()
+        return t, result
+
+    def testCommandAck(self):
+        t, result = self.send_command_async(CMD_DISCONNECT)
+        self.assertEqual(self.client.recv(1), (CMD_DISCONNECT, ''))
+        self.client.ack(CMD_DISCONNECT)
+        t.join()
+        self.assertEqual(result, [True])
+
+    def testStackMessageHandler(self):
+        received = []
+        self.server.add_handler('event', received.append)
+        self.client.send('event', 'payload with spaces')
+        self.wait_for(lambda: received)
+        self.assertEqual(received, ['payload with spaces'])
+
+    def testFailingHandler(self):
+        received = []
+
+        def fail(payload):
+            raise Exception('handler failed')
+
+        self.server.add_handler('bad', fail)
+        self.server.add_handler('event', received.append)
+        self.client.send('bad', 'payload')
+        self.client.send('event', 'payload')
+        self.wait_for(lambda: received)
+        t, result = self.send_command_async(CMD_DISCONNECT)
+        self.assertEqual(self.client.recv(1), (CMD_DISCONNECT, ''))
+        self.client.ack(CMD_DISCONNECT)
+        t.join()
+        self.assertEqual(result, [True])
+        local = LocalChannelServer(self.logger)
+        local.start()
+        local.add_handler('bad', fail)
+        self.assertTrue(local.client.send('bad', 'payload'))
+
+    def testClientDetectsClose(self):
+        self.server.stop()
+        self.assertIsNone(self.client.recv(1))
+        self.wait_for(lambda: not self.client.is_connected())
+
+    def testFuzzAppReconnect(self):
+        app = Umap2FuzzApp(None)
+        app.channel = self.client
+        app.phy = RecordingPhy()
+        app.dev = None
+        self.assertFalse(app.check_connection_commands())
+        t, result = self.send_command_async(CMD_DISCONNECT)
+        self.wait_for(self.client.has_messages)
+        # the app blocks until the reconnect command
+        t2 = threading.Thread(target=lambda: result.append(app.check_connection_commands()))
+        t2.start()
+        t.join()
+        t, _ = self.send_command_async(CMD_CONNECT)
+        t.join()
+        t2.join()
+        app.watchdog.stop()
+        self.assertEqual(result, [True, True])
+        self.assertEqual(app.phy.calls, ['disconnect', 'connect'])
+
+    def testFuzzAppActiveStages(self):
+        app = Umap2FuzzApp(None)
+        app.channel = self.client
+        app.phy = RecordingPhy()
+        app.dev = None
+        app.fuzzer = PrefetchingMutationClient(RecordingFuzzer())
+        t, result = self.send_command_async(CMD_DISCONNECT)
+        self.wait_for(self.client.has_messages)
+        t2 = threading.Thread(target=app.check_connection_commands)
+        t2.start()
+        t.join()
+        # the stages are pushed while the device is disconnected
+        t, result = self.send_command_async(CMD_STAGES, '["Device_Descriptor"]')
+        t.join()
+        t, _ = self.send_command_async(CMD_CONNECT)
+        t.join()
+        t2.join()
+        app.watchdog.stop()
+        self.assertEqual(result, [True])
+        app.get_mutation('device_descriptor')
+        app.get_mutation('configuration_descriptor')
+        self.assertEqual(app.fuzzer.fuzzer.stages, ['device_descriptor'])
+        self.assertFalse(app.is_stage_active('configuration_descriptor'))
+
+    def testLocalChannel(self):
+        server = LocalChannelServer(self.logger)
+        server.start()
+        received = []
+        server.add_handler('event', received.append)
+        app = Umap2FuzzApp(None)
+        app.channel = server.client
+        app.phy = RecordingPhy()
+        app.dev = None
+        self.assertTrue(app.connect_channel())
+        acks = []
+        t = threading.Thread(target=lambda: acks.extend([
+            server.send_command(CMD_DISCONNECT, timeout=2),
+            server.send_command(CMD_CONNECT, timeout=2),
+        ]))
+        t.start()
+        self.wait_for(app.channel.has_messages)
+        self.assertTrue(app.check_connection_commands())
+        t.join()
+        app.watchdog.stop()
+        app.channel.send('event', 'payload')
+        self.assertEqual(acks, [True, True])
+        self.assertEqual(app.phy.calls, ['disconnect', 'connect'])
+        self.assertEqual(received, ['payload'])
+        server.stop()
+        self.assertFalse(app.channel.is_connected())
@@ -0,0 +1,75 @@
+'''
+Tests for the fuzzing session journal
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from common import get_test_logger
+from umap2.fuzz.checkpoint import SessionJournal
+from umap2.fuzz.fuzz_engine import get_fuzzer
+
+
+class SessionJournalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'session.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def start_session(self):
+        journal = SessionJournal(self.path)
+        journal.start_session('keyboard.stages', ['device_descriptor', 'configuration_descriptor'], '2', 'abcd')
+        return journal
+
+    def testResume(self):
+        journal = self.start_session()
+        self.assertEqual(journal.next_test(), 0)
+        journal.record_test(0, 'device_descriptor', False)
+        journal.record_test(1, 'device_descriptor', True, 'host is silent')
+        journal.record_test(2, 'configuration_descriptor', False)
+        # the machine crashed while writing the next test
+        with open(self.path, 'a') as f:
+            f.write('{"type": "test", "te')
+        resumed = SessionJournal(self.path)
+        self.assertTrue(resumed.is_resumed())
+        self.assertEqual(resumed.stages, ['device_descriptor', 'configuration_descriptor'])
+        self.assertEqual(resumed.next_test(), 3)
+        self.assertEqual(resumed.failures, [(1, 'device_descriptor', 'host is silent')])
+        self.assertEqual(resumed.stats['device_descriptor'], {'tests': 2, 'failures': 1})
+        resumed.start_session(resumed.stage_file, resumed.stages, resumed.count, 'abcd')
+        resumed.record_test(3, 'configuration_descriptor', False)
+        self.assertEqual(SessionJournal(self.path).tests, 4)
+
+    def testUnfinishedTest(self):
+        journal = self.start_session()
+        journal.start_test(0, 'device_descriptor')
+        journal.record_test(0, 'device_descriptor', False)
+        self.assertIsNone(journal.unfinished)
+        # the host crashed during the next test
+        journal.start_test(1, 'configuration_descriptor')
+        resumed = SessionJournal(self.path)
+        self.assertEqual(resumed.next_test(), 1)
+        self.assertEqual(resumed.unfinished[:2], (1, 'configuration_descriptor'))
+        resumed.record_test(1, 'configuration_descriptor', True, 'the session stopped during the test')
+        resumed = SessionJournal(self.path)
+        self.assertIsNone(resumed.unfinished)
+        self.assertEqual(resumed.next_test(), 2)
+        self.assertEqual(resumed.failures, [(1, 'configuration_descriptor', 'the session stopped during the test')])
+
+    def testModelMismatch(self):
+        self.start_session()
+        journal = SessionJournal(self.path)
+        self.assertRaises(Exception, journal.start_session, 'keyboard.stages', journal.stages, '2', 'other')
+
+    def testUnorderedFuzzers(self):
+        # the coordinated and feedback fuzzers do not run the tests in the order of the journal
+        for option, value in [('--coordinator', 'localhost:26010'), ('--feedback', True)]:
+            options = {'--journal': self.path, '--stage-file': 'keyboard.stages', option: value}
+            self.assertRaises(Exception, get_fuzzer, options)
+        self.assertFalse(os.path.exists(self.path))
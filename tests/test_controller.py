@@ -0,0 +1,108 @@
+'''
+Tests for the kitty controller of the Umap2 stack
+'''
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from common import get_test_logger
+from kitty.data.report import Report
+from umap2.fuzz.channel import ControlChannelClient, LocalChannelServer
+from umap2.fuzz.channel import CMD_CONNECT, CMD_DISCONNECT
+from umap2.fuzz.controller import UmapController
+from umap2.fuzz.feedback import CMD_SEQUENCE
+from umap2.fuzz.watchdog import CMD_SILENT
+
+
+class FakeStack(object):
+    '''
+    Stack side of the channel, reports a request sequence whenever an enumerated device is disconnected
+    '''
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.enumerations = 1
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            msg = self.channel.recv(None)
+            if msg is None:
+                return
+            cmd, _ = msg
+            if cmd == CMD_DISCONNECT and self.enumerations:
+                self.channel.send(CMD_SEQUENCE, json.dumps({'hash': 'seq%d' % self.enumerations, 'length': 1}))
+            elif cmd == CMD_CONNECT:
+                self.enumerations += 1
+            self.channel.ack(cmd)
+
+
+class UmapControllerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+        self.server = LocalChannelServer(self.logger)
+        self.controller = UmapController(channel=self.server)
+        self.controller.setup()
+        self.stack = FakeStack(self.server.client)
+
+    def tearDown(self):
+        self.controller.teardown()
+        self.stack.thread.join(1)
+
+    def testSequenceBeforeFirstTest(self):
+        sequences = []
+        self.controller.add_sequence_callback(lambda payload: sequences.append(json.loads(payload)['hash']))
+        # the device was enumerated before the first test, pre_test disconnects it before there is a report
+        self.controller.pre_test(0)
+        self.assertTrue(self.server.is_connected())
+        self.controller.trigger_connect()
+        self.controller.post_test()
+        self.assertEqual(sequences, ['seq2'])
+        self.assertEqual(self.controller.get_report().get('request sequence'), 'seq2')
+
+    def testSilentHost(self):
+        ends = []
+        self.controller.add_silent_callback(lambda: ends.append(True))
+        self.controller.pre_test(0)
+        # an idle host after the enumeration ends the wait for the mutation request
+        self.server.client.send(CMD_SILENT, json.dumps({'silent_for': 2.0, 'enumerated': True, 'mutated': False}))
+        self.assertEqual(ends, [True])
+        self.assertTrue(self.controller.is_victim_alive())
+        self.assertNotEqual(self.controller.get_report().get_status(), Report.FAILED)
+        # a host that stops in the middle of the enumeration hangs
+        self.server.client.send(CMD_SILENT, json.dumps({'silent_for': 2.0, 'enumerated': False, 'mutated': True}))
+        self.assertEqual(ends, [True, True])
+        self.assertFalse(self.controller.is_victim_alive())
+        self.assertEqual(self.controller.get_report().get_status(), Report.FAILED)
+
+    def testStackConnectsWhileWaitingForTriggerFile(self):
+        tmpdir = tempfile.mkdtemp()
+        controller = UmapController(control_socket=os.path.join(tmpdir, 'control.sock'))
+        controller.setup()
+        try:
+            t = threading.Thread(target=controller.trigger_disconnect)
+            t.start()
+            # the stack is not connected yet, the controller waits for it to remove the trigger file
+            path = os.path.join(controller.trigger_dir, controller.disconnect_file)
+            for _ in range(100):
+                if os.path.isfile(path):
+                    break
+                t.join(0.01)
+            client = ControlChannelClient(controller.channel.path)
+            self.assertTrue(client.connect())
+            stack = FakeStack(client)
+            t.join(5)
+            self.assertFalse(t.is_alive())
+            self.assertFalse(os.path.isfile(path))
+            client.close()
+            stack.thread.join(1)
+        finally:
+            controller.teardown()
+            shutil.rmtree(tmpdir)
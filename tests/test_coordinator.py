@@ -0,0 +1,99 @@
+'''
+Tests for the multi-worker fuzzing coordinator
+'''
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from common import get_test_logger
+from umap2.fuzz.coordinator import RangeScheduler, FuzzCoordinator, CoordinatorClient
+from umap2.fuzz.transport import BinaryFuzzerServer
+
+
+class RangeSchedulerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+
+    def run_worker(self, scheduler, worker, count):
+        return [scheduler.next_test(worker) for _ in range(count)]
+
+    def testPartition(self):
+        scheduler = RangeScheduler(0, 10, chunk_size=4)
+        self.assertEqual(self.run_worker(scheduler, 'a', 2), [0, 1])
+        self.assertEqual(self.run_worker(scheduler, 'b', 2), [4, 5])
+        self.assertEqual(self.run_worker(scheduler, 'a', 3), [2, 3, 8])
+        self.assertEqual(scheduler.remaining(), 3)
+
+    def testSteal(self):
+        scheduler = RangeScheduler(0, 10, chunk_size=10)
+        self.assertEqual(scheduler.next_test('a'), 0)
+        # a's host is slow, b takes the second half of a's lease
+        self.assertEqual(self.run_worker(scheduler, 'b', 5), [5, 6, 7, 8, 9])
+        self.assertEqual(self.run_worker(scheduler, 'b', 2), [3, 4])
+        self.assertEqual(self.run_worker(scheduler, 'a', 3), [1, 2, None])
+        self.assertEqual(scheduler.next_test('b'), None)
+        self.assertEqual(scheduler.completed, 10)
+
+    def testRelease(self):
+        scheduler = RangeScheduler(0, 10, chunk_size=5)
+        self.assertEqual(self.run_worker(scheduler, 'a', 3), [0, 1, 2])
+        # the current test of a was not completed
+        self.assertEqual(scheduler.release('a'), [2, 5])
+        self.assertEqual(self.run_worker(scheduler, 'b', 4), [2, 3, 4, 5])
+
+
+class FuzzCoordinatorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+        self.tmpdir = tempfile.mkdtemp()
+        self.address = 'unix:' + os.path.join(self.tmpdir, 'coordinator.sock')
+        self.coordinator = FuzzCoordinator(100, model_hash='hash', chunk_size=8, logger=self.logger)
+        self.server = BinaryFuzzerServer(self.address, self.coordinator, self.logger, threaded=True)
+        self.server.bind()
+        self.thread = threading.Thread(target=self.server.start)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.thread.join()
+        shutil.rmtree(self.tmpdir)
+
+    def testWorkersCoverAllTests(self):
+        results = {}
+
+        def worker(name):
+            client = CoordinatorClient(self.address)
+            worker_id = client.register(name=name, model_hash='hash')
+            tests = []
+            index = client.next_test(worker_id=worker_id)
+            while index is not None:
+                tests.append(index)
+                if index % 10 == 0:
+                    client.report_failure(worker_id=worker_id, test=index, report={'status': 'failed'})
+                index = client.next_test(worker_id=worker_id)
+            client.close()
+            results[name] = tests
+
+        threads = [threading.Thread(target=worker, args=('worker%d' % i,)) for i in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        tests = sum(results.values(), [])
+        self.assertEqual(sorted(tests), list(range(100)))
+        stats = self.coordinator.get_stats()
+        self.assertEqual(stats['failures'], 10)
+        self.assertEqual(stats['completed'], 100)
+        self.assertTrue(self.coordinator.is_done())
+
+    def testRejectOtherModel(self):
+        client = CoordinatorClient(self.address)
+        with self.assertRaises(Exception):
+            client.register(name='worker', model_hash='other')
+        client.close()
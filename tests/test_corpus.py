@@ -0,0 +1,49 @@
+'''
+Tests for the pre-rendered mutation corpus
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from common import get_test_logger
+from umap2.fuzz.corpus import CorpusWriter, MutationCorpus
+
+
+class MutationCorpusTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'mutations.corpus')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testReadWrite(self):
+        writer = CorpusWriter(self.path, 'abcd')
+        writer.add(0, ['device_descriptor'], b'\x12\x01\xff')
+        writer.add(1, ['device_descriptor', 'configuration_descriptor'], b'')
+        writer.add(2, ['device_descriptor', 'configuration_descriptor'], None)
+        writer.add(3, ['device_descriptor'], b'\x12' * 0x100)
+        self.assertRaises(Exception, writer.add, 5, ['device_descriptor'], b'')
+        writer.close()
+        corpus = MutationCorpus(self.path)
+        try:
+            self.assertEqual(corpus.num_tests, 4)
+            self.assertEqual(corpus.model_hash, 'abcd')
+            self.assertEqual(corpus.get(0), (['device_descriptor'], b'\x12\x01\xff'))
+            self.assertEqual(corpus.get_mutation(1, 'Configuration_Descriptor'), b'')
+            self.assertIsNone(corpus.get_mutation(1, 'device_descriptor'))
+            # dynamic tests are rendered by the fuzzer
+            self.assertEqual(corpus.get(2), (['device_descriptor', 'configuration_descriptor'], None))
+            self.assertEqual(corpus.get_mutation(3, 'device_descriptor'), b'\x12' * 0x100)
+            self.assertRaises(IndexError, corpus.get, 4)
+        finally:
+            corpus.close()
+
+    def testNotCorpus(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\x00' * 64)
+        self.assertRaises(Exception, MutationCorpus, self.path)
@@ -0,0 +1,67 @@
+'''
+Tests for the deduplication of tests by their effective payload
+'''
+
+import json
+import struct
+import unittest
+from common import get_test_logger
+from umap2.apps.fuzz import Umap2FuzzApp
+from umap2.core.usb_device import USBDeviceRequest
+from umap2.fuzz.channel import LocalChannelServer
+from umap2.fuzz.dedup import PayloadDeduplicator, CMD_LENGTHS
+
+
+class RequestDevice(object):
+
+    def __init__(self):
+        self.current_request = None
+
+
+class NullPhy(object):
+
+    def disconnect(self):
+        pass
+
+
+class PayloadDeduplicatorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+
+    def testTruncatedPayloads(self):
+        dedup = PayloadDeduplicator()
+        self.assertFalse(dedup.is_duplicate('device_descriptor', b'\x12\x01' + b'\x00' * 16 + b'\xaa'))
+        # until the length is known, the payloads are compared in full
+        self.assertFalse(dedup.is_duplicate('device_descriptor', b'\x12\x01' + b'\x00' * 16 + b'\xbb'))
+        dedup.update_lengths({'Device_Descriptor': 0x12})
+        dedup.update_lengths({'device_descriptor': 0x08})
+        # the bytes after the requested length are not sent
+        self.assertFalse(dedup.is_duplicate('device_descriptor', b'\x12\x01' + b'\x00' * 16 + b'\xcc'))
+        self.assertTrue(dedup.is_duplicate('device_descriptor', b'\x12\x01' + b'\x00' * 16 + b'\xdd\xdd'))
+        self.assertFalse(dedup.is_duplicate('device_descriptor', b'\x12\x02' + b'\x00' * 16))
+        # same payload of another stage
+        self.assertFalse(dedup.is_duplicate('string_descriptor', b'\x12\x02' + b'\x00' * 16))
+        self.assertEqual(dedup.skipped, 1)
+
+    def testStackReportsLengths(self):
+        server = LocalChannelServer(self.logger)
+        server.start()
+        received = []
+        server.add_handler(CMD_LENGTHS, received.append)
+        app = Umap2FuzzApp(None)
+        app.channel = server.client
+        app.phy = NullPhy()
+        app.dev = RequestDevice()
+        for length in [0x40, 0x12]:
+            app.dev.current_request = USBDeviceRequest(struct.pack('<BBHHH', 0x80, 6, 0x0100, 0, length))
+            app.get_mutation('device_descriptor')
+        # a request from the device to the host does not limit the response
+        app.dev.current_request = USBDeviceRequest(struct.pack('<BBHHH', 0x21, 9, 0x0200, 0, 1))
+        app.get_mutation('hid_report')
+        app.dev.current_request = None
+        app.get_mutation('scsi_inquiry_response')
+        app.disconnect_device()
+        self.assertEqual([json.loads(msg) for msg in received], [{'device_descriptor': 0x40}])
+        server.stop()
@@ -0,0 +1,100 @@
+'''
+Tests for distributed fuzzing: a coordinator and several simulated workers
+on localhost, over TCP
+'''
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from common import get_test_logger
+from infra_worker import SimulatedWorker
+from umap2.fuzz.coordinator import FuzzCoordinator, serve_coordinator
+from umap2.fuzz.transport import BinaryFuzzerServer
+
+
+class DistributedFuzzingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+        self.server = None
+
+    def tearDown(self):
+        if self.server:
+            self.server.stop()
+            self.thread.join()
+
+    def start_coordinator(self, num_tests, chunk_size=10, worker_timeout=30.0, session_file=None, target=None):
+        self.coordinator = FuzzCoordinator(
+            num_tests, model_hash='model', chunk_size=chunk_size, session_file=session_file, logger=self.logger,
+            worker_timeout=worker_timeout
+        )
+        self.server = BinaryFuzzerServer('127.0.0.1:0', self.coordinator, self.logger, threaded=True)
+        self.server.bind()
+        self.address = '127.0.0.1:%d' % (self.server.sock.getsockname()[1])
+        self.thread = threading.Thread(target=target or self.server.start)
+        self.thread.start()
+
+    def run_workers(self, workers):
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(10)
+            self.assertFalse(worker.is_alive())
+
+    def testWorkersUploadFailures(self):
+        self.start_coordinator(60)
+        workers = [SimulatedWorker(self.address, 'worker%d' % i, fail_every=7) for i in range(3)]
+        self.run_workers(workers)
+        completed = sum((worker.completed for worker in workers), [])
+        self.assertEqual(sorted(completed), list(range(60)))
+        failures = self.coordinator.get_failures()
+        self.assertEqual(sorted(failures.keys()), list(range(0, 60, 7)))
+        self.assertEqual(failures[14]['mutations'], [('device_descriptor', b'\x12\x01\x0e')])
+        self.assertEqual(failures[14]['report']['reason'], 'host crashed')
+        self.assertTrue(self.coordinator.is_done())
+
+    def testDeadWorkerTestsAreReleased(self):
+        self.start_coordinator(40, worker_timeout=0.2)
+        dead = SimulatedWorker(self.address, 'dead', die_after=3)
+        self.run_workers([dead])
+        self.assertEqual(dead.completed, [0, 1, 2])
+        workers = [SimulatedWorker(self.address, 'worker%d' % i, test_time=0.01) for i in range(2)]
+        self.run_workers(workers)
+        completed = sum((worker.completed for worker in workers), [])
+        # the test the dead worker abandoned, and the rest of its lease, are run by the others
+        self.assertIn(dead.abandoned, completed)
+        self.assertEqual(sorted(completed + dead.completed), list(range(40)))
+        stats = self.coordinator.get_stats()
+        self.assertFalse(stats['workers'][0]['alive'])
+        self.assertTrue(self.coordinator.is_done())
+
+    def testHeartbeatKeepsLease(self):
+        self.start_coordinator(20, chunk_size=5, worker_timeout=0.2)
+        # test 0 takes longer than the worker timeout
+        workers = [SimulatedWorker(self.address, 'worker%d' % i, slow_tests=[0], test_time=0.05) for i in range(2)]
+        self.run_workers(workers)
+        completed = sum((worker.completed for worker in workers), [])
+        # no test was re-leased
+        self.assertEqual(sorted(completed), list(range(20)))
+        self.assertTrue(all(worker['alive'] for worker in self.coordinator.get_stats()['workers'].values()))
+
+    def testCoordinatorStopsWhenDone(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            self.start_coordinator(
+                30, session_file=os.path.join(tmpdir, 'session.db'),
+                target=lambda: serve_coordinator(self.coordinator, self.server, poll_interval=0.01)
+            )
+            workers = [SimulatedWorker(self.address, 'worker%d' % i) for i in range(2)]
+            self.run_workers(workers)
+            # the coordinator stops serving, and closes the session file, when all the tests are done
+            self.thread.join(5)
+            self.assertFalse(self.thread.is_alive())
+            self.assertIsNone(self.server.sock)
+            self.assertIsNone(self.coordinator.dataman)
+            self.assertEqual(self.coordinator.get_stats()['completed'], 30)
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,79 @@
+'''
+Tests for the host behavior feedback
+'''
+
+import unittest
+from common import get_test_logger
+from umap2.core.usb_device import USBDeviceRequest
+from umap2.fuzz.feedback import RequestSequence, FeedbackScheduler
+
+
+def get_request(request_type, request, value, index=0, length=0x40):
+    return USBDeviceRequest(bytes(bytearray([
+        request_type, request, value & 0xff, value >> 8, index & 0xff, index >> 8, length & 0xff, length >> 8
+    ])))
+
+
+class RequestSequenceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+
+    def get_digest(self, requests):
+        sequence = RequestSequence()
+        for req in requests:
+            if isinstance(req, int):
+                sequence.add_data(req)
+            else:
+                sequence.add_request(req)
+        return sequence.digest()
+
+    def testIgnoresLengthAndRetries(self):
+        device = get_request(0x80, 6, 0x0100, length=0x40)
+        config = get_request(0x80, 6, 0x0200, length=9)
+        base = self.get_digest([device, config])
+        self.assertEqual(base, self.get_digest([device, device, get_request(0x80, 6, 0x0200, length=0x20)]))
+        self.assertNotEqual(base, self.get_digest([device, config, get_request(0x00, 9, 1)]))
+        self.assertNotEqual(base, self.get_digest([device, config, 1]))
+
+
+class FeedbackSchedulerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+
+    def run_tests(self, scheduler, count, sequence_of=lambda test: 'same'):
+        tests = []
+        for _ in range(count):
+            test = scheduler.next_test()
+            if test is None:
+                break
+            tests.append(test)
+            scheduler.report(test, sequence_of(test))
+        return tests
+
+    def testProbeAllFields(self):
+        # the first sequence is new, the first field is hot until its next test
+        scheduler = FeedbackScheduler([[0, 10], [10, 20], [20, 30]], probe_size=2, patience=1)
+        self.assertEqual(self.run_tests(scheduler, 6), [0, 1, 10, 11, 20, 21])
+        self.assertEqual(len(self.run_tests(scheduler, 100)), 24)
+        self.assertEqual(scheduler.next_test(), None)
+
+    def testNovelFieldFirst(self):
+        # only the mutations of the second field change the host behavior
+        scheduler = FeedbackScheduler([[0, 10], [10, 20], [20, 30]], probe_size=2, patience=3)
+        sequence_of = lambda test: 'seq-%d' % test if 10 <= test < 20 else 'same'
+        tests = self.run_tests(scheduler, 14, sequence_of)
+        self.assertEqual(tests[:5], [0, 1, 2, 3, 10])
+        # once the field produces a new sequence, its tests run before the probes of the other fields
+        self.assertEqual(tests[5:14], list(range(11, 20)))
+        self.assertEqual(len(scheduler.coverage), 11)
+
+    def testHotFieldCoolsDown(self):
+        scheduler = FeedbackScheduler([[0, 10], [10, 20]], probe_size=1, patience=2)
+        sequence_of = lambda test: 'b' if test == 1 else 'a'
+        tests = self.run_tests(scheduler, 5, sequence_of)
+        # tests 0 and 1 are new, then two known sequences in a row
+        self.assertEqual(tests, [0, 1, 2, 3, 10])
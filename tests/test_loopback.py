@@ -0,0 +1,85 @@
+'''
+Tests for the loopback physical layer and the simulated host
+'''
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from common import get_test_logger
+from infra_event_handler import EventHandler
+from infra_app import TestApp
+from umap2.phy.loopback.host import SimulatedHost, HidDriver, default_drivers
+from umap2.phy.loopback.loopback_phy import LoopbackPhy
+from umap2.core.usb_class import USBClass
+from umap2.dev.mass_storage import USBMassStorageDevice
+
+
+class LoopbackPhyTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+        self.events = EventHandler()
+        self.app = TestApp(event_handler=self.events)
+        drivers = default_drivers()
+        drivers[USBClass.HID] = HidDriver(polls=1)
+        self.host = SimulatedHost(drivers=drivers)
+        self.phy = LoopbackPhy(self.app, host=self.host, exit_when_done=True)
+        self.device = None
+
+    def tearDown(self):
+        if self.device:
+            self.device.disconnect()
+
+    def run_device(self, device):
+        self.device = device
+        self.device.connect()
+        self.device.run()
+
+    def testKeyboardEnumeration(self):
+        self.run_device(self.app.load_device('keyboard', self.phy))
+        self.assertEqual(self.phy.sessions, 1)
+        self.assertTrue(self.host.configured)
+        self.assertEqual(len(self.host.device_descriptor), 18)
+        self.assertEqual(struct.unpack('<HH', self.host.device_descriptor[8:12]), (0x610b, 0x4653))
+        self.assertEqual(self.device.address, self.host.address)
+        self.assertEqual([i.interface_class for i in self.host.interfaces], [USBClass.HID])
+        self.assertTrue(self.host.results['hid_report_descriptor'])
+        self.assertTrue(self.host.strings)
+        self.assertGreater(self.events.setup_packets, 0)
+        self.assertEqual(self.host.stats['control'], self.events.setup_packets)
+
+    def testSmartcardCommands(self):
+        self.run_device(self.app.load_device('smartcard', self.phy))
+        self.assertTrue(self.host.configured)
+        status = self.host.results['ccid_get_slot_status']
+        self.assertTrue(status)
+        # RDR_to_PC_SlotStatus
+        self.assertEqual(status[0:1], b'\x81')
+        atr = self.host.results['ccid_icc_power_on']
+        # RDR_to_PC_DataBlock
+        self.assertEqual(atr[0:1], b'\x80')
+
+    def testMassStorageRead(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            image = os.path.join(tmpdir, 'disk.img')
+            with open(image, 'wb') as f:
+                f.write(b'\xaa' * 0x200 + b'\x00' * 0x200 * 7)
+            self.run_device(USBMassStorageDevice(self.app, self.phy, disk_image_filename=image))
+            self.device.disconnect()
+            self.device = None
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(self.host.results['msc_max_lun'], b'\x00')
+        inquiry, status = self.host.results['scsi_inquiry']
+        self.assertEqual(status, 0)
+        self.assertEqual(len(inquiry), 36)
+        capacity, status = self.host.results['scsi_read_capacity_10']
+        self.assertEqual(status, 0)
+        self.assertEqual(struct.unpack('>II', capacity), (7, 0x200))
+        data, status = self.host.results['scsi_read_10']
+        self.assertEqual(status, 0)
+        self.assertEqual(data, b'\xaa' * 0x200)
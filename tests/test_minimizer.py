@@ -0,0 +1,109 @@
+'''
+Tests for the failure minimizer
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from kitty.data.report import Report
+from common import get_test_logger
+from umap2.fuzz.minimizer import ddmin, get_byte_changes, apply_byte_changes, Reproducer, Minimizer
+
+
+class HostController(object):
+    '''
+    Controller of a simulated host, that fails when crash() returns True
+    for the mutations that the stack serves, and reports silence after the requests if silent
+    '''
+
+    def __init__(self, logger, stages, crash, silent=False):
+        self.logger = logger
+        self.stages = stages
+        self.crash = crash
+        self.silent = silent
+        self.minimizer = None
+        self.report = None
+
+    def pre_test(self, test_number):
+        self.report = Report('controller')
+
+    def trigger(self):
+        mutations = dict((stage, self.minimizer.get_mutation(stage)) for stage in self.stages)
+        if self.crash(mutations):
+            self.report.failed('host crashed')
+        if self.silent:
+            self.minimizer.signal_mutated()
+
+    def post_test(self):
+        pass
+
+    def get_report(self):
+        return self.report
+
+
+class MinimizerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+
+    def testDdmin(self):
+        fails = lambda items: 3 in items and 7 in items
+        self.assertEqual(ddmin(list(range(10)), fails), [3, 7])
+        self.assertEqual(ddmin([5], fails), [5])
+
+    def testByteChanges(self):
+        default = b'\x12\x01\x00\x02'
+        payload = b'\xff\x01\x00\x03\x00\x00'
+        changes = get_byte_changes(default, payload)
+        self.assertEqual(changes, [0, 3, 'length'])
+        self.assertEqual(apply_byte_changes(default, payload, changes), payload)
+        self.assertEqual(apply_byte_changes(default, payload, [3]), b'\x12\x01\x00\x03')
+        self.assertEqual(apply_byte_changes(default, payload, ['length']), b'\x12\x01\x00\x02\x00\x00')
+        self.assertEqual(apply_byte_changes(default, b'\x12', ['length']), b'\x12')
+
+    def testMinimize(self):
+        defaults = {'device_descriptor': b'\x12\x01\x00\x02\x00\x00\x00\x40'}
+        reproducer = Reproducer([
+            ('device_descriptor', b'\x12\x01\xff\x02\x00\xee\x00\x40'),
+            ('string_descriptor', b'\x04\x03\x09\x04'),
+        ], test=17)
+
+        # the host crashes on the third byte of the device descriptor
+        def crash(mutations):
+            payload = mutations['device_descriptor']
+            return payload is not None and payload[2:3] == b'\xff'
+        controller = HostController(self.logger, ['device_descriptor', 'string_descriptor'], crash)
+        minimizer = Minimizer(controller, reproducer, defaults=defaults, test_time=0)
+        controller.minimizer = minimizer
+        result = minimizer.minimize()
+        self.assertEqual(result.mutations, [('device_descriptor', b'\x12\x01\xff\x02\x00\x00\x00\x40')])
+        self.assertEqual(result.test, 17)
+        # the minimal reproducer is replayed by the stack
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'crash.json')
+            result.save(path)
+            loaded = Reproducer.load(path)
+            self.assertEqual(loaded.get_mutation('device_descriptor'), result.mutations[0][1])
+            self.assertIsNone(loaded.get_mutation('string_descriptor'))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testNotReproducing(self):
+        controller = HostController(self.logger, ['device_descriptor'], lambda mutations: False)
+        minimizer = Minimizer(controller, Reproducer([('device_descriptor', b'\x00')]), test_time=0)
+        controller.minimizer = minimizer
+        self.assertRaises(Exception, minimizer.minimize)
+
+    def testMutationNotRequested(self):
+        # the host hangs before it requests the mutated stage, kitty reports "trigger timed out"
+        controller = HostController(self.logger, ['device_descriptor'], lambda mutations: False)
+        reproducer = Reproducer([('configuration_descriptor', b'\x09\x02')], test=5)
+        minimizer = Minimizer(controller, reproducer, test_time=0, mutation_timeout=0.01)
+        controller.minimizer = minimizer
+        self.assertEqual(minimizer.minimize().mutations, reproducer.mutations)
+        # an idle host ends the wait for the mutation request, without failing the test
+        controller.silent = True
+        self.assertFalse(minimizer.run_test(reproducer.mutations))
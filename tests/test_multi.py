@@ -0,0 +1,45 @@
+'''
+Tests for the multi-device runtime
+'''
+
+import logging
+import unittest
+from common import get_test_logger
+from umap2.apps.multi import Umap2MultiApp
+from umap2.utils.ulogger import set_default_handler_level
+
+
+class MultiAppTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+        self.app = Umap2MultiApp()
+        set_default_handler_level(logging.ERROR)
+
+    def testRunMultipleDevices(self):
+        keyboard = self.app.add_device('loopback:once', 'keyboard')
+        smartcard = self.app.add_device('loopback:once', 'smartcard')
+        self.app.run()
+        self.assertFalse(keyboard.is_alive())
+        self.assertFalse(smartcard.is_alive())
+        self.assertTrue(keyboard.phy.host.configured)
+        self.assertTrue(smartcard.phy.host.configured)
+        self.assertIsNot(keyboard.dev.app, smartcard.dev.app)
+        stats = self.app.get_stats()
+        self.assertEqual(stats['devices'], 2)
+        self.assertEqual(stats['running'], 0)
+        self.assertEqual(stats['errors'], 0)
+        self.assertEqual(
+            stats['setup_packets'],
+            keyboard.phy.host.stats['control'] + smartcard.phy.host.stats['control']
+        )
+        self.assertTrue(stats['per_device'][smartcard.name]['supported'])
+
+    def testTimeout(self):
+        self.app.timeout = 0.2
+        ctx = self.app.add_device('loopback', 'keyboard')
+        self.app.run()
+        self.assertFalse(ctx.is_alive())
+        self.assertEqual(ctx.phy.sessions, 1)
+        self.assertIsNone(ctx.stats['error'])
@@ -0,0 +1,94 @@
+'''
+Tests for the prefetching mutation client
+'''
+
+import time
+import unittest
+from common import get_test_logger
+from umap2.apps.fuzz import Umap2FuzzApp
+from umap2.fuzz.prefetch import PrefetchingMutationClient
+
+
+class FakeFuzzer(object):
+
+    def __init__(self, test_mutations):
+        self.test_mutations = test_mutations
+        self.calls = []
+        self.reported = []
+        self.report_time = 0
+
+    def get_test_mutations(self):
+        self.calls.append('get_test_mutations')
+        if isinstance(self.test_mutations, Exception):
+            raise self.test_mutations
+        return self.test_mutations
+
+    def get_mutation(self, stage, data):
+        self.calls.append(stage)
+        return b'rpc'
+
+    def report_mutation(self, stage, test):
+        time.sleep(self.report_time)
+        self.reported.append((stage, test))
+
+
+class PrefetchingMutationClientTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+
+    def get_client(self, test_mutations):
+        self.fuzzer = FakeFuzzer(test_mutations)
+        return PrefetchingMutationClient(self.fuzzer, self.logger)
+
+    def testServedFromMemory(self):
+        client = self.get_client({
+            'test': 7,
+            'stages': ['device_descriptor', 'configuration_descriptor'],
+            'mutations': {'configuration_descriptor': b'mutated'},
+        })
+        self.assertTrue(client.prefetch())
+        # the mutated stage is only fuzzed after the stages that lead to it
+        self.assertIsNone(client.get_mutation('configuration_descriptor'))
+        self.assertIsNone(client.get_mutation('device_descriptor'))
+        self.assertEqual(client.get_mutation('configuration_descriptor'), b'mutated')
+        self.assertEqual(client.get_mutation('configuration_descriptor'), b'mutated')
+        client.stop()
+        self.assertEqual(self.fuzzer.calls, ['get_test_mutations'])
+        self.assertEqual(self.fuzzer.reported, [('configuration_descriptor', 7)] * 2)
+
+    def testSessionDataMutationUsesRpc(self):
+        client = self.get_client({'test': 1, 'stages': ['scsi_inquiry_response'], 'mutations': None})
+        self.assertFalse(client.prefetch())
+        self.assertEqual(client.get_mutation('scsi_inquiry_response', {'tag': b'1'}), b'rpc')
+        self.assertEqual(self.fuzzer.calls, ['get_test_mutations', 'scsi_inquiry_response'])
+
+    def testServerWithoutBatchedApi(self):
+        client = self.get_client(Exception('method not found'))
+        self.assertFalse(client.prefetch())
+        self.assertFalse(client.prefetch())
+        self.assertEqual(client.get_mutation('device_descriptor'), b'rpc')
+        self.assertEqual(self.fuzzer.calls, ['get_test_mutations', 'device_descriptor'])
+
+    def testAppSendsPendingReports(self):
+        client = self.get_client({
+            'test': 3,
+            'stages': ['device_descriptor'],
+            'mutations': {'device_descriptor': b'm'},
+        })
+        self.fuzzer.report_time = 0.1
+        self.assertTrue(client.prefetch())
+        client.get_mutation('device_descriptor')
+        client.get_mutation('device_descriptor')
+
+        def fail(phy_string):
+            raise Exception('the stack stopped')
+
+        app = Umap2FuzzApp(None)
+        app.get_fuzzer = lambda: client
+        app.load_phy = fail
+        self.assertRaises(Exception, app.run)
+        # the reports of the last test are sent when the stack exits
+        self.assertIsNone(client.thread)
+        self.assertEqual(self.fuzzer.reported, [('device_descriptor', 3)] * 2)
@@ -0,0 +1,103 @@
+'''
+Tests for the raw gadget physical layer
+'''
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from common import get_test_logger
+from infra_event_handler import EventHandler
+from infra_app import TestApp
+from infra_rawgadget import MockRawGadgetLayer
+from umap2.phy.rawgadget.raw_gadget import RawGadget, USB_SPEED_FULL
+from umap2.phy.rawgadget.rawgadget_phy import RawGadgetPhy, find_udc_device
+
+
+def setup_packet(request_type, request, value, index, length):
+    return struct.pack('<BBHHH', request_type, request, value, index, length)
+
+
+class RawGadgetPhyTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+        self.events = EventHandler()
+        self.app = TestApp(event_handler=self.events)
+        self.layer = MockRawGadgetLayer()
+        self.phy = RawGadgetPhy(self.app, raw_gadget=RawGadget(ioctl_layer=self.layer))
+        self.device = self.app.load_device('keyboard', self.phy)
+        self.device.connect()
+        self.handle_next_event()  # CONNECT
+
+    def tearDown(self):
+        self.device.disconnect()
+
+    def handle_next_event(self):
+        event = self.phy.event_thread.events.get(True, 1)
+        self.phy._handle_event(event)
+        return event
+
+    def control(self, setup, data=b''):
+        self.layer.inject_control(setup, data)
+        self.handle_next_event()
+
+    def testInit(self):
+        self.assertTrue(self.layer.running)
+        self.assertEqual(self.layer.initialized, (b'dummy_udc', b'dummy_udc.0', USB_SPEED_FULL))
+
+    def testGetDeviceDescriptor(self):
+        self.control(setup_packet(0x80, 6, 0x0100, 0, 18))
+        self.assertEqual(self.events.setup_packets, 1)
+        self.assertEqual(len(self.layer.ep0_writes), 1)
+        desc = self.layer.ep0_writes[0]
+        self.assertEqual(len(desc), 18)
+        self.assertEqual(struct.unpack('<HH', desc[8:12]), (0x610b, 0x4653))
+
+    def testUnsupportedDescriptorStalls(self):
+        self.control(setup_packet(0x80, 6, 0x0b00, 0, 0xff))
+        self.assertEqual(self.layer.ep0_writes, [])
+        self.assertEqual(self.layer.ep0_stalls, 1)
+
+    def testSetAddressAcknowledged(self):
+        self.control(setup_packet(0x00, 5, 0x0003, 0, 0))
+        self.assertEqual(self.layer.ep0_reads, [0])
+        self.assertEqual(self.layer.ep0_stalls, 0)
+
+    def testSetConfigurationEnablesEndpoints(self):
+        self.control(setup_packet(0x00, 9, 0x0001, 0, 0))
+        self.assertTrue(self.layer.configured)
+        self.assertEqual(self.layer.vbus_power, 0x32 * 2)
+        self.assertEqual(len(self.layer.enabled_eps), 1)
+        desc = self.layer.enabled_eps[0]
+        self.assertEqual(len(desc), 9)
+        self.assertEqual(desc[2:3], b'\x82')
+        self.assertEqual(self.layer.ep0_reads, [0])
+        self.assertEqual(list(self.phy.ep_threads.keys()), [0x82])
+
+    def testOutRequestDataStage(self):
+        self.control(setup_packet(0x00, 9, 0x0001, 0, 0))
+        self.control(setup_packet(0x21, 0x09, 0x0200, 0, 1), b'\x01')
+        self.assertEqual(self.layer.ep0_reads, [0, 1])
+        self.assertEqual(self.layer.ep0_writes, [])
+        self.assertEqual(self.layer.ep0_stalls, 0)
+
+
+class FindUdcDeviceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+        self.udc_dir = tempfile.mkdtemp()
+        for name in ['dummy_udc.0', '20980000.usb']:
+            os.mkdir(os.path.join(self.udc_dir, name))
+
+    def tearDown(self):
+        shutil.rmtree(self.udc_dir)
+
+    def testFindDevice(self):
+        self.assertEqual(find_udc_device('dummy_udc', self.udc_dir), 'dummy_udc.0')
+        self.assertEqual(find_udc_device('20980000.usb', self.udc_dir), '20980000.usb')
+        self.assertRaises(Exception, find_udc_device, 'fe980000.usb', self.udc_dir)
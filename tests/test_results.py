@@ -0,0 +1,57 @@
+'''
+Tests for the fuzz results store
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from common import get_test_logger
+from umap2.fuzz.minimizer import Reproducer
+from umap2.fuzz.results import ResultStore, export_reproducers, mutation_hash
+
+
+class ResultStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'results.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testBatchedWrites(self):
+        store = ResultStore(self.path, batch_size=2, flush_interval=60)
+        self.assertRaises(Exception, store.add_test, 0, 'device_descriptor', b'\x12', 0.0, 0.1, None, False)
+        store.start_campaign('keyboard', 'keyboard.stages', 'abcd')
+        store.add_test(0, 'device_descriptor', b'\x12\x01', 0.0, 0.1, None, False)
+        reader = ResultStore(self.path)
+        self.assertEqual(len(reader.get_tests()), 0)
+        sequence = {'hash': '0123456789abcdef', 'length': 1, 'events': [['setup', 0x80, 6, 0x100, 0]]}
+        store.add_test(1, 'device_descriptor', b'\x12\x02', 0.1, 0.1, sequence, True, 'host is silent')
+        self.assertEqual([row['test'] for row in reader.get_tests()], [0, 1])
+        store.add_test(2, 'configuration_descriptor', None, 0.2, 0.1, None, False)
+        store.close()
+        self.assertEqual(len(reader.get_tests()), 3)
+        self.assertEqual(reader.get_tests(mutation=mutation_hash(b'\x12\x02'))[0]['sequence_hash'], '0123456789abcdef')
+        self.assertEqual([tuple(row) for row in reader.group_by('stage')], [
+            ('device_descriptor', 2, 1), ('configuration_descriptor', 1, 0)
+        ])
+        campaign = reader.get_campaigns()[0]
+        self.assertEqual((campaign['name'], campaign['tests'], campaign['failures']), ('keyboard', 3, 1))
+        reader.close()
+
+    def testExportReproducers(self):
+        store = ResultStore(self.path)
+        for name in ['first', 'second']:
+            store.start_campaign(name, '%s.stages' % name, 'abcd')
+            store.add_test(5, 'device_descriptor', b'\x12\x01', 0.0, 0.1, None, True, 'crash')
+            store.add_test(6, 'device_descriptor', b'\x12\x02', 0.0, 0.1, None, False)
+        store.flush()
+        paths = export_reproducers(store, self.tmpdir, campaigns=['2'])
+        self.assertEqual([os.path.basename(path) for path in paths], ['campaign2-test5.json'])
+        reproducer = Reproducer.load(paths[0])
+        self.assertEqual((reproducer.test, reproducer.mutations), (5, [('device_descriptor', b'\x12\x01')]))
+        store.close()
@@ -0,0 +1,52 @@
+'''
+Tests for the stage file writer and loader
+'''
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from common import get_test_logger
+from umap2.core.usb_device import USBDeviceRequest
+from umap2.fuzz.helpers import StageLogger, StageTrace
+
+
+class StageLoggerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'device.stages')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testWriteAndLoad(self):
+        stage_logger = StageLogger(self.filename)
+        stage_logger.start()
+        request = USBDeviceRequest(struct.pack('<BBHHH', 0x80, 6, 0x0200, 0, 0xff))
+        stage_logger.log_stage('device_descriptor', USBDeviceRequest(struct.pack('<BBHHH', 0x80, 6, 0x0100, 0, 0x12)))
+        # the interface descriptor is handled inside the configuration descriptor
+        configuration = stage_logger.begin_stage('configuration_descriptor', request)
+        stage_logger.log_stage('interface_descriptor')
+        stage_logger.end_stage(configuration)
+        stage_logger.log_stage('device_descriptor')
+        stage_logger.stop()
+        trace = StageTrace(self.filename)
+        self.assertEqual(trace.stages, ['device_descriptor', 'configuration_descriptor', 'interface_descriptor', 'device_descriptor'])
+        self.assertEqual(list(trace.get_counts().items()), [
+            ('device_descriptor', 2), ('configuration_descriptor', 1), ('interface_descriptor', 1)
+        ])
+        stats = trace.stats['configuration_descriptor']
+        self.assertEqual(stats.first, 1)
+        self.assertGreaterEqual(stats.mean_latency(), trace.stats['interface_descriptor'].max_latency)
+
+    def testLoadPlainStageFile(self):
+        with open(self.filename, 'w') as f:
+            f.write('device_descriptor\nconfiguration_descriptor\ndevice_descriptor\n')
+        trace = StageTrace(self.filename)
+        self.assertEqual(trace.stages, ['device_descriptor', 'configuration_descriptor', 'device_descriptor'])
+        self.assertEqual(trace.get_counts(), {'device_descriptor': 2, 'configuration_descriptor': 1})
+        self.assertIsNone(trace.stats['device_descriptor'].mean_latency())
@@ -0,0 +1,102 @@
+'''
+Tests for the pcap tap
+'''
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from common import get_test_logger
+from infra_event_handler import EventHandler
+from infra_app import TestApp
+from umap2.phy.loopback.loopback_phy import LoopbackPhy
+from umap2.phy.tap import PcapTap, PCAP_HEADER, PCAP_RECORD_HEADER, USBMON_HEADER
+from umap2.phy.tap import LINKTYPE_USB_LINUX_MMAPPED, XFER_BULK, XFER_CONTROL, STATUS_EPIPE
+
+
+def read_pcap(filename):
+    with open(filename, 'rb') as f:
+        buff = f.read()
+    header = PCAP_HEADER.unpack_from(buff, 0)
+    offset = PCAP_HEADER.size
+    packets = []
+    while offset < len(buff):
+        _, _, caplen, _ = PCAP_RECORD_HEADER.unpack_from(buff, offset)
+        offset += PCAP_RECORD_HEADER.size
+        usbmon = USBMON_HEADER.unpack_from(buff, offset)
+        data = buff[offset + USBMON_HEADER.size:offset + caplen]
+        packets.append((usbmon, data))
+        offset += caplen
+    return header, packets
+
+
+class PcapTapTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+        self.app = TestApp(event_handler=EventHandler())
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'capture.pcap')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testCaptureSession(self):
+        tap = PcapTap(self.filename)
+        phy = LoopbackPhy(self.app, exit_when_done=True)
+        phy.set_tap(tap)
+        device = self.app.load_device('keyboard', phy)
+        device.connect()
+        device.run()
+        device.disconnect()
+        tap.close()
+        header, packets = read_pcap(self.filename)
+        self.assertEqual(header[0], 0xa1b2c3d4)
+        self.assertEqual(header[-1], LINKTYPE_USB_LINUX_MMAPPED)
+        self.assertEqual(tap.dropped, 0)
+        setups = [p for p in packets if p[0][1] == b'S' and p[0][2] == XFER_CONTROL]
+        self.assertEqual(len(setups), phy.host.stats['control'])
+        # first transaction is GET_DESCRIPTOR(device)
+        (submit, _), (complete, data) = packets[:2]
+        self.assertEqual(submit[13], b'\x80\x06\x00\x01\x00\x00\x40\x00')
+        self.assertEqual(complete[1], b'C')
+        self.assertEqual(complete[3], 0x80)
+        self.assertEqual(complete[0], submit[0])
+        self.assertEqual(data, phy.host.device_descriptor)
+
+    def testRingBufferWrapAndDrop(self):
+        record_size = PCAP_RECORD_HEADER.size + USBMON_HEADER.size
+        tap = PcapTap(self.filename, buffer_size=record_size * 3 + 10)
+        # stop the writer thread, so we control when the buffer is flushed
+        tap.stop_event.set()
+        tap.flush_event.set()
+        tap.thread.join()
+        for i in range(5):
+            tap.stall(i)
+        self.assertEqual(tap.dropped, 2)
+        tap.flush()
+        for i in range(3):
+            tap.ack(5 + i)
+        tap.close()
+        _, packets = read_pcap(self.filename)
+        self.assertEqual([p[0][4] for p in packets], [0, 1, 2, 5, 6, 7])
+        self.assertEqual(packets[0][0][10], STATUS_EPIPE)
+
+    def testConcurrentUrbIds(self):
+        tap = PcapTap(self.filename)
+
+        def transfers(ep_num):
+            for _ in range(500):
+                tap.data_out(1, ep_num, XFER_BULK, b'\x00')
+
+        threads = [threading.Thread(target=transfers, args=(ep_num,)) for ep_num in range(1, 5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        tap.close()
+        _, packets = read_pcap(self.filename)
+        # the records are written in the order of their URB ids
+        self.assertEqual([p[0][0] for p in packets], list(range(1, 2001)))
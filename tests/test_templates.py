@@ -0,0 +1,44 @@
+'''
+Tests for the registry of the stage templates
+'''
+
+import ast
+import os
+import unittest
+from common import get_test_logger
+from umap2.fuzz import templates
+from umap2.fuzz.templates import STAGE_MODULES
+
+
+def get_module_templates(module_name):
+    '''
+    :return: names of the module-level variables that are assigned a template of the same name
+    '''
+    path = os.path.join(os.path.dirname(templates.__file__), '%s.py' % module_name)
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    names = set()
+    for node in tree.body:
+        if not isinstance(node, ast.Assign) or not isinstance(node.value, ast.Call):
+            continue
+        target = node.targets[0]
+        args = [kw.value for kw in node.value.keywords if kw.arg == 'name'] + node.value.args[:1]
+        if isinstance(target, ast.Name) and any(getattr(arg, 's', None) == target.id for arg in args):
+            names.add(target.id)
+    return names
+
+
+class TemplateRegistryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+
+    def testAllTemplatesRegistered(self):
+        for module_name in ['audio', 'cdc', 'enum', 'hid', 'hub', 'mass_storage', 'smart_card']:
+            for stage in get_module_templates(module_name):
+                self.assertIn(stage, STAGE_MODULES)
+                if stage != 'hub_descriptor':
+                    self.assertEqual(STAGE_MODULES[stage], module_name)
+        for stage, module_name in STAGE_MODULES.items():
+            self.assertIn(stage, get_module_templates(module_name))
@@ -0,0 +1,52 @@
+'''
+Tests for the adaptive disconnect / reconnect delays
+'''
+
+import unittest
+from common import get_test_logger
+from umap2.fuzz.timing import HostTiming, DelayEstimator, AdaptiveTiming
+
+
+class TimingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+
+    def testHostTiming(self):
+        timing = HostTiming()
+        self.assertIsNone(timing.disconnected())
+        timing.connected(now=10.0)
+        timing.setup_packet(now=10.25)
+        timing.mutation_served(now=10.5)
+        timing.host_request(now=10.75)
+        timing.setup_packet(now=11.0)
+        self.assertEqual(timing.disconnected(), {'enumeration': 0.25, 'reaction': 0.25})
+        # the second disconnection of the test is not reported
+        self.assertIsNone(timing.disconnected())
+        timing.connected(now=20.0)
+        self.assertEqual(timing.disconnected(), {'enumeration': None, 'reaction': None})
+
+    def testPercentile(self):
+        delay = DelayEstimator(2.0, percentile=90, margin=1.0, min_samples=5)
+        for sample in [0.1, 0.2, 0.3, 0.4]:
+            delay.add(sample)
+        self.assertEqual(delay.value(), 2.0)
+        for sample in [0.5, 0.6, 0.7, 0.8, 0.9, 1.0]:
+            delay.add(sample)
+        self.assertAlmostEqual(delay.value(), 0.9)
+
+    def testWidenAfterAnomaly(self):
+        timing = AdaptiveTiming(pre_disconnect_delay=1.0, post_disconnect_delay=1.0, logger=self.logger)
+        for _ in range(10):
+            timing.update({'enumeration': 0.1, 'reaction': 0.02})
+        pre, post, reconnect = timing.get_delays()
+        self.assertAlmostEqual(pre, 0.03)
+        self.assertAlmostEqual(post, 0.15)
+        self.assertAlmostEqual(reconnect, 0.15)
+        timing.update({'enumeration': None, 'reaction': None})
+        self.assertAlmostEqual(timing.get_delays()[2], 0.3)
+        # the widening decays as the host enumerates again
+        for _ in range(20):
+            timing.update({'enumeration': 0.1, 'reaction': 0.02})
+        self.assertAlmostEqual(timing.get_delays()[2], 0.15)
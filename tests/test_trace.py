@@ -0,0 +1,80 @@
+'''
+Tests for recording and replaying host sessions
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from common import get_test_logger
+from infra_event_handler import EventHandler
+from infra_app import TestApp
+from umap2.phy.loopback.loopback_phy import LoopbackPhy
+from umap2.phy.trace.recording_phy import RecordingPhy
+from umap2.phy.trace.replay_phy import ReplayPhy
+from umap2.phy.trace.trace import read_trace, RecordType
+
+
+class TraceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+        self.app = TestApp(event_handler=EventHandler())
+        self.tmpdir = tempfile.mkdtemp()
+        self.trace_file = os.path.join(self.tmpdir, 'session.trace')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_device(self, dev_name, phy):
+        device = self.app.load_device(dev_name, phy)
+        device.connect()
+        device.run()
+        device.disconnect()
+        return device
+
+    def record_session(self, dev_name):
+        loopback = LoopbackPhy(self.app, exit_when_done=True)
+        self.run_device(dev_name, RecordingPhy(self.app, loopback, self.trace_file))
+        return loopback.host
+
+    def replay_session(self, dev_name):
+        phy = ReplayPhy(self.app, self.trace_file)
+        self.run_device(dev_name, phy)
+        return phy
+
+    def testRecord(self):
+        host = self.record_session('keyboard')
+        records = read_trace(self.trace_file)
+        types = [r.type for r in records]
+        self.assertEqual(types[0], RecordType.start)
+        self.assertEqual(types[1], RecordType.connect)
+        self.assertEqual(types[-1], RecordType.disconnect)
+        self.assertEqual(types.count(RecordType.setup), host.stats['control'])
+        self.assertEqual(records[2].data[:2], b'\x80\x06')
+        self.assertEqual(records[3].type, RecordType.data_in)
+        self.assertEqual(records[3].data, host.device_descriptor)
+
+    def testReplayNoDiffs(self):
+        self.record_session('smartcard')
+        phy = self.replay_session('smartcard')
+        self.assertEqual(phy.replayed, len(phy.records))
+        self.assertEqual([str(d) for d in phy.diffs], [])
+
+    def testReplayDiffs(self):
+        self.record_session('keyboard')
+        self.app.options = {'--vid': '0x1234'}
+        phy = self.replay_session('keyboard')
+        self.assertTrue(phy.diffs)
+        diff = phy.diffs[0]
+        self.assertEqual(diff.expected.type, RecordType.data_in)
+        self.assertEqual(diff.expected.data[8:10], b'\x0b\x61')
+        self.assertEqual(diff.actual.data[8:10], b'\x34\x12')
+
+    def testTruncatedTrace(self):
+        self.record_session('keyboard')
+        count = len(read_trace(self.trace_file))
+        with open(self.trace_file, 'r+b') as f:
+            f.truncate(os.path.getsize(self.trace_file) - 1)
+        self.assertEqual(len(read_trace(self.trace_file)), count - 1)
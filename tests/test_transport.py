@@ -0,0 +1,82 @@
+'''
+Tests for the binary transport of the mutation protocol
+'''
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from common import get_test_logger
+from umap2.fuzz.transport import BinaryFuzzerServer, BinaryFuzzerClient
+from umap2.fuzz.transport import pack_value, unpack_value
+
+
+class FakeFuzzer(object):
+
+    def __init__(self):
+        self.calls = []
+        self.started = False
+
+    def get_mutation(self, stage, data):
+        self.calls.append(('get_mutation', stage, data))
+        if stage == 'device_descriptor':
+            return b'\x12\x01' + data.get('suffix', b'')
+        if stage == 'broken':
+            raise Exception('broken stage')
+        return None
+
+    def get_test_mutations(self):
+        return {'test': 3, 'stages': ['device_descriptor'], 'mutations': {'device_descriptor': b'\x00\xff'}}
+
+    def report_mutation(self, stage, test):
+        self.calls.append(('report_mutation', stage, test))
+
+    def start(self):
+        self.started = True
+        return True
+
+
+class BinaryTransportTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+        self.tmpdir = tempfile.mkdtemp()
+        self.address = 'unix:' + os.path.join(self.tmpdir, 'fuzzer.sock')
+        self.fuzzer = FakeFuzzer()
+        self.server = BinaryFuzzerServer(self.address, self.fuzzer, self.logger)
+        self.server.bind()
+        self.thread = threading.Thread(target=self.server.start)
+        self.thread.start()
+        self.client = BinaryFuzzerClient(self.address)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        self.thread.join()
+        shutil.rmtree(self.tmpdir)
+
+    def testValueEncoding(self):
+        value = {'a': [1, -2, None, True, False], 'b': b'\x00\xff', 'c': u'text', 'd': {}}
+        encoded = pack_value(value)
+        self.assertEqual(unpack_value(encoded), (value, len(encoded)))
+
+    def testMutationRequests(self):
+        self.assertTrue(self.client.start())
+        self.assertTrue(self.fuzzer.started)
+        self.assertEqual(self.client.get_mutation('device_descriptor'), b'\x12\x01')
+        self.assertEqual(self.client.get_mutation('device_descriptor', {'suffix': b'\x00'}), b'\x12\x01\x00')
+        self.assertIsNone(self.client.get_mutation('string_descriptor'))
+        # each stage name is sent once
+        self.assertEqual(self.client.stage_ids, {'device_descriptor': 0, 'string_descriptor': 1})
+        self.assertEqual(self.client.get_test_mutations()['mutations'], {'device_descriptor': b'\x00\xff'})
+        self.client.report_mutation('device_descriptor', 3)
+        # reports are not acknowledged, but are handled before the next request
+        self.assertIsNone(self.client.get_mutation('string_descriptor'))
+        self.assertIn(('report_mutation', 'device_descriptor', 3), self.fuzzer.calls)
+
+    def testErrorResponse(self):
+        with self.assertRaises(Exception):
+            self.client.get_mutation('broken')
+        self.assertEqual(self.client.get_mutation('device_descriptor'), b'\x12\x01')
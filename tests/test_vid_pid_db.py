@@ -0,0 +1,67 @@
+'''
+Tests for the compact VID:PID database of umap2vsscan
+'''
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from common import get_test_logger
+from umap2.utils.vid_pid_db import VidPidDB, VidPidDBWriter, parse_db_file, parse_usb_ids
+
+
+USB_IDS = u'''# comment
+0bda  Realtek Semiconductor Corp.
+\t0129  RTS5129 Card Reader Controller
+\t0139  RTS5139 Card Reader Controller
+2058  Nano River Technology
+C 00  (Defined at Interface level)
+\t01  Audio
+'''
+
+DB_FILE = u'''from umap2.apps.vsscan import DBEntry, OS
+
+db = [
+    DBEntry(0x2058, 0x1005, 'Nano River Technology', '', drivers={OS.LINUX: 'drivers/mfd/viperboard.c'}),
+    DBEntry(0x0bda, 0x0129, 'Realtek', 'RTS5129', drivers={OS.LINUX: 'drivers/mfd/rtsx_usb.c', OS.QNX: 'devu'}),
+]
+'''
+
+
+class VidPidDBTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'vid_pid.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testImportAndMerge(self):
+        writer = VidPidDBWriter()
+        for vid, pid, vendor_name, product_name in parse_usb_ids(io.StringIO(USB_IDS)):
+            writer.add(vid, pid, vendor_name, product_name)
+        for vid, pid, vendor_name, product_name, drivers in parse_db_file(io.StringIO(DB_FILE)):
+            writer.add(vid, pid, vendor_name, product_name, drivers)
+        self.assertEqual(writer.write(self.path), 3)
+        db = VidPidDB(self.path)
+        try:
+            self.assertEqual(len(db), 3)
+            self.assertEqual([entry.vidpid() for entry in db], ['0bda:0129', '0bda:0139', '2058:1005'])
+            entry = db[db.find(0x0bda, 0x0129)]
+            # the names of usb.ids are kept, the drivers are merged
+            self.assertEqual(entry.product_name, 'RTS5129 Card Reader Controller')
+            self.assertEqual(entry.drivers, {'Linux': 'drivers/mfd/rtsx_usb.c', 'QNX': 'devu'})
+            self.assertEqual(db[-1].vendor_name, 'Nano River Technology')
+            self.assertIsNone(db.find(0x0bda, 0x0130))
+            self.assertRaises(IndexError, db.__getitem__, 3)
+        finally:
+            db.close()
+
+    def testNotDatabase(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\x00' * 64)
+        self.assertRaises(Exception, VidPidDB, self.path)
@@ -0,0 +1,74 @@
+'''
+Tests for the host watchdog
+'''
+
+import json
+import unittest
+from common import get_test_logger
+from umap2.fuzz.watchdog import HostWatchdog, CMD_ALIVE, CMD_SILENT
+
+
+class FakeChannel(object):
+
+    def __init__(self):
+        self.messages = []
+
+    def send(self, cmd, payload=''):
+        self.messages.append((cmd, json.loads(payload)))
+        return True
+
+
+class HostWatchdogTests(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = get_test_logger()
+        self.logger.info('Starting test: %s' % self._testMethodName)
+        self.channel = FakeChannel()
+        self.watchdog = HostWatchdog(self.channel, silence_timeout=1.0, alive_interval=0.1)
+
+    def testAliveRateLimit(self):
+        self.watchdog.last_setup = 100.0
+        self.watchdog.check(100.01)
+        self.watchdog.last_data = 100.02
+        self.watchdog.check(100.05)
+        self.assertEqual(len(self.channel.messages), 1)
+        self.watchdog.check(100.2)
+        self.assertEqual([m[0] for m in self.channel.messages], [CMD_ALIVE, CMD_ALIVE])
+        self.assertAlmostEqual(self.channel.messages[1][1]['since_data'], 0.18)
+
+    def testSilentOnlyWhenArmed(self):
+        self.watchdog.last_setup = 100.0
+        self.watchdog.check(100.0)
+        self.watchdog.check(105.0)
+        self.assertEqual([m[0] for m in self.channel.messages], [CMD_ALIVE])
+        self.watchdog.arm()
+        self.watchdog.armed_time = 105.0
+        self.watchdog.check(105.5)
+        self.watchdog.check(106.5)
+        self.watchdog.check(107.0)
+        self.assertEqual([m[0] for m in self.channel.messages], [CMD_ALIVE, CMD_SILENT])
+        self.assertAlmostEqual(self.channel.messages[1][1]['silent_for'], 1.5)
+
+    def testAliveAfterSilent(self):
+        self.watchdog.arm()
+        self.watchdog.armed_time = 100.0
+        self.watchdog.check(101.5)
+        self.watchdog.last_setup = 101.6
+        self.watchdog.check(101.6)
+        self.assertEqual([m[0] for m in self.channel.messages], [CMD_SILENT, CMD_ALIVE])
+        self.assertFalse(self.watchdog.silent)
+
+    def testInTransfersAreAlive(self):
+        self.watchdog.arm()
+        self.watchdog.armed_time = 100.0
+        self.watchdog.enumerated()
+        self.watchdog.last_in = 100.8
+        self.watchdog.check(101.5)
+        self.assertEqual([m[0] for m in self.channel.messages], [CMD_ALIVE])
+        self.watchdog.check(102.0)
+        self.assertEqual([m[0] for m in self.channel.messages], [CMD_ALIVE, CMD_SILENT])
+        self.assertTrue(self.channel.messages[1][1]['enumerated'])
+        self.assertFalse(self.channel.messages[1][1]['mutated'])
+        # a new connection starts a new enumeration
+        self.watchdog.arm()
+        self.assertFalse(self.watchdog.is_enumerated)
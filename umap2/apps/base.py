@@ -10,6 +10,11 @@ from serial import Serial, PARITY_NONE
 
 from umap2.phy.facedancer.max342x_phy import Max342xPhy
 from umap2.phy.gadgetfs.gadgetfs_phy import GadgetFsPhy
+from umap2.phy.rawgadget.rawgadget_phy import RawGadgetPhy
+from umap2.phy.loopback.loopback_phy import LoopbackPhy
+from umap2.phy.trace.recording_phy import RecordingPhy
+from umap2.phy.trace.replay_phy import ReplayPhy
+from umap2.phy.tap import PcapTap
 from umap2.utils.ulogger import set_default_handler_level
 
 
@@ -79,6 +84,33 @@ class Umap2App(object):
             self.logger.debug('Physical interface is GadgetFs')
             phy = GadgetFsPhy(self)
             return phy
+        elif phy_type == 'rawgadget':
+            self.logger.debug('Physical interface is RawGadget')
+            phy = RawGadgetPhy(self, *phy_arr[1:3])
+            return phy
+        elif phy_type == 'loopback':
+            self.logger.debug('Physical interface is Loopback')
+            phy = LoopbackPhy(self, exit_when_done=(phy_arr[1:2] == ['once']))
+            return phy
+        elif phy_type == 'record':
+            if len(phy_arr) < 3:
+                raise Exception('Usage: record:<trace_file>:<phy_info>')
+            self.logger.debug('Recording session to %s' % phy_arr[1])
+            phy = RecordingPhy(self, self.load_phy(':'.join(phy_arr[2:])), phy_arr[1])
+            return phy
+        elif phy_type == 'replay':
+            if len(phy_arr) < 2:
+                raise Exception('Usage: replay:<trace_file>[:speed]')
+            self.logger.debug('Physical interface is Replay')
+            phy = ReplayPhy(self, *phy_arr[1:3])
+            return phy
+        elif phy_type == 'pcap':
+            if len(phy_arr) < 3:
+                raise Exception('Usage: pcap:<pcap_file>:<phy_info>')
+            self.logger.debug('Capturing traffic to %s' % phy_arr[1])
+            phy = self.load_phy(':'.join(phy_arr[2:]))
+            phy.set_tap(PcapTap(phy_arr[1]))
+            return phy
         raise Exception('Phy type not supported: %s' % phy_type)
 
     def load_device(self, dev_name, phy):
@@ -123,6 +155,31 @@ class Umap2App(object):
         '''
         self.setup_packet_received = True
 
+    def signal_data_received(self, ep_num):
+        '''
+        Signal that we received data from the host on a (non-control) endpoint
+
+        :param ep_num: endpoint number
+        '''
+        pass
+
+    def signal_buffer_available(self, ep_num):
+        '''
+        Signal that the host read from an IN endpoint (its buffer is available)
+
+        :param ep_num: endpoint number
+        '''
+        pass
+
+    def signal_request_received(self, req):
+        '''
+        Signal that the device received a control request from the host
+
+        :type req: :class:`~umap2.core.usb_device.USBDeviceRequest`
+        :param req: the request
+        '''
+        pass
+
     def should_stop_phy(self):
         '''
         :return: whether phy should stop serving.
@@ -144,3 +201,10 @@ class Umap2App(object):
         mutation is only needed when fuzzing
         '''
         return None
+
+    def is_stage_active(self, stage):
+        '''
+        :param stage: stage name
+        :return: whether a mutation should be requested for this stage
+        '''
+        return True
@@ -16,6 +16,11 @@ Options:
 Physical layer:
     fd:<serial_port>        use facedancer connected to given serial port
     gadgetfs                use gadgetfs (requires mounting of gadgetfs beforehand)
+    rawgadget[:DRV[:DEV]]   use raw gadget (default: dummy_udc:dummy_udc.0, requires raw_gadget module)
+    loopback[:once]         use an in-process simulated host (once: stop after a single session)
+    record:<file>:<phy>     record the session of another phy to a trace file
+    replay:<file>[:speed]   replay a trace file (speed: max [default] or original)
+    pcap:<file>:<phy>       capture the traffic of another phy to a pcap file (usbmon format)
 
 Examples:
     emulate keyboard:
@@ -4,6 +4,10 @@ Emulate a USB device to be used for fuzzing
 
 Usage:
     umap2fuzz -P=PHY_INFO -C=DEVICE_CLASS [-q] [--vid=VID] [--pid=PID] [-i=FUZZER_IP] [-p FUZZER_PORT] [-v ...]
+    umap2fuzz -P=PHY_INFO -C=DEVICE_CLASS -b=ADDRESS [-q] [--vid=VID] [--pid=PID] [-v ...]
+    umap2fuzz -P=PHY_INFO -C=DEVICE_CLASS -s=STAGE_FILE [-j=JOURNAL] [-c=COUNT] [-d=DELAYS] [-a] [-k=KITTY_OPTIONS] [--corpus=CORPUS] [--dedup] [--results=RESULTS] [-q] [--vid=VID] [--pid=PID] [-v ...]
+    umap2fuzz -P=PHY_INFO -C=DEVICE_CLASS -j=JOURNAL [-d=DELAYS] [-a] [-k=KITTY_OPTIONS] [-q] [--vid=VID] [--pid=PID] [-v ...]
+    umap2fuzz -P=PHY_INFO -C=DEVICE_CLASS -r=REPRODUCER [-q] [--vid=VID] [--pid=PID] [-v ...]
 
 Options:
     -P --phy PHY_INFO           physical layer info, see list below
@@ -11,42 +15,201 @@ Options:
     -v --verbose                verbosity level
     -i --fuzzer-ip HOST         hostname or IP of the fuzzer [default: 127.0.0.1]
     -p --fuzzer-port PORT       port of the fuzzer [default: 26007]
+    -b --binary ADDRESS         connect to the fuzzer with the binary protocol
+                                (unix:<path> or <host>:<port>, see umap2kitty -b)
     -q --quiet                  quiet mode. only print warning/error messages
     --vid VID                   override vendor ID
     --pid PID                   override product ID
+    -s --stage-file STAGE_FILE  run the fuzzer in this process (instead of connecting to umap2kitty),
+                                using the stage file from an emulation run
+    -c --count COUNT            (in-process fuzzer) stage count [default: 2]
+    -d --disconnect-delays DELAYS  (in-process fuzzer) delays before and after disconnecting the
+                                device in the post_test [default: 0.0,0.0]
+    -a --adaptive-delays        (in-process fuzzer) learn the delays from the timing of the host
+    -k --kitty-options OPTIONS  (in-process fuzzer) options for the kitty fuzzer
+    -j --journal JOURNAL        (in-process fuzzer) journal the session to this file before and after each test,
+                                if the file exists, resume its session (see umap2kitty -j)
+    --corpus CORPUS             (in-process fuzzer) serve the mutations from a corpus file
+                                (see umap2kitty --render-corpus)
+    --dedup                     (in-process fuzzer) skip tests whose payload was already sent
+    --results RESULTS           (in-process fuzzer) record the results of the tests in a results file
+                                (see umap2results)
+    -r --reproducer REPRODUCER  replay the mutations of a reproducer file (see umap2minimize)
 
 Physical layer:
     fd:<serial_port>        use facedancer connected to given serial port
     gadgetfs                use gadgetfs (requires mounting of gadgetfs beforehand)
+    rawgadget[:DRV[:DEV]]   use raw gadget (default: dummy_udc:dummy_udc.0, requires raw_gadget module)
+    loopback[:once]         use an in-process simulated host (once: stop after a single session)
+    record:<file>:<phy>     record the session of another phy to a trace file
+    replay:<file>[:speed]   replay a trace file (speed: max [default] or original)
+    pcap:<file>:<phy>       capture the traffic of another phy to a pcap file (usbmon format)
 
 Examples:
     emulate disk-on-key:
         umap2fuzz -P fd:/dev/ttyUSB1 -C mass_storage
+    fuzz disk-on-key without a separate umap2kitty process:
+        umap2fuzz -P fd:/dev/ttyUSB1 -C mass_storage -s stages.log
+    replay a minimized failure:
+        umap2fuzz -P fd:/dev/ttyUSB1 -C mass_storage -r crash.json
 '''
+import json
 import os
 import time
 from kitty.remote.rpc import RpcClient
 from umap2.apps.emulate import Umap2EmulationApp
+from umap2.core.usb import Request
+from umap2.fuzz.channel import ControlChannelClient, LocalChannelServer, CMD_CONNECT, CMD_DISCONNECT, CMD_STAGES
+from umap2.fuzz.dedup import CMD_LENGTHS
+from umap2.fuzz.feedback import RequestSequence, CMD_SEQUENCE
+from umap2.fuzz.minimizer import Reproducer
+from umap2.fuzz.timing import HostTiming, CMD_TIMING
+from umap2.fuzz.prefetch import PrefetchingMutationClient
+from umap2.fuzz.transport import BinaryFuzzerClient
+from umap2.fuzz.watchdog import HostWatchdog
 
 
 class Umap2FuzzApp(Umap2EmulationApp):
 
     def __init__(self, options):
         super(Umap2FuzzApp, self).__init__(options)
+        self.dev = None
         self.count = 0
+        self.channel = ControlChannelClient()
+        self.last_channel_attempt = 0
+        self.watchdog = HostWatchdog(self.channel)
+        # stages (lower case) that are active in the current test, None if unknown
+        self.active_stages = None
+        # requests of the host in the current test, reported to the fuzzer at the end of the test
+        self.sequence = RequestSequence()
+        self.timing = HostTiming()
+        # stage -> maximal length requested by the host in the current test
+        self.response_lengths = {}
+
+    def run(self):
+        try:
+            super(Umap2FuzzApp, self).run()
+        finally:
+            self.watchdog.stop()
+            # the prefetching client sends its pending mutation reports before it stops
+            if self.fuzzer and (self.in_process or isinstance(self.fuzzer, PrefetchingMutationClient)):
+                self.fuzzer.stop()
+
+    @property
+    def in_process(self):
+        return bool(self.options.get('--stage-file') or self.options.get('--journal'))
 
     def get_fuzzer(self):
-        fuzzer = RpcClient(
-            host=self.options['--fuzzer-ip'],
-            port=int(self.options['--fuzzer-port'])
-        )
+        if self.in_process:
+            return self.get_local_fuzzer()
+        if self.options.get('--reproducer'):
+            return Reproducer.load(self.options['--reproducer'])
+        if self.options.get('--binary'):
+            fuzzer = BinaryFuzzerClient(self.options['--binary'])
+        else:
+            fuzzer = RpcClient(
+                host=self.options['--fuzzer-ip'],
+                port=int(self.options['--fuzzer-port'])
+            )
+        fuzzer.start()
+        self.connect_channel()
+        return PrefetchingMutationClient(fuzzer, self.logger)
+
+    def get_local_fuzzer(self):
+        '''
+        Create and start the fuzzer in this process.
+        Mutations are rendered by direct calls to the fuzzer,
+        and the controller commands are passed over an in-memory channel.
+        '''
+        server = LocalChannelServer(self.logger)
+        fuzzer = self.create_local_fuzzer(server)
+        self.channel = server.client
+        self.watchdog.channel = self.channel
         fuzzer.start()
+        self.connect_channel()
         return fuzzer
 
+    def create_local_fuzzer(self, channel):
+        '''
+        :param channel: control channel server of the controller
+        :return: the fuzzer to run in this process (not started)
+        '''
+        from umap2.fuzz.fuzz_engine import get_fuzzer
+        return get_fuzzer(self.options, channel=channel)
+
+    def reconnect_device(self):
+        '''
+        Connect the device for a new test,
+        the mutations of the test are fetched before the host starts the enumeration.
+        '''
+        if isinstance(self.fuzzer, PrefetchingMutationClient):
+            self.fuzzer.prefetch()
+        self.sequence.reset()
+        self.timing.connected()
+        self.phy.connect(self.dev)
+
+    def disconnect_device(self):
+        self.phy.disconnect()
+        if isinstance(self.fuzzer, PrefetchingMutationClient):
+            self.fuzzer.invalidate()
+        if self.sequence.events:
+            self.channel.send(CMD_SEQUENCE, self.sequence.to_json())
+            self.sequence.reset()
+        timing = self.timing.disconnected()
+        if timing:
+            self.channel.send(CMD_TIMING, json.dumps(timing))
+        if self.response_lengths:
+            self.channel.send(CMD_LENGTHS, json.dumps(self.response_lengths))
+            self.response_lengths = {}
+
+    def connect_channel(self):
+        '''
+        Try to connect to the control channel of the fuzzer
+
+        :return: whether connected
+        '''
+        self.last_channel_attempt = time.time()
+        if self.channel.connect():
+            self.logger.info('Connected to the control channel at %s' % (self.channel.path))
+            if self.watchdog.thread is None:
+                self.watchdog.start()
+            self.watchdog.arm()
+            return True
+        return False
+
+    def signal_setup_packet_received(self):
+        super(Umap2FuzzApp, self).signal_setup_packet_received()
+        self.watchdog.setup_packet()
+        self.timing.setup_packet()
+
+    def signal_data_received(self, ep_num):
+        self.watchdog.data_event()
+        self.timing.host_request()
+        self.sequence.add_data(ep_num)
+
+    def signal_buffer_available(self, ep_num):
+        self.watchdog.in_event()
+
+    def signal_request_received(self, req):
+        self.sequence.add_request(req)
+        if req.get_type() == Request.type_standard and req.request == 9:
+            # SET_CONFIGURATION, a host that is silent from now on may just be idle
+            self.watchdog.enumerated()
+
+    def is_session_done(self):
+        '''
+        :return: whether the session of the fuzzer is done (only known for the in-process fuzzer)
+        '''
+        return self.in_process and self.fuzzer is not None and self.fuzzer.is_done()
+
     def should_stop_phy(self):
+        if self.is_session_done():
+            self.logger.info('Fuzzing session is done')
+            return True
         self.count = (self.count + 1) % 50
         self.check_connection_commands()
-        if self.count == 0:
+        if self.count == 0 and not self.channel.is_connected():
+            # the watchdog pushes liveness events over the control channel
             self.send_heartbeat()
         return False
 
@@ -60,8 +223,14 @@ class Umap2FuzzApp(Umap2EmulationApp):
         '''
         :return: whether performed reconnection
         '''
+        if self.channel.is_connected() or self.channel.has_messages():
+            return self._check_channel_commands()
+        if self.fuzzer and time.time() - self.last_channel_attempt > 1:
+            if self.connect_channel():
+                return self._check_channel_commands()
+        # fallback - trigger files
         if self._should_disconnect():
-            self.phy.disconnect()
+            self.disconnect_device()
             self._clear_disconnect_trigger()
             # wait for reconnection request; no point in returning to service_irqs loop while not connected!
             while not self._should_reconnect():
@@ -71,11 +240,77 @@ class Umap2FuzzApp(Umap2EmulationApp):
         # be robust to reconnection requests, whether received after a disconnect request, or standalone
         # (not sure this is right, might be better to *not* be robust in the face of possible misuse?)
         if self._should_reconnect():
-            self.phy.connect(self.dev)
+            self.reconnect_device()
             self._clear_reconnect_trigger()
             return True
         return False
 
+    def _check_channel_commands(self):
+        '''
+        Handle the pending commands from the control channel.
+        The channel is read by a background thread,
+        so when there are no pending commands this does not perform any syscall.
+
+        :return: whether performed reconnection
+        '''
+        reconnected = False
+        while self.channel.has_messages():
+            msg = self.channel.recv()
+            if msg is None:
+                self.logger.warning('Control channel closed, falling back to trigger files')
+                break
+            cmd = msg[0]
+            if cmd == CMD_DISCONNECT:
+                self.disconnect_device()
+                self.watchdog.disarm()
+                self.channel.ack(cmd)
+                # wait for reconnection request; no point in returning to service_irqs loop while not connected!
+                msg = self._wait_channel_message()
+                while msg is not None and msg[0] != CMD_CONNECT:
+                    self._handle_channel_message(msg)
+                    msg = self._wait_channel_message()
+                if msg is None:
+                    if not self.is_session_done():
+                        self.logger.warning('Control channel closed while disconnected, falling back to trigger files')
+                    break
+                cmd = msg[0]
+            if cmd == CMD_CONNECT:
+                self.reconnect_device()
+                self.watchdog.arm()
+                self.channel.ack(cmd)
+                reconnected = True
+            else:
+                self._handle_channel_message(msg)
+        return reconnected
+
+    def _wait_channel_message(self):
+        '''
+        Block until a message is received from the control channel
+
+        :return: the message, None if the channel was closed or the fuzzing session is done
+            (there will be no reconnection request after the last test)
+        '''
+        while True:
+            msg = self.channel.recv(0.1)
+            if msg is not None or not self.channel.is_connected() or self.is_session_done():
+                return msg
+
+    def _handle_channel_message(self, msg):
+        '''
+        Handle a control channel message that does not change the connection state
+        '''
+        cmd, payload = msg
+        if cmd == CMD_DISCONNECT:
+            # be robust to additional disconnect requests
+            self.channel.ack(cmd)
+        elif cmd == CMD_STAGES:
+            stages = json.loads(payload)
+            self.active_stages = None if stages is None else set(stage.lower() for stage in stages)
+            self.logger.debug('Active stages: %s' % (stages))
+            self.channel.ack(cmd)
+        else:
+            self.logger.warning('Unknown command from the control channel: %s' % (cmd))
+
     def _should_reconnect(self):
         if self.fuzzer:
             if os.path.isfile('/tmp/umap_kitty/trigger_reconnect'):
@@ -98,10 +333,25 @@ class Umap2FuzzApp(Umap2EmulationApp):
         if os.path.isfile(trigger):
             os.remove(trigger)
 
+    def is_stage_active(self, stage):
+        if self.active_stages is None or not self.channel.is_connected():
+            return True
+        return stage.lower() in self.active_stages
+
     def get_mutation(self, stage, data=None):
+        req = getattr(self.dev, 'current_request', None)
+        if req is not None and req.get_direction():
+            # the response of the stage is truncated to the length of the request
+            self.response_lengths[stage] = max(req.length, self.response_lengths.get(stage, 0))
+        if not self.is_stage_active(stage):
+            return None
         if self.fuzzer:
             data = {} if data is None else data
-            return self.fuzzer.get_mutation(stage=stage, data=data)
+            mutation = self.fuzzer.get_mutation(stage=stage, data=data)
+            if mutation is not None:
+                self.timing.mutation_served()
+                self.watchdog.mutation_served()
+            return mutation
         return None
 
 
@@ -17,6 +17,11 @@ Options:
 Physical layer:
     fd:<serial_port>        use facedancer connected to given serial port
     gadgetfs                use gadgetfs (requires mounting of gadgetfs beforehand)
+    rawgadget[:DRV[:DEV]]   use raw gadget (default: dummy_udc:dummy_udc.0, requires raw_gadget module)
+    loopback[:once]         use an in-process simulated host (once: stop after a single session)
+    record:<file>:<phy>     record the session of another phy to a trace file
+    replay:<file>[:speed]   replay a trace file (speed: max [default] or original)
+    pcap:<file>:<phy>       capture the traffic of another phy to a pcap file (usbmon format)
 '''
 import time
 from umap2.apps.emulate import Umap2EmulationApp
@@ -28,11 +33,18 @@ class Umap2MakeStagesApp(Umap2EmulationApp):
     def load_device(self, dev_name, phy):
         self.start_time = time.time()
         self.stage_file_name = self.options['--stage-file']
-        stage_logger = StageLogger(self.stage_file_name)
-        stage_logger.start()
-        set_stage_logger(stage_logger)
+        self.stage_logger = StageLogger(self.stage_file_name)
+        self.stage_logger.start()
+        set_stage_logger(self.stage_logger)
         return super(Umap2MakeStagesApp, self).load_device(dev_name, phy)
 
+    def run(self):
+        try:
+            super(Umap2MakeStagesApp, self).run()
+        finally:
+            if hasattr(self, 'stage_logger'):
+                self.stage_logger.stop()
+
     def should_stop_phy(self):
         stop_phy = False
         passed = int(time.time() - self.start_time)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+'''
+Emulate multiple USB devices, each on its own physical layer,
+concurrently in a single process
+
+The devices are emulated, not fuzzed: there is no fuzzer shared by the devices.
+To fuzz several targets in a single session, run a umap2kitty and umap2fuzz pair
+for each target with a coordinator (see umap2kitty --coordinate).
+
+Usage:
+    umap2multi (-D=DEVICE_INFO)... [-q] [-t=TIMEOUT] [-v ...]
+
+Options:
+    -D --device DEVICE_INFO     physical layer info and device class, separated by a comma
+    -t --timeout TIMEOUT        stop each device after TIMEOUT seconds
+    -v --verbose                verbosity level
+    -q --quiet                  quiet mode. only print warning/error messages
+
+Physical layer:
+    fd:<serial_port>        use facedancer connected to given serial port
+    gadgetfs                use gadgetfs (requires mounting of gadgetfs beforehand)
+    rawgadget[:DRV[:DEV]]   use raw gadget (default: dummy_udc:dummy_udc.0, requires raw_gadget module)
+    loopback[:once]         use an in-process simulated host (once: stop after a single session)
+    record:<file>:<phy>     record the session of another phy to a trace file
+    replay:<file>[:speed]   replay a trace file (speed: max [default] or original)
+    pcap:<file>:<phy>       capture the traffic of another phy to a pcap file (usbmon format)
+
+Examples:
+    emulate a keyboard and a disk-on-key on two facedancers:
+        umap2multi -D fd:/dev/ttyUSB0,keyboard -D fd:/dev/ttyUSB1,mass_storage
+'''
+import threading
+import time
+import traceback
+from umap2.apps.base import Umap2App
+
+
+class DeviceContext(Umap2App):
+    '''
+    Application context of a single phy+device pair.
+    Devices and phys call the context as their app,
+    the context keeps per-device state and statistics
+    and forwards the callbacks to the parent (multi) app.
+    '''
+
+    def __init__(self, parent, index, phy_info, device_class):
+        '''
+        :type parent: :class:`~umap2.apps.multi.Umap2MultiApp`
+        :param parent: the multi app
+        :param index: index of the device
+        :param phy_info: physical layer info (same format as -P)
+        :param device_class: class of the device or path to python file with device class
+        '''
+        self.parent = parent
+        super(DeviceContext, self).__init__(None)
+        self.options = parent.options
+        self.fuzzer = parent.fuzzer
+        self.index = index
+        self.phy_info = phy_info
+        self.device_class = device_class
+        self.name = '%d:%s@%s' % (index, device_class, phy_info)
+        self.phy = None
+        self.dev = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.stats = {
+            'setup_packets': 0,
+            'supported': False,
+            'supported_reason': None,
+            'start_time': None,
+            'end_time': None,
+            'error': None,
+        }
+
+    def get_logger(self):
+        return self.parent.logger
+
+    def signal_setup_packet_received(self):
+        self.setup_packet_received = True
+        with self.parent.stats_lock:
+            self.stats['setup_packets'] += 1
+
+    def should_stop_phy(self):
+        if self.stop_event.is_set():
+            return True
+        return self.parent.should_stop_phy(self)
+
+    def usb_function_supported(self, reason=None):
+        with self.parent.stats_lock:
+            if self.stats['supported']:
+                return
+            self.stats['supported'] = True
+            self.stats['supported_reason'] = reason
+        self.parent.usb_function_supported(self, reason)
+
+    def get_mutation(self, stage, data=None):
+        return self.parent.get_mutation(self, stage, data)
+
+    def load(self):
+        self.phy = self.load_phy(self.phy_info)
+        self.dev = self.load_device(self.device_class, self.phy)
+
+    def run(self):
+        with self.parent.stats_lock:
+            self.stats['start_time'] = time.time()
+        try:
+            if self.dev is None:
+                self.load()
+            self.dev.connect()
+            self.dev.run()
+        except:
+            self.logger.error('[%s] Got exception while connecting/running device' % (self.name))
+            self.logger.error(traceback.format_exc())
+            with self.parent.stats_lock:
+                self.stats['error'] = traceback.format_exc()
+        if self.dev:
+            self.dev.disconnect()
+        with self.parent.stats_lock:
+            self.stats['end_time'] = time.time()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def is_alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+
+class Umap2MultiApp(Umap2App):
+    '''
+    Run multiple phy+device pairs concurrently, each in its own thread.
+    The app does not fuzz (get_fuzzer returns None and get_mutation does not mutate),
+    a subclass can return a fuzzer from get_fuzzer, which is then shared by all devices,
+    and serve its mutations from get_mutation.
+    Subclasses can override the per-device callbacks
+    (should_stop_phy, usb_function_supported and get_mutation),
+    which receive the device context as their first argument.
+    '''
+
+    def __init__(self, docstring=None):
+        super(Umap2MultiApp, self).__init__(docstring)
+        self.contexts = []
+        self.stats_lock = threading.Lock()
+        timeout = self.options.get('--timeout')
+        self.timeout = float(timeout) if timeout else None
+        for device_info in self.options.get('--device') or []:
+            if ',' not in device_info:
+                raise Exception('Invalid device info: %s (expected PHY_INFO,DEVICE_CLASS)' % (device_info))
+            phy_info, device_class = device_info.rsplit(',', 1)
+            self.add_device(phy_info, device_class)
+
+    def add_device(self, phy_info, device_class):
+        '''
+        :param phy_info: physical layer info
+        :param device_class: class of the device or path to python file with device class
+        :return: the device context
+        '''
+        ctx = DeviceContext(self, len(self.contexts), phy_info, device_class)
+        self.contexts.append(ctx)
+        return ctx
+
+    def run(self):
+        self.fuzzer = self.get_fuzzer()
+        for ctx in self.contexts:
+            ctx.fuzzer = self.fuzzer
+            ctx.load()
+        self.logger.always('Starting %d devices' % (len(self.contexts)))
+        for ctx in self.contexts:
+            ctx.start()
+        try:
+            while any(ctx.is_alive() for ctx in self.contexts):
+                time.sleep(0.1)
+        except KeyboardInterrupt:
+            self.logger.info('user terminated the run')
+        self.stop()
+        self.print_stats()
+
+    def stop(self):
+        for ctx in self.contexts:
+            ctx.stop()
+        for ctx in self.contexts:
+            if ctx.thread:
+                ctx.thread.join()
+
+    def get_fuzzer(self):
+        '''
+        :return: fuzzer that is shared by all the devices (default: None, no fuzzing)
+        '''
+        return None
+
+    def get_stats(self):
+        '''
+        :return: dictionary of aggregated statistics and per-device statistics
+        '''
+        with self.stats_lock:
+            devices = dict((ctx.name, dict(ctx.stats)) for ctx in self.contexts)
+        return {
+            'devices': len(self.contexts),
+            'running': len([ctx for ctx in self.contexts if ctx.is_alive()]),
+            'supported': len([s for s in devices.values() if s['supported']]),
+            'errors': len([s for s in devices.values() if s['error']]),
+            'setup_packets': sum(s['setup_packets'] for s in devices.values()),
+            'per_device': devices,
+        }
+
+    def print_stats(self):
+        stats = self.get_stats()
+        self.logger.always('---------------------------------')
+        self.logger.always(
+            'Devices: %(devices)d, supported: %(supported)d, errors: %(errors)d, setup packets: %(setup_packets)d' % stats
+        )
+        for name in sorted(stats['per_device']):
+            dev_stats = stats['per_device'][name]
+            self.logger.always('%s: setup packets: %d, supported: %s' % (
+                name, dev_stats['setup_packets'], dev_stats['supported']
+            ))
+
+    def should_stop_phy(self, ctx):
+        '''
+        :param ctx: the device context
+        :return: whether the phy of the device should stop serving.
+        '''
+        if self.timeout is not None and time.time() - ctx.stats['start_time'] > self.timeout:
+            return True
+        return False
+
+    def usb_function_supported(self, ctx, reason=None):
+        '''
+        Callback from a USB device, notifying that it is supported by the host.
+
+        :param ctx: the device context
+        :param reason: reason why we decided it is supported (default: None)
+        '''
+        self.logger.info('[%s] device is supported: %s' % (ctx.name, reason))
+
+    def get_mutation(self, ctx, stage, data=None):
+        '''
+        mutation is only needed when fuzzing
+        '''
+        return None
+
+
+def main():
+    app = Umap2MultiApp(__doc__)
+    app.run()
+
+
+if __name__ == '__main__':
+    main()
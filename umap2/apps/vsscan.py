@@ -20,9 +20,15 @@ Options:
 Physical layer:
     fd:<serial_port>        use facedancer connected to given serial port
     gadgetfs                use gadgetfs (requires mounting of gadgetfs beforehand)
+    rawgadget[:DRV[:DEV]]   use raw gadget (default: dummy_udc:dummy_udc.0, requires raw_gadget module)
+    loopback[:once]         use an in-process simulated host (once: stop after a single session)
+    record:<file>:<phy>     record the session of another phy to a trace file
+    replay:<file>[:speed]   replay a trace file (speed: max [default] or original)
+    pcap:<file>:<phy>       capture the traffic of another phy to a pcap file (usbmon format)
 
 DB_FILE:
-    a python file with a db member which is a list of DBEntry() objects.
+    a database file built by umap2vsdb (from usb.ids and python db files),
+    or a python file with a db member which is a list of DBEntry() objects.
     a sample can be found at: umap2/data/vid_pid_db.py
 
 OS:
@@ -41,11 +47,11 @@ import time
 import traceback
 import os
 import signal
-import sys
 import six
 from six.moves import cPickle
 from umap2.apps.base import Umap2App
 from umap2.dev.vendor_specific import USBVendorSpecificDevice
+from umap2.utils.vid_pid_db import VidPidDB, load_db_module
 
 
 class OS(object):
@@ -96,6 +102,8 @@ class _ScanSession(object):
     def __init__(self):
         self.timeout = 5
         self.db = []
+        # database file (umap2vsdb) that the db is loaded from, it is not stored in the resume file
+        self.db_file = None
         self.supported = []
         self.unsupported = []
         self.supported_drivers = []
@@ -104,6 +112,12 @@ class _ScanSession(object):
         self.no_response = {}
         self.current = 0
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.db_file:
+            del state['db']
+        return state
+
 
 class Umap2VSScanApp(Umap2App):
 
@@ -144,13 +158,11 @@ class Umap2VSScanApp(Umap2App):
 
     def load_db_from_file(self, db_file):
         self.logger.info('loading vid_pid db file: %s' % db_file)
-        dirpath, filename = os.path.split(db_file)
-        modulename = filename[:-3]
-        if dirpath in sys.path:
-            sys.path.remove(dirpath)
-        sys.path.insert(0, dirpath)
-        module = __import__(modulename, globals(), locals(), [], -1)
-        self.scan_session.db = module.db
+        if db_file.endswith('.py'):
+            self.scan_session.db = load_db_module(db_file)
+        else:
+            self.scan_session.db = VidPidDB(db_file)
+            self.scan_session.db_file = db_file
         self.logger.always('loaded %d entries' % len(self.scan_session.db))
 
     def build_db_from_vid_pid(self, vid_pid):
@@ -179,6 +191,8 @@ class Umap2VSScanApp(Umap2App):
                 self.logger.always('Resume file found. Loading scan data')
                 with open(self.resume_file, 'rb') as rf:
                     self.scan_session = cPickle.load(rf)
+                if getattr(self.scan_session, 'db_file', None):
+                    self.scan_session.db = VidPidDB(self.scan_session.db_file)
         else:
             db_file = self.options['--db']
             vid_pid = self.options['--vid_pid']
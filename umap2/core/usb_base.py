@@ -30,6 +30,13 @@ class USBBaseActor(object):
         '''
         return self.app.get_mutation(stage, data)
 
+    def is_stage_active(self, stage):
+        '''
+        :param stage: stage name
+        :return: whether a mutation should be requested for this stage
+        '''
+        return self.app.is_stage_active(stage)
+
     def send_on_endpoint(self, ep, data):
         '''
         Send data on a given endpoint
@@ -44,6 +44,8 @@ class USBDevice(USBBaseActor):
             descriptors = {}
         self.supported_device_class_trigger = False
         self.supported_device_class_count = 0
+        # the control request that is being handled (None between requests)
+        self.current_request = None
 
         self.strings = []
 
@@ -196,6 +198,7 @@ class USBDevice(USBBaseActor):
     def handle_request(self, buf):
         req = USBDeviceRequest(buf)
         self.debug('Received request: %s' % req)
+        self.app.signal_request_received(req)
 
         # figure out the intended recipient
         req_type = req.get_type()
@@ -246,11 +249,14 @@ class USBDevice(USBBaseActor):
                 self.error('0x%02x: %s' % (k, handler_entity.request_handlers[k]))
             self.error('invalid handler, stalling')
             self.phy.stall_ep0()
+        self.current_request = req
         try:
             handler(req)
         except:
             traceback.print_exc()
             raise
+        finally:
+            self.current_request = None
 
     def default_handler(self, req):
         """
@@ -260,6 +266,7 @@ class USBDevice(USBBaseActor):
         self.debug('Received an unknown device request: %s, returned an empty response' % req)
 
     def handle_data_available(self, ep_num, data):
+        self.app.signal_data_received(ep_num)
         if self.state == State.configured and ep_num in self.endpoints:
             self.usb_function_supported('data received on endpoint %#x' % (ep_num))
             endpoint = self.endpoints[ep_num]
@@ -267,6 +274,7 @@ class USBDevice(USBBaseActor):
                 endpoint.handler(data)
 
     def handle_buffer_available(self, ep_num):
+        self.app.signal_buffer_available(ep_num)
         if self.state == State.configured and ep_num in self.endpoints:
             endpoint = self.endpoints[ep_num]
             if callable(endpoint.handler):
@@ -305,7 +313,7 @@ class USBDevice(USBBaseActor):
         self.state = State.address
         self.ack_status_stage()
 
-        self.verbose('Received SET_ADDRESS request for address', self.address)
+        self.verbose('Received SET_ADDRESS request for address %d' % self.address)
 
     # USB 2.0 specification, section 9.4.3 (p 281 of pdf)
     def handle_get_descriptor_request(self, req):
@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+'''
+Fuzzing throughput benchmark
+
+Runs the whole fuzzing loop - fuzzer, controller triggers, mutation requests,
+the mutable hooks of the device and the reconnections - in this process,
+against the simulated host of the loopback phy.
+With the rpc and binary transports the fuzzer is served (on the loopback interface
+or a unix socket) and the stack connects to it, as with umap2kitty and umap2fuzz.
+Each template family (module of umap2.fuzz.templates) is benchmarked
+with a device whose emulation reaches the stages of the family:
+the stages are recorded with the simulated host (like ``umap2stages -P loopback:once``),
+and the fuzzer is started with the stages of the family only.
+
+The results are printed as JSON, for each family:
+tests per second (in total and per stage), time spent in each phase
+(mutation requests, rendering, disconnection / reconnection, enumeration)
+and percentiles of the time of a test.
+
+Usage:
+    umap2bench [-f <family>]... [-n <tests>] [-c <count>] [-t <transport>] [-o <file>] [-v ...]
+
+Options:
+    -f --family <family>        template family to benchmark (default: all the families)
+    -n --tests <tests>          number of tests to run for each family [default: 50]
+    -c --count <count>          stage count [default: 2]
+    -t --transport <transport>  how the stack gets the mutations: rpc (JSON-RPC fuzzer server, like umap2kitty),
+                                binary (binary protocol fuzzer server, like umap2kitty -b)
+                                or local (fuzzer in the stack, like umap2fuzz -s) [default: binary]
+    -o --output <file>          write the results to a file instead of printing them
+    -v --verbose                verbosity level
+
+Families:
+    audio, cdc, enum, hid, hub, mass_storage, smart_card
+    (mass_storage requires a disk image called stick.img in the running directory)
+'''
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import docopt
+from umap2.apps.fuzz import Umap2FuzzApp
+from umap2.apps.makestages import Umap2MakeStagesApp
+from umap2.fuzz.templates import STAGE_MODULES
+
+
+#: device class to emulate for each template family
+FAMILY_DEVICES = {
+    'audio': 'audio',
+    'cdc': 'cdc_acm',
+    'enum': 'keyboard',
+    'hid': 'keyboard',
+    'hub': 'hub',
+    'mass_storage': 'mass_storage',
+    'smart_card': 'smartcard',
+}
+
+
+def percentile(samples, p):
+    '''
+    :param samples: list of numbers
+    :param p: percentile (0-100)
+    :return: the p percentile of the samples (nearest rank), None if there are no samples
+    '''
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[max(0, int(math.ceil(len(ordered) * p / 100.0)) - 1)]
+
+
+class PhaseTimer(object):
+    '''
+    Accumulate the time spent in methods of the benchmarked objects, by phase.
+    When a timed method calls another method of the same phase,
+    only the outer call is counted.
+    '''
+
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+        self.local = threading.local()
+
+    def add(self, phase, duration):
+        self.totals[phase] = self.totals.get(phase, 0.0) + duration
+        self.counts[phase] = self.counts.get(phase, 0) + 1
+
+    def wrap(self, obj, name, phase):
+        '''
+        Time the calls to a method of an object
+
+        :param obj: the object
+        :param name: method name
+        :param phase: phase to add the time to
+        '''
+        func = getattr(obj, name)
+
+        def timed(*args, **kwargs):
+            active = self.local.__dict__.setdefault('active', set())
+            if phase in active:
+                return func(*args, **kwargs)
+            active.add(phase)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(phase, time.time() - start)
+                active.discard(phase)
+
+        setattr(obj, name, timed)
+
+    def get_stats(self):
+        '''
+        :return: dictionary of phase -> {'total': .., 'count': .., 'mean': ..}
+        '''
+        return dict(
+            (phase, {
+                'total': total,
+                'count': self.counts[phase],
+                'mean': total / self.counts[phase],
+            }) for phase, total in self.totals.items()
+        )
+
+
+class TestTimer(object):
+    '''
+    Time the tests of the fuzzer, from the pre_test to the post_test of the controller
+    '''
+
+    def __init__(self, fuzzer):
+        '''
+        :param fuzzer: the kitty fuzzer
+        '''
+        self.fuzzer = fuzzer
+        self.start = None
+        self.stage = None
+        # list of (fuzzed stage, duration)
+        self.tests = []
+        controller = fuzzer.target.controller
+        pre_test = controller.pre_test
+        post_test = controller.post_test
+
+        def timed_pre_test(test_number):
+            self.start = time.time()
+            sequence = self.fuzzer.model.get_sequence()
+            self.stage = sequence[-1].dst.name if sequence else None
+            return pre_test(test_number)
+
+        def timed_post_test():
+            try:
+                return post_test()
+            finally:
+                if self.start is not None:
+                    self.tests.append((self.stage, time.time() - self.start))
+                    self.start = None
+
+        controller.pre_test = timed_pre_test
+        controller.post_test = timed_post_test
+
+    def get_stats(self):
+        '''
+        :return: dictionary with the percentiles of the test time and the test rate of each stage
+        '''
+        durations = [duration for _, duration in self.tests]
+        stages = {}
+        for stage, duration in self.tests:
+            stats = stages.setdefault(stage, {'tests': 0, 'time': 0.0})
+            stats['tests'] += 1
+            stats['time'] += duration
+        for stats in stages.values():
+            stats['tests_per_second'] = stats['tests'] / stats['time'] if stats['time'] else None
+        return {
+            'latency': {
+                'p50': percentile(durations, 50),
+                'p99': percentile(durations, 99),
+                'max': max(durations) if durations else None,
+            },
+            'stages': stages,
+        }
+
+
+class BenchmarkFuzzApp(Umap2FuzzApp):
+    '''
+    Fuzzing stack that stops when the session of the fuzzer is done,
+    and times the mutation requests and the enumerations of the simulated host
+    '''
+
+    def __init__(self, options, phases, time_fuzzer, session_fuzzer=None):
+        '''
+        :param options: app options
+        :param phases: PhaseTimer
+        :param time_fuzzer: function that times the kitty fuzzer before it is started,
+            returns a TestTimer
+        :param session_fuzzer: the kitty fuzzer of the session,
+            if it runs out of this app (default: None, run the fuzzer in this app)
+        '''
+        super(BenchmarkFuzzApp, self).__init__(None)
+        self.options = options
+        self.phases = phases
+        self.time_fuzzer = time_fuzzer
+        self.session_fuzzer = session_fuzzer
+        self.test_timer = None
+
+    def load_phy(self, phy_string):
+        phy = super(BenchmarkFuzzApp, self).load_phy(phy_string)
+        session = phy.host.session
+        phases = self.phases
+
+        def timed_session(bus):
+            start = time.time()
+            for step in session(bus):
+                yield step
+            phases.add('enumeration', time.time() - start)
+
+        phy.host.session = timed_session
+        return phy
+
+    def create_local_fuzzer(self, channel):
+        fuzzer = super(BenchmarkFuzzApp, self).create_local_fuzzer(channel)
+        self.session_fuzzer = fuzzer
+        self.test_timer = self.time_fuzzer(fuzzer)
+        return fuzzer
+
+    def get_fuzzer(self):
+        fuzzer = super(BenchmarkFuzzApp, self).get_fuzzer()
+        for name in ['get_mutation', 'prefetch']:
+            if hasattr(fuzzer, name):
+                self.phases.wrap(fuzzer, name, 'request')
+        return fuzzer
+
+    def is_session_done(self):
+        return self.session_fuzzer is not None and self.session_fuzzer.is_done()
+
+
+def record_stages(device, stage_file):
+    '''
+    Record the stages of an emulation of the device with the simulated host
+
+    :param device: device class
+    :param stage_file: path of the stage file
+    :return: list of the stages
+    '''
+    from umap2.fuzz.fuzz_engine import read_stages
+    app = Umap2MakeStagesApp(None)
+    app.options = {'--phy': 'loopback:once', '--class': device, '--stage-file': stage_file}
+    app.run()
+    return read_stages(stage_file)
+
+
+def run_family(family, options, workdir):
+    '''
+    Benchmark the fuzzing of a template family
+
+    :param family: template family
+    :param options: benchmark options
+    :param workdir: directory for the session files
+    :return: dictionary of results
+    '''
+    from kitty.remote.rpc import RpcClient, RpcServer
+    from umap2.fuzz.fuzz_engine import get_fuzzer
+    from umap2.fuzz.transport import BinaryFuzzerServer
+    device = FAMILY_DEVICES[family]
+    if device == 'mass_storage' and not os.path.isfile('stick.img'):
+        return {'device': device, 'skipped': 'the mass storage device requires a disk image called stick.img'}
+    recorded = record_stages(device, os.path.join(workdir, '%s.recorded' % family))
+    stages = [stage for stage in recorded if STAGE_MODULES.get(stage) == family]
+    result = {'device': device, 'phy': 'loopback', 'stages': sorted(set(stages))}
+    if not stages:
+        result['skipped'] = 'the emulation of %s does not reach the stages of %s' % (device, family)
+        return result
+    stage_file = os.path.join(workdir, '%s.stages' % family)
+    with open(stage_file, 'w') as f:
+        f.write(''.join('%s\n' % stage for stage in stages))
+    fuzz_options = {
+        '--stage-file': stage_file,
+        '--count': options['--count'],
+        '--disconnect-delays': '0.0,0.0',
+        '--kitty-options': '--test-list=0-%d --session=%s --no-env-test' % (
+            int(options['--tests']) - 1, os.path.join(workdir, '%s.db' % family)
+        ),
+    }
+    phases = PhaseTimer()
+
+    def time_fuzzer(fuzzer):
+        for name in ['get_mutation', 'get_test_mutations']:
+            phases.wrap(fuzzer, name, 'render')
+        controller = fuzzer.target.controller
+        for name in ['trigger', 'trigger_connect', 'trigger_disconnect']:
+            phases.wrap(controller, name, 'reconnect')
+        return TestTimer(fuzzer)
+
+    app_options = {'--phy': 'loopback', '--class': device}
+    fuzzer = None
+    stop_server = None
+    if options['--transport'] == 'local':
+        app_options.update(fuzz_options)
+        app = BenchmarkFuzzApp(app_options, phases, time_fuzzer)
+    else:
+        fuzzer = get_fuzzer(fuzz_options)
+        if options['--transport'] == 'rpc':
+            server = RpcServer(host='127.0.0.1', port=0, impl=fuzzer)
+            port = server.server.server_address[1]
+            app_options.update({'--fuzzer-ip': '127.0.0.1', '--fuzzer-port': str(port)})
+            # the server handles one request at a time, the stop request unblocks it
+            stop_server = lambda: RpcClient(host='127.0.0.1', port=port).stop_remote_server()
+        elif options['--transport'] == 'binary':
+            address = 'unix:%s' % os.path.join(workdir, '%s.sock' % family)
+            server = BinaryFuzzerServer(address, impl=fuzzer, logger=fuzzer.logger)
+            app_options['--binary'] = address
+            stop_server = server.stop
+        else:
+            raise Exception('Unknown transport %s (transports: rpc, binary, local)' % (options['--transport']))
+        app = BenchmarkFuzzApp(app_options, phases, time_fuzzer, session_fuzzer=fuzzer)
+        app.test_timer = time_fuzzer(fuzzer)
+        server_thread = threading.Thread(target=server.start)
+        server_thread.daemon = True
+        server_thread.start()
+        fuzzer.start()
+    start = time.time()
+    try:
+        app.run()
+    finally:
+        duration = time.time() - start
+        if fuzzer is not None:
+            fuzzer.stop()
+            stop_server()
+            server_thread.join()
+    tests = app.test_timer
+    phase_stats = phases.get_stats()
+    # the time of the mutation requests includes the rendering, which is done on the fuzzer side
+    if 'request' in phase_stats:
+        render = phase_stats.get('render', {}).get('total', 0.0)
+        phase_stats['rpc'] = {'total': max(0.0, phase_stats.pop('request')['total'] - render)}
+    result.update(tests.get_stats())
+    result.update({
+        'tests': len(tests.tests),
+        'duration': duration,
+        'tests_per_second': len(tests.tests) / duration if duration else None,
+        'phases': phase_stats,
+    })
+    return result
+
+
+def main():
+    options = docopt.docopt(__doc__)
+    families = options['--family'] or sorted(FAMILY_DEVICES)
+    for family in families:
+        if family not in FAMILY_DEVICES:
+            raise Exception('Unknown template family %s (families: %s)' % (family, ', '.join(sorted(FAMILY_DEVICES))))
+    results = {'transport': options['--transport'], 'tests': int(options['--tests']), 'families': {}}
+    workdir = tempfile.mkdtemp()
+    stdout = sys.stdout
+    if not options['--output']:
+        # kitty's RpcServer prints its address, only the results are printed on stdout
+        sys.stdout = sys.stderr
+    try:
+        for family in families:
+            results['families'][family] = run_family(family, options, workdir)
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(workdir)
+    output = json.dumps(results, indent=4, sort_keys=True)
+    if options['--output']:
+        with open(options['--output'], 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
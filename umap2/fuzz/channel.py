@@ -0,0 +1,377 @@
+'''
+Control channel between the fuzzer (UmapController) and the Umap2 stack
+
+The channel is a Unix domain socket, the controller listens on it
+and the stack (Umap2FuzzApp) connects to it.
+Messages are newline terminated lines of the form ``<command> [payload]``.
+
+Commands from the controller to the stack:
+
+- ``disconnect`` - disconnect the device
+- ``connect`` - (re)connect the device
+- ``stages <json list>`` - the stages that are active in the current test,
+  mutations for other stages are not requested from the fuzzer
+
+The stack acknowledges each command with ``ack <command>``.
+Other messages from the stack (e.g. events) are passed to handlers
+that are registered on the controller side.
+
+If the channel is not available, the controller and the stack fall back
+to the trigger files in /tmp/umap_kitty.
+
+When the fuzzer runs inside the stack's process, the LocalChannelServer
+and its LocalChannelClient pass the same messages through in-memory queues.
+'''
+import os
+import select
+import socket
+import threading
+import time
+
+from six.moves.queue import Queue, Empty
+
+
+DEFAULT_CONTROL_SOCKET = '/tmp/umap_kitty/control.sock'
+
+CMD_CONNECT = 'connect'
+CMD_DISCONNECT = 'disconnect'
+CMD_STAGES = 'stages'
+CMD_ACK = 'ack'
+
+
+class ChannelEndpoint(object):
+    '''
+    Message framing over a connected stream socket
+    '''
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buff = b''
+        self.send_lock = threading.Lock()
+        self.closed = False
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, cmd, payload=''):
+        line = ('%s %s' % (cmd, payload) if payload else cmd).encode('utf-8') + b'\n'
+        with self.send_lock:
+            self.sock.sendall(line)
+
+    def _pop_message(self):
+        if b'\n' not in self.buff:
+            return None
+        line, self.buff = self.buff.split(b'\n', 1)
+        parts = line.decode('utf-8').split(' ', 1)
+        return (parts[0], parts[1] if len(parts) > 1 else '')
+
+    def recv(self, timeout=None):
+        '''
+        :param timeout: timeout in seconds (default: None, block until a message is received)
+        :return: tuple of (command, payload), None if no message was received
+        :raises: socket.error if the channel was closed
+        '''
+        end = None if timeout is None else time.time() + timeout
+        while True:
+            msg = self._pop_message()
+            if msg is not None:
+                return msg
+            remaining = None if end is None else max(0, end - time.time())
+            readable, _, _ = select.select([self.sock], [], [], remaining)
+            if not readable:
+                return None
+            data = self.sock.recv(4096)
+            if not data:
+                self.closed = True
+                raise socket.error('control channel closed')
+            self.buff += data
+
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+
+class ControlChannelServer(object):
+    '''
+    Controller side of the channel
+    '''
+
+    def __init__(self, path=DEFAULT_CONTROL_SOCKET, logger=None):
+        '''
+        :param path: path of the unix socket (default: /tmp/umap_kitty/control.sock)
+        :param logger: logger (default: None)
+        '''
+        self.path = path
+        self.logger = logger
+        self.sock = None
+        self.client = None
+        self.acks = Queue()
+        self.handlers = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def add_handler(self, cmd, handler):
+        '''
+        :param cmd: command from the stack
+        :param handler: callable, called with the payload of the message
+        '''
+        self.handlers[cmd] = handler
+
+    def start(self):
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        self.sock.listen(1)
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.client:
+            self.client.close()
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def is_connected(self):
+        return self.client is not None and not self.client.closed
+
+    def _serve(self):
+        while not self.stop_event.is_set():
+            try:
+                readable, _, _ = select.select([self.sock], [], [], 0.1)
+                if not readable:
+                    continue
+                conn, _ = self.sock.accept()
+            except (socket.error, ValueError, AttributeError):
+                break
+            if self.client:
+                self.client.close()
+            self.client = ChannelEndpoint(conn)
+            self._log('info', 'Umap2 stack connected to the control channel')
+            self._read_messages(self.client)
+
+    def _read_messages(self, client):
+        while not self.stop_event.is_set() and not client.closed:
+            try:
+                msg = client.recv(0.1)
+            except (socket.error, ValueError):
+                self._log('warning', 'Umap2 stack disconnected from the control channel')
+                break
+            if msg is None:
+                continue
+            self.dispatch(*msg)
+
+    def dispatch(self, cmd, payload):
+        '''
+        Handle a message from the stack,
+        an exception in a handler is logged and does not stop the handling of the next messages
+        '''
+        if cmd == CMD_ACK:
+            self.acks.put(payload)
+        elif cmd in self.handlers:
+            try:
+                self.handlers[cmd](payload)
+            except Exception:
+                self._log('exception', 'Failed to handle the message %s from the stack' % (cmd))
+        else:
+            self._log('warning', 'Unknown message from the stack: %s' % (cmd))
+
+    def send(self, cmd, payload=''):
+        '''
+        Send a message to the stack without waiting for an ack
+
+        :return: True if the message was sent
+        '''
+        if not self.is_connected():
+            return False
+        try:
+            self.client.send(cmd, payload)
+        except socket.error:
+            return False
+        return True
+
+    def send_command(self, cmd, timeout=None, payload=''):
+        '''
+        Send a command to the stack and wait for it to be acknowledged
+
+        :param cmd: the command
+        :param timeout: how long to wait for the ack (default: None, wait until the channel is closed)
+        :param payload: command payload (default: '')
+        :return: True if the command was acknowledged
+        '''
+        while not self.acks.empty():
+            self.acks.get_nowait()
+        if not self.send(cmd, payload):
+            return False
+        end = None if timeout is None else time.time() + timeout
+        count = 0
+        while self.is_connected():
+            try:
+                if self.acks.get(True, 1) == cmd:
+                    return True
+            except Empty:
+                count += 1
+                if count % 10 == 0:
+                    self._log('warning', 'still waiting for umap_stack to ack %s' % (cmd))
+            if end is not None and time.time() > end:
+                break
+        return False
+
+    def _log(self, level, msg):
+        if self.logger:
+            getattr(self.logger, level)(msg)
+
+
+class ControlChannelClient(object):
+    '''
+    Stack side of the channel.
+    Messages are read by a background thread,
+    so checking for pending commands does not require any syscall.
+    '''
+
+    def __init__(self, path=DEFAULT_CONTROL_SOCKET):
+        '''
+        :param path: path of the unix socket (default: /tmp/umap_kitty/control.sock)
+        '''
+        self.path = path
+        self.endpoint = None
+        self.messages = Queue()
+        self.thread = None
+
+    def connect(self):
+        '''
+        :return: True if connected to the controller
+        '''
+        if not os.path.exists(self.path):
+            return False
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except socket.error:
+            sock.close()
+            return False
+        self.endpoint = ChannelEndpoint(sock)
+        self.messages = Queue()
+        self.thread = threading.Thread(target=self._read_messages, args=(self.endpoint, self.messages))
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    def _read_messages(self, endpoint, messages):
+        while not endpoint.closed:
+            try:
+                msg = endpoint.recv(0.5)
+            except (socket.error, ValueError):
+                endpoint.closed = True
+                break
+            if msg is not None:
+                messages.put(msg)
+        # wake up readers that are blocked on the queue
+        messages.put(None)
+
+    def is_connected(self):
+        return self.endpoint is not None and not self.endpoint.closed
+
+    def has_messages(self):
+        return not self.messages.empty()
+
+    def close(self):
+        if self.endpoint:
+            self.endpoint.close()
+        self.endpoint = None
+
+    def recv(self, timeout=0):
+        '''
+        :param timeout: timeout in seconds (0: don't block, None: block until a message is received)
+        :return: tuple of (command, payload), None if there is no message or the channel was closed
+        '''
+        try:
+            if timeout == 0:
+                return self.messages.get_nowait()
+            return self.messages.get(True, timeout)
+        except Empty:
+            return None
+
+    def send(self, cmd, payload=''):
+        if not self.is_connected():
+            return False
+        try:
+            self.endpoint.send(cmd, payload)
+        except socket.error:
+            self.close()
+            return False
+        return True
+
+    def ack(self, cmd):
+        return self.send(CMD_ACK, cmd)
+
+
+class LocalChannelServer(ControlChannelServer):
+    '''
+    Controller side of an in-process channel,
+    the stack side is the server's client attribute
+    '''
+
+    def __init__(self, logger=None):
+        '''
+        :param logger: logger (default: None)
+        '''
+        super(LocalChannelServer, self).__init__(None, logger)
+        self.client = LocalChannelClient(self)
+
+    def start(self):
+        self.stop_event.clear()
+
+    def stop(self):
+        self.stop_event.set()
+        # wake up the stack if it is waiting for a command
+        self.client.messages.put(None)
+
+    def is_connected(self):
+        return not self.stop_event.is_set()
+
+    def send(self, cmd, payload=''):
+        if not self.is_connected():
+            return False
+        self.client.messages.put((cmd, payload))
+        return True
+
+
+class LocalChannelClient(ControlChannelClient):
+    '''
+    Stack side of an in-process channel
+    '''
+
+    def __init__(self, server):
+        '''
+        :type server: :class:`~umap2.fuzz.channel.LocalChannelServer`
+        :param server: the controller side of the channel
+        '''
+        super(LocalChannelClient, self).__init__(None)
+        self.server = server
+
+    def connect(self):
+        return self.server.is_connected()
+
+    def is_connected(self):
+        return self.server.is_connected()
+
+    def close(self):
+        pass
+
+    def send(self, cmd, payload=''):
+        if not self.is_connected():
+            return False
+        self.server.dispatch(cmd, payload)
+        return True
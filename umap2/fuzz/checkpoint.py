@@ -0,0 +1,146 @@
+'''
+Crash-safe journal of a fuzzing session
+
+The journal is an append-only file of JSON lines, each line is written
+and synced to the disk before the next test starts:
+
+- ``{"type": "session", ...}`` - the stages (content of the stage file),
+  stage count and hash of the model, written once when the session starts
+- ``{"type": "start", "test": ..., "stage": ..., "time": ...}`` -
+  written before each test
+- ``{"type": "test", "test": ..., "stage": ..., "failed": ..., "reason": ...}`` -
+  written after each test
+
+If the fuzzer, the stack or the whole machine dies, the session is resumed
+from the journal at the test after the last one that was completed,
+without the stage file and without running the earlier tests.
+A test that was started but not completed probably crashed or hung the host,
+it is recorded as a failure when the session is resumed, and is not run again.
+A line that was cut by the crash is ignored.
+'''
+import json
+import os
+import time
+
+
+class SessionJournal(object):
+
+    def __init__(self, path):
+        '''
+        :param path: path of the journal, the session in it (if any) is loaded
+        '''
+        self.path = path
+        self.stage_file = None
+        self.stages = None
+        self.count = None
+        self.model_hash = None
+        self.last_test = None
+        # (test, stage, start time) of the test that was started and not completed, if any
+        self.unfinished = None
+        self.tests = 0
+        # list of (test, stage, reason)
+        self.failures = []
+        # stage -> {'tests': ..., 'failures': ...}
+        self.stats = {}
+        # the last line was cut, the next record starts on a new line
+        self.cut_line = False
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, 'r') as f:
+            lines = f.read().split('\n')
+        self.cut_line = lines[-1] != ''
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record['type'] == 'session':
+                self.stage_file = record['stage_file']
+                self.stages = record['stages']
+                self.count = record['count']
+                self.model_hash = record['model_hash']
+            elif record['type'] == 'start':
+                self.unfinished = (record['test'], record['stage'], record['time'])
+            elif record['type'] == 'test':
+                self._update(record)
+
+    def _update(self, record):
+        self.last_test = record['test']
+        self.unfinished = None
+        self.tests += 1
+        stats = self.stats.setdefault(record['stage'], {'tests': 0, 'failures': 0})
+        stats['tests'] += 1
+        if record['failed']:
+            stats['failures'] += 1
+            self.failures.append((record['test'], record['stage'], record['reason']))
+
+    def _append(self, record):
+        with open(self.path, 'a') as f:
+            if self.cut_line:
+                f.write('\n')
+                self.cut_line = False
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def is_resumed(self):
+        '''
+        :return: whether the journal has a session to resume
+        '''
+        return self.stages is not None
+
+    def next_test(self):
+        '''
+        :return: index of the first test that was not completed
+        '''
+        if self.unfinished is not None:
+            return self.unfinished[0]
+        return 0 if self.last_test is None else self.last_test + 1
+
+    def start_session(self, stage_file, stages, count, model_hash):
+        '''
+        Start a new session, or check that the resumed session matches the model
+
+        :param stage_file: path of the stage file
+        :param stages: stages from the stage file
+        :param count: stage count
+        :param model_hash: hash of the model
+        '''
+        if self.is_resumed():
+            if model_hash != self.model_hash:
+                raise Exception('The model does not match the session in the journal %s' % (self.path))
+            return
+        self.stage_file = stage_file
+        self.stages = stages
+        self.count = count
+        self.model_hash = model_hash
+        self._append({
+            'type': 'session',
+            'time': time.time(),
+            'stage_file': stage_file,
+            'stages': stages,
+            'count': count,
+            'model_hash': model_hash,
+        })
+
+    def start_test(self, test, stage):
+        '''
+        :param test: index of the test that is about to run
+        :param stage: the fuzzed stage
+        '''
+        record = {'type': 'start', 'test': test, 'stage': stage, 'time': time.time()}
+        self._append(record)
+        self.unfinished = (test, stage, record['time'])
+
+    def record_test(self, test, stage, failed, reason=None):
+        '''
+        :param test: index of the completed test
+        :param stage: the fuzzed stage
+        :param failed: whether the test failed
+        :param reason: failure reason (default: None)
+        '''
+        record = {'type': 'test', 'test': test, 'stage': stage, 'failed': failed, 'reason': reason}
+        self._append(record)
+        self._update(record)
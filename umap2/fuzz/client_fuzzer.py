@@ -0,0 +1,289 @@
+'''
+Kitty client fuzzer for the Umap stack
+
+Extends kitty's ClientFuzzer with a batched API, so the stack can fetch
+the mutations of the current test once (before the device is connected)
+and serve the EP0 requests from memory,
+instead of blocking on an RPC call for each request.
+'''
+import json
+import time
+from binascii import hexlify
+
+from kitty.data.report import Report
+from kitty.fuzzers import ClientFuzzer
+from kitty.model.low_level.container import Container
+from kitty.model.low_level.field import Dynamic
+
+
+def uses_session_data(node):
+    '''
+    :param node: kitty template (or any other field)
+    :return: whether the rendered node depends on session data from the stack
+    '''
+    if isinstance(node, Dynamic):
+        return True
+    if isinstance(node, Container):
+        return any(uses_session_data(field) for field in node._fields)
+    return False
+
+
+def reset_model(model):
+    '''
+    Move a kitty GraphModel back to its initial state,
+    so it can be moved to a lower test index
+    '''
+    model._get_ready()
+    for sequence in model._sequences:
+        for edge in sequence:
+            edge.dst.reset()
+    model._current_index = -1
+    model._sequence_idx = -1
+    model._update_state(0)
+
+
+class Umap2ClientFuzzer(ClientFuzzer):
+
+    def __init__(self, name='Umap2ClientFuzzer', logger=None, option_line=None):
+        '''
+        :param name: name of the object
+        :param logger: logger for the object (default: None)
+        :param option_line: cmd line options to the fuzzer
+        '''
+        super(Umap2ClientFuzzer, self).__init__(name, logger, option_line)
+        self.journal = None
+        self.corpus = None
+        self.dedup = None
+        self.results = None
+        self._test_start = None
+        self._sequence = None
+
+    def set_journal(self, journal):
+        '''
+        :type journal: :class:`~umap2.fuzz.checkpoint.SessionJournal`
+        :param journal: journal to record each started and completed test in
+        '''
+        self.journal = journal
+
+    def set_corpus(self, corpus):
+        '''
+        :type corpus: :class:`~umap2.fuzz.corpus.MutationCorpus`
+        :param corpus: pre-rendered mutations of the model, served instead of rendering the templates
+        '''
+        if corpus.model_hash != self.model.hash():
+            raise Exception('The corpus %s was rendered from another model' % (corpus.path))
+        self.corpus = corpus
+
+    def set_dedup(self, dedup):
+        '''
+        :type dedup: :class:`~umap2.fuzz.dedup.PayloadDeduplicator`
+        :param dedup: skip the tests whose effective payload was already sent
+        '''
+        self.dedup = dedup
+
+    def set_results(self, results):
+        '''
+        :type results: :class:`~umap2.fuzz.results.ResultStore`
+        :param results: results file to record each completed test in (with a started campaign)
+        '''
+        self.results = results
+
+    def report_request_sequence(self, payload):
+        '''
+        Called by the controller with the request sequence of the current test
+
+        :param payload: sequence message payload (json)
+        '''
+        self._sequence = json.loads(payload)
+
+    def report_lengths(self, payload):
+        '''
+        Called by the controller with the lengths that the host requested in the last test
+
+        :param payload: lengths message payload (json)
+        '''
+        if self.dedup:
+            self.dedup.update_lengths(json.loads(payload))
+
+    def _next_mutation(self):
+        while self._next_test():
+            if self._is_unfinished():
+                self._record_unfinished()
+                continue
+            if self.dedup is None or not self._is_duplicate():
+                return True
+            self.logger.debug('skipping test %d, its payload was already sent' % (self.model.current_index()))
+        return False
+
+    def _next_test(self):
+        '''
+        Move the model to the next test, subclasses that change the order of the tests override this
+
+        :return: True if mutated, False otherwise
+        '''
+        return super(Umap2ClientFuzzer, self)._next_mutation()
+
+    def _is_duplicate(self):
+        node = self.model.get_sequence()[-1].dst
+        payload = self._render_payload(node)
+        if payload is None:
+            return False
+        return self.dedup.is_duplicate(node.name, payload)
+
+    def _render_payload(self, node):
+        '''
+        :param node: the fuzzed node of the current test
+        :return: the mutation of the node, None if it depends on the request or on session data
+        '''
+        if node.name == ClientFuzzer.STAGE_ANY or uses_session_data(node):
+            return None
+        payload = self._get_corpus_payload(node.name)
+        if payload is None:
+            payload = node.render().tobytes()
+        return payload
+
+    def _is_unfinished(self):
+        '''
+        :return: whether the current test was started and not completed in the journaled session
+        '''
+        if self.journal is None or self.journal.unfinished is None:
+            return False
+        return self.journal.unfinished[0] == self.model.current_index()
+
+    def _record_unfinished(self):
+        '''
+        Record the test that was running when the journaled session stopped as a failure,
+        without running it again (it probably crashed or hung the host)
+        '''
+        test, stage, start = self.journal.unfinished
+        reason = 'the session stopped during the test'
+        self.logger.warning('test %d was not completed in the journaled session, recording it as a failure' % test)
+        node = self.model.get_sequence()[-1].dst
+        payload = self._render_payload(node)
+        self._last_payload = payload
+        fuzzer_report = Report(self.get_name())
+        fuzzer_report.add('stages', [stage])
+        fuzzer_report.add('payloads', [None if payload is None else hexlify(payload)])
+        report = Report(self.get_name())
+        report.failed(reason)
+        report.add('fuzzer', fuzzer_report)
+        self._store_report(report)
+        self.session_info.failure_count += 1
+        self._store_session()
+        self.journal.record_test(test, stage, True, reason)
+        if self.results:
+            self.results.add_test(test, stage, payload, start, None, None, True, reason)
+
+    def _get_corpus_payload(self, stage):
+        '''
+        :return: pre-rendered mutation of the stage in the current test,
+            None if there is no corpus or the test is dynamic
+        '''
+        if self.corpus is None:
+            return None
+        return self.corpus.get_mutation(self.model.current_index(), stage)
+
+    def get_mutation(self, stage, data):
+        payload = self._get_corpus_payload(stage) if self._keep_running() else None
+        if payload is None:
+            return super(Umap2ClientFuzzer, self).get_mutation(stage, data)
+        # same as the base class, without rendering the node
+        if self._should_fuzz_node(self._fuzz_path[self._index_in_path].dst, stage):
+            self._last_payload = payload
+            if payload:
+                self._notify_mutated()
+        else:
+            self._update_path_index(stage)
+            payload = None
+        self._requested_stages.append((stage, payload))
+        return payload
+
+    def _pre_test(self):
+        self._test_start = time.time()
+        self._sequence = None
+        if self.journal and not self._in_environment_test:
+            self.journal.start_test(self.model.current_index(), self.model.get_sequence()[-1].dst.name)
+        super(Umap2ClientFuzzer, self)._pre_test()
+
+    def _post_test(self):
+        failed = super(Umap2ClientFuzzer, self)._post_test()
+        if self._in_environment_test or not (self.journal or self.results):
+            return failed
+        reason = self._get_report().get('reason') if failed else None
+        stage = self.model.get_sequence()[-1].dst.name
+        if self.journal:
+            self.journal.record_test(self.model.current_index(), stage, failed, reason)
+        if self.results:
+            payloads = [payload for _, payload in self._requested_stages if payload is not None]
+            self.results.add_test(
+                self.model.current_index(),
+                stage,
+                payloads[0] if payloads else None,
+                self._test_start,
+                time.time() - self._test_start,
+                self._sequence,
+                failed,
+                reason
+            )
+        return failed
+
+    def stop(self):
+        super(Umap2ClientFuzzer, self).stop()
+        if self.results:
+            self.results.close()
+            self.results = None
+
+    def get_test_mutations(self):
+        '''
+        Get all the mutations of the current test in a single call.
+
+        :return: dictionary with the test number (``test``),
+            the names of the stages in the fuzzing path (``stages``)
+            and the mutations of the path, stage -> payload (``mutations``).
+            ``mutations`` is None if the mutation depends on session data,
+            so the stack should call get_mutation for each stage.
+            Returns None if there is no test in progress.
+        '''
+        if not self._keep_running() or not getattr(self, '_fuzz_path', None):
+            return None
+        stages = [edge.dst.name for edge in self._fuzz_path]
+        fuzz_node = self._fuzz_path[-1].dst
+        mutations = None
+        payload = self._get_corpus_payload(fuzz_node.name)
+        if payload is None and fuzz_node.name != ClientFuzzer.STAGE_ANY and not uses_session_data(fuzz_node):
+            payload = fuzz_node.render().tobytes()
+        if payload is not None:
+            self._last_payload = payload
+            mutations = {fuzz_node.name: payload}
+        return {
+            'test': self.model.current_index(),
+            'stages': stages,
+            'mutations': mutations,
+        }
+
+    def report_mutation(self, stage, test):
+        '''
+        Called by the stack when it used a prefetched mutation
+
+        :param stage: the mutated stage
+        :param test: the test number of the mutation
+        '''
+        if test != self.model.current_index():
+            self.logger.warning('stack reported a mutation of test %s during test %s' % (
+                test, self.model.current_index()
+            ))
+            return
+        self._requested_stages.append((stage, self._last_payload))
+        self._notify_mutated()
+
+    def _goto(self, index):
+        '''
+        Move the model to a given test,
+        for subclasses that do not run the tests in order
+        '''
+        if index <= self.model.current_index():
+            reset_model(self.model)
+        skip = index - self.model.current_index() - 1
+        if skip > 0:
+            self.model.skip(skip)
+        return self.model.mutate()
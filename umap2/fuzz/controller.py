@@ -1,19 +1,32 @@
 '''
 Kitty Controller for the Umap stack
 '''
+import json
 import os
 import time
 
 from kitty.controllers import ClientController
+from umap2.fuzz.channel import ControlChannelServer, CMD_CONNECT, CMD_DISCONNECT, CMD_STAGES
+from umap2.fuzz.dedup import CMD_LENGTHS
+from umap2.fuzz.feedback import CMD_SEQUENCE
+from umap2.fuzz.timing import CMD_TIMING
+from umap2.fuzz.watchdog import CMD_ALIVE, CMD_SILENT
 
 
 class UmapController(ClientController):
     '''
     Trigger a USB reconnection -
-    Signal the Umap to disconnect / reconnect using files.
+    Signal the Umap to disconnect / reconnect over the control channel,
+    or using files if the stack is not connected to the channel.
     '''
 
-    def __init__(self, pre_disconnect_delay=0.0, post_disconnect_delay=0.0):
+    def __init__(self, pre_disconnect_delay=0.0, post_disconnect_delay=0.0, control_socket=None, channel=None):
+        '''
+        :param pre_disconnect_delay: time to wait in post_test before disconnecting the device (default: 0.0)
+        :param post_disconnect_delay: time to wait in post_test after disconnecting the device (default: 0.0)
+        :param control_socket: path of the control channel socket (default: None, /tmp/umap_kitty/control.sock)
+        :param channel: control channel server to use instead of the socket (default: None)
+        '''
         super(UmapController, self).__init__('UmapController')
         self.trigger_dir = '/tmp/umap_kitty'
         self.connect_file = 'trigger_reconnect'
@@ -21,6 +34,126 @@ class UmapController(ClientController):
         self.heartbeat_file = 'heartbeat'
         self.pre_disconnect_delay = pre_disconnect_delay
         self.post_disconnect_delay = post_disconnect_delay
+        if channel is None:
+            if control_socket is None:
+                control_socket = os.path.join(self.trigger_dir, 'control.sock')
+            channel = ControlChannelServer(control_socket, self.logger)
+        self.channel = channel
+        self.channel.add_handler(CMD_ALIVE, self.handle_host_alive)
+        self.channel.add_handler(CMD_SILENT, self.handle_host_silent)
+        self.channel.add_handler(CMD_SEQUENCE, self.handle_request_sequence)
+        self.channel.add_handler(CMD_TIMING, self.handle_host_timing)
+        self.channel.add_handler(CMD_LENGTHS, self.handle_response_lengths)
+        self.last_alive = 0
+        self.host_silent = False
+        self.in_test = False
+        # the request sequence is part of the test from pre_test until the disconnection in post_test
+        self.record_sequence = False
+        self.silent_callbacks = []
+        self.sequence_callbacks = []
+        self.lengths_callbacks = []
+        self.stage_provider = None
+        self.reconnect_delay = 0.2
+        self.timing = None
+
+    def set_timing(self, timing):
+        '''
+        :type timing: :class:`~umap2.fuzz.timing.AdaptiveTiming`
+        :param timing: learn the delays from the timing of the host, instead of the fixed delays
+        '''
+        self.timing = timing
+
+    def get_delays(self):
+        '''
+        :return: tuple of (pre disconnect, post disconnect, reconnect) delays
+        '''
+        if self.timing:
+            return self.timing.get_delays()
+        return self.pre_disconnect_delay, self.post_disconnect_delay, self.reconnect_delay
+
+    def set_stage_provider(self, provider):
+        '''
+        :param provider: callable, returns the list of stages that are active in the current test
+            (None if all the stages should request mutations from the fuzzer)
+        '''
+        self.stage_provider = provider
+
+    def push_stages(self):
+        '''
+        Tell the stack which stages are active in the current test,
+        so it only requests mutations for those stages.
+        '''
+        if self.stage_provider is None or not self.channel.is_connected():
+            return
+        stages = self.stage_provider()
+        if not self.channel.send_command(CMD_STAGES, timeout=1, payload=json.dumps(stages)):
+            self.logger.warning('stack did not ack the active stages')
+
+    def add_silent_callback(self, callback):
+        '''
+        :param callback: callable, called (without arguments) when the host is silent during a test
+            (whether it is a failure or the host is idle after the enumeration)
+        '''
+        self.silent_callbacks.append(callback)
+
+    def add_sequence_callback(self, callback):
+        '''
+        :param callback: callable, called with the request sequence message
+            when the stack reports the requests of the host in a test
+        '''
+        self.sequence_callbacks.append(callback)
+
+    def add_lengths_callback(self, callback):
+        '''
+        :param callback: callable, called with the lengths message
+            when the stack reports the lengths that the host requested in a test
+        '''
+        self.lengths_callbacks.append(callback)
+
+    def handle_host_alive(self, payload):
+        self.last_alive = time.time()
+        self.host_silent = False
+
+    def handle_host_silent(self, payload):
+        silent = json.loads(payload)
+        silent_for = silent.get('silent_for', 0)
+        if silent.get('enumerated'):
+            # e.g. an idle HID host, or the mutated stage is not requested by the host
+            self.logger.info('host is idle for %.3f seconds after the enumeration' % (silent_for))
+        else:
+            reason = 'host is silent for %.3f seconds %s the mutation, before the enumeration is done' % (
+                silent_for, 'after' if silent.get('mutated') else 'before'
+            )
+            self.host_silent = True
+            self.logger.warning(reason)
+            if self.timing:
+                self.timing.host_silent()
+            if self.in_test:
+                self.report.failed(reason)
+        if self.in_test:
+            for callback in self.silent_callbacks:
+                callback()
+
+    def handle_request_sequence(self, payload):
+        # sent by the stack when the device is disconnected at the end of the test
+        if not self.record_sequence or self.report is None:
+            # e.g. the enumeration before the first test, disconnected by its pre_test
+            self.logger.debug('ignoring request sequence out of a test')
+            return
+        self.report.add('request sequence', json.loads(payload)['hash'])
+        for callback in self.sequence_callbacks:
+            callback(payload)
+
+    def handle_response_lengths(self, payload):
+        for callback in self.lengths_callbacks:
+            callback(payload)
+
+    def handle_host_timing(self, payload):
+        if self.timing:
+            self.timing.update(json.loads(payload))
+
+    def is_victim_alive(self):
+        return not self.host_silent
 
     def del_file(self, filename):
         path = os.path.join(self.trigger_dir, filename)
@@ -38,29 +171,58 @@ class UmapController(ClientController):
     def setup(self):
         super(UmapController, self).setup()
         self.cleanup_triggers()
+        self.channel.start()
+
+    def teardown(self):
+        self.channel.stop()
+        super(UmapController, self).teardown()
 
     def trigger_connect(self):
         self.logger.info('trigger reconnection')
-        self.do(self.connect_file)
+        self.do_command(CMD_CONNECT, self.connect_file)
 
     def trigger_disconnect(self):
         self.logger.info('trigger disconnection')
-        self.do(self.disconnect_file)
+        self.do_command(CMD_DISCONNECT, self.disconnect_file)
 
     def trigger(self):
         self.trigger_disconnect()
-        time.sleep(0.2)
+        time.sleep(self.get_delays()[2])
         self.trigger_connect()
 
-    def do(self, filename):
+    def do_command(self, cmd, filename):
+        '''
+        Send a command to the stack over the control channel,
+        fall back to a trigger file if the stack is not connected to the channel.
+        '''
+        if self.channel.is_connected():
+            if self.channel.send_command(cmd):
+                return
+            self.logger.warning('control channel failed, falling back to trigger files')
+        if not self.do(filename, stop_on_channel=True):
+            # the stack connected to the channel and no longer checks the trigger files
+            self.do_command(cmd, filename)
+
+    def do(self, filename, stop_on_channel=False):
+        '''
+        Create a trigger file and wait for the stack to remove it
+
+        :param filename: name of the trigger file
+        :param stop_on_channel: stop waiting (and remove the file) if the stack connects to the control channel
+        :return: whether the stack removed the file
+        '''
         count = 0
         path = os.path.join(self.trigger_dir, filename)
         open(path, 'a').close()
         while os.path.isfile(path):
+            if stop_on_channel and self.channel.is_connected():
+                self.del_file(filename)
+                return False
             time.sleep(0.01)
             count += 1
             if count % 1000 == 0:
                 self.logger.warning('still waiting for umap_stack to remove the file %s' % path)
+        return True
 
     def get_last_heartbeat(self):
         '''
@@ -68,6 +230,8 @@ class UmapController(ClientController):
         (via umap_stack).
         If no responses have ever been received from the victim, returns 0.
         '''
+        if self.last_alive:
+            return self.last_alive
         heartbeat_file = os.path.join(self.trigger_dir, self.heartbeat_file)
         if not os.path.exists(heartbeat_file):
             return 0
@@ -75,14 +239,24 @@ class UmapController(ClientController):
 
     def pre_test(self, test_number):
         self.trigger_disconnect()
+        # the stack is disconnected, so the stages will be updated before the next enumeration
+        self.push_stages()
         super(UmapController, self).pre_test(test_number)
+        self.host_silent = False
+        self.in_test = True
+        self.record_sequence = True
 
     def post_test(self):
+        self.in_test = False
         super(UmapController, self).post_test()
-        if self.pre_disconnect_delay:
-            time.sleep(self.pre_disconnect_delay)
-        self.trigger_disconnect()
-        if self.post_disconnect_delay:
-            time.sleep(self.post_disconnect_delay)
+        pre_disconnect_delay, post_disconnect_delay, _ = self.get_delays()
+        if pre_disconnect_delay:
+            time.sleep(pre_disconnect_delay)
+        try:
+            self.trigger_disconnect()
+        finally:
+            self.record_sequence = False
+        if post_disconnect_delay:
+            time.sleep(post_disconnect_delay)
         # reconnection will be handled when trigger() is called by the base class after pre_test
 
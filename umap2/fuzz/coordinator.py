@@ -0,0 +1,408 @@
+'''
+Parallel fuzzing with multiple workers
+
+Each worker is a umap2kitty fuzzer (with its own umap2fuzz stack and target host).
+The coordinator partitions the test index space of the model into ranges,
+and leases them to the workers on demand:
+
+- A worker gets its next test from its current lease,
+  and leases a new range (of chunk_size tests) when the lease is done.
+- When there are no more free ranges, an idle worker steals
+  the second half of the largest remaining lease of another worker,
+  so workers whose host is slow (e.g. rebooting) do not hold the session.
+- Workers send heartbeats, a worker that is silent for worker_timeout seconds
+  is considered dead, and its lease (including its current test) is re-leased.
+- Failure reports of all the workers are merged into one session,
+  with the mutations that reproduce them.
+
+Workers may run on other machines, the coordinator is served over the binary transport
+(:mod:`umap2.fuzz.transport`), on a unix or TCP socket.
+'''
+import binascii
+import os
+import socket
+import threading
+import time
+
+from kitty.data.data_manager import DataManager
+from kitty.data.report import Report
+from umap2.fuzz.client_fuzzer import Umap2ClientFuzzer
+from umap2.fuzz.transport import BinaryFuzzerClient
+
+
+class RangeScheduler(object):
+    '''
+    Partition of the test index space into leased ranges.
+    Ranges are lists of [start, end).
+    '''
+
+    def __init__(self, start, end, chunk_size=50):
+        '''
+        :param start: first test index
+        :param end: last test index + 1
+        :param chunk_size: number of tests in a new lease (default: 50)
+        '''
+        self.chunk_size = chunk_size
+        self.pending = [[start, end]] if start < end else []
+        # worker -> remaining range of its lease
+        self.leases = {}
+        # worker -> the test that is currently run by the worker
+        self.current = {}
+        self.completed = 0
+
+    def next_test(self, worker):
+        '''
+        Complete the current test of the worker and get the next one
+
+        :param worker: worker id
+        :return: next test index for the worker, None if there are no more tests
+        '''
+        if self.current.pop(worker, None) is not None:
+            self.completed += 1
+        lease = self.leases.get(worker)
+        if lease is None or lease[0] >= lease[1]:
+            lease = self._new_lease(worker)
+            if lease is None:
+                return None
+        index = lease[0]
+        lease[0] += 1
+        self.current[worker] = index
+        return index
+
+    def _new_lease(self, worker):
+        self.leases.pop(worker, None)
+        if self.pending:
+            start, end = self.pending[0]
+            lease_end = min(end, start + self.chunk_size)
+            if lease_end == end:
+                self.pending.pop(0)
+            else:
+                self.pending[0][0] = lease_end
+            lease = [start, lease_end]
+        else:
+            lease = self._steal(worker)
+            if lease is None:
+                return None
+        self.leases[worker] = lease
+        return lease
+
+    def _steal(self, worker):
+        '''
+        Take the second half of the largest remaining lease of another worker
+        '''
+        victim = None
+        for other, lease in self.leases.items():
+            if other == worker:
+                continue
+            if victim is None or lease[1] - lease[0] > self.leases[victim][1] - self.leases[victim][0]:
+                victim = other
+        if victim is None:
+            return None
+        lease = self.leases[victim]
+        if lease[1] - lease[0] < 2:
+            return None
+        middle = lease[0] + (lease[1] - lease[0]) // 2
+        stolen = [middle, lease[1]]
+        lease[1] = middle
+        return stolen
+
+    def release(self, worker):
+        '''
+        Return the remaining tests of the worker (including its current test)
+        to the pending ranges
+
+        :return: the released range, None if nothing was released
+        '''
+        lease = self.leases.pop(worker, None)
+        current = self.current.pop(worker, None)
+        if lease is None:
+            return None
+        if current is not None:
+            lease[0] = current
+        if lease[0] >= lease[1]:
+            return None
+        self.pending.insert(0, lease)
+        return lease
+
+    def remaining(self):
+        '''
+        :return: number of tests that were not handed out yet
+        '''
+        ranges = self.pending + list(self.leases.values())
+        return sum(end - start for start, end in ranges)
+
+
+class FuzzCoordinator(object):
+    '''
+    Hands out tests to the workers and collects their failure reports.
+    Called from the server's connection threads, so all methods are locked.
+    '''
+
+    def __init__(self, num_tests, model_hash=None, chunk_size=50, session_file=None, logger=None,
+                 worker_timeout=30.0):
+        '''
+        :param num_tests: number of tests in the model
+        :param model_hash: hash of the model, workers with other models are rejected (default: None)
+        :param chunk_size: number of tests in each lease (default: 50)
+        :param session_file: kitty session file to merge the failure reports into (default: None)
+        :param logger: logger (default: None)
+        :param worker_timeout: time (in seconds) without a message from a worker to consider it dead (default: 30.0)
+        '''
+        self.num_tests = num_tests
+        self.model_hash = model_hash
+        self.worker_timeout = worker_timeout
+        self.scheduler = RangeScheduler(0, num_tests, chunk_size)
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.workers = {}
+        self.failures = {}
+        self.dataman = None
+        if session_file:
+            self.dataman = DataManager(session_file)
+            self.dataman.start()
+
+    def register(self, name, model_hash=None):
+        '''
+        :param name: name of the worker
+        :param model_hash: hash of the worker's model (default: None)
+        :return: worker id
+        '''
+        if self.model_hash is not None and model_hash != self.model_hash:
+            raise Exception('Worker %s uses a different model (hash %s != %s)' % (
+                name, model_hash, self.model_hash
+            ))
+        with self.lock:
+            worker_id = len(self.workers)
+            self.workers[worker_id] = {
+                'name': name, 'tests': 0, 'failures': 0, 'alive': True, 'last_seen': time.time()
+            }
+        self._log('info', 'Worker %d registered: %s' % (worker_id, name))
+        return worker_id
+
+    def next_test(self, worker_id):
+        '''
+        :param worker_id: worker id
+        :return: the next test for the worker, None if the session is done
+        '''
+        with self.lock:
+            self._touch(worker_id)
+            self._reap()
+            index = self.scheduler.next_test(worker_id)
+            if index is not None:
+                self.workers[worker_id]['tests'] += 1
+            return index
+
+    def heartbeat(self, worker_id):
+        '''
+        Keep the lease of a worker (e.g. while its host is rebooting)
+        '''
+        with self.lock:
+            self._touch(worker_id)
+        return True
+
+    def release(self, worker_id):
+        '''
+        Return the remaining tests of a worker to the other workers
+        (e.g. when the worker stops)
+        '''
+        with self.lock:
+            released = self.scheduler.release(worker_id)
+        if released:
+            self._log('info', 'Worker %d released tests %d-%d' % (worker_id, released[0], released[1] - 1))
+        return True
+
+    def report_failure(self, worker_id, test, report, mutations=None):
+        '''
+        :param worker_id: worker id
+        :param test: test index
+        :param report: failure report (kitty Report as a dictionary)
+        :param mutations: list of (stage, payload) pairs that were sent in the test,
+            to reproduce the failure (default: None)
+        '''
+        mutations = [tuple(mutation) for mutation in mutations] if mutations else []
+        with self.lock:
+            worker = self._touch(worker_id)
+            worker['failures'] += 1
+            self.failures[test] = {'worker': worker['name'], 'report': report, 'mutations': mutations}
+        self._log('warning', 'Worker %d (%s) reported a failure in test %d' % (worker_id, worker['name'], test))
+        if self.dataman:
+            merged = Report.from_dict(dict(report))
+            merged.add('worker', worker['name'])
+            reproducer = Report('reproducer')
+            for i, (stage, payload) in enumerate(mutations):
+                reproducer.add('%d/%s' % (i, stage), binascii.hexlify(payload).decode())
+            merged.add('reproducer', reproducer)
+            self.dataman.store_report(merged, test)
+        return True
+
+    def get_failures(self):
+        '''
+        :return: dictionary of test index -> failure (worker, report and mutations)
+        '''
+        with self.lock:
+            return dict(self.failures)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'tests': self.num_tests,
+                'completed': self.scheduler.completed,
+                'remaining': self.scheduler.remaining(),
+                'failures': len(self.failures),
+                'alive': len([w for w in self.workers.values() if w['alive']]),
+                'workers': dict((wid, dict(worker)) for wid, worker in self.workers.items()),
+            }
+
+    def is_done(self):
+        with self.lock:
+            return not self.scheduler.current and self.scheduler.remaining() == 0
+
+    def close(self):
+        '''
+        Close the session file (when the session is done)
+        '''
+        if self.dataman:
+            self.dataman.stop()
+            self.dataman = None
+
+    def _get_worker(self, worker_id):
+        if worker_id not in self.workers:
+            raise Exception('Unknown worker: %s' % (worker_id))
+        return self.workers[worker_id]
+
+    def _touch(self, worker_id):
+        worker = self._get_worker(worker_id)
+        worker['last_seen'] = time.time()
+        if not worker['alive']:
+            worker['alive'] = True
+            self._log('info', 'Worker %d (%s) is back' % (worker_id, worker['name']))
+        return worker
+
+    def _reap(self, now=None):
+        '''
+        Re-lease the tests of workers that did not send anything for worker_timeout seconds
+        '''
+        now = time.time() if now is None else now
+        for worker_id, worker in self.workers.items():
+            if worker['alive'] and now - worker['last_seen'] > self.worker_timeout:
+                worker['alive'] = False
+                released = self.scheduler.release(worker_id)
+                if released:
+                    self._log('warning', 'Worker %d (%s) is dead, re-leasing tests %d-%d' % (
+                        worker_id, worker['name'], released[0], released[1] - 1
+                    ))
+
+    def _log(self, level, msg):
+        if self.logger:
+            getattr(self.logger, level)(msg)
+
+
+def serve_coordinator(coordinator, server, poll_interval=1.0):
+    '''
+    Serve the coordinator until all the tests are done (or until it is interrupted),
+    then stop the server and close the session file of the coordinator
+
+    :param coordinator: the coordinator
+    :type server: :class:`~umap2.fuzz.transport.BinaryFuzzerServer`
+    :param server: threaded server of the coordinator
+    :param poll_interval: time (in seconds) between checks of the session (default: 1.0)
+    '''
+    thread = threading.Thread(target=server.start)
+    thread.daemon = True
+    thread.start()
+    try:
+        while thread.is_alive() and not coordinator.is_done():
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        pass
+    server.stop()
+    thread.join()
+    coordinator.close()
+
+
+class CoordinatorClient(BinaryFuzzerClient):
+    '''
+    Worker side of the coordinator protocol
+    '''
+
+    def register(self, name, model_hash=None):
+        return self.call('register', name=name, model_hash=model_hash)
+
+    def next_test(self, worker_id):
+        return self.call('next_test', worker_id=worker_id)
+
+    def release(self, worker_id):
+        return self.call('release', worker_id=worker_id)
+
+    def heartbeat(self, worker_id):
+        return self.call('heartbeat', worker_id=worker_id)
+
+    def report_failure(self, worker_id, test, report, mutations=None):
+        return self.call('report_failure', worker_id=worker_id, test=test, report=report, mutations=mutations)
+
+
+class CoordinatedFuzzer(Umap2ClientFuzzer):
+    '''
+    Fuzzer that runs the tests it gets from a coordinator
+    instead of its own test range
+    '''
+
+    def __init__(self, coordinator, name='CoordinatedFuzzer', logger=None, option_line=None,
+                 heartbeat_interval=5.0):
+        '''
+        :type coordinator: :class:`~umap2.fuzz.coordinator.CoordinatorClient`
+        :param coordinator: the coordinator (or a client of it)
+        :param name: name of the object
+        :param logger: logger for the object (default: None)
+        :param option_line: cmd line options to the fuzzer
+        :param heartbeat_interval: time (in seconds) between heartbeats to the coordinator (default: 5.0)
+        '''
+        super(CoordinatedFuzzer, self).__init__(name, logger, option_line)
+        self.coordinator = coordinator
+        self.worker_id = None
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_stop = threading.Event()
+        self.heartbeat_thread = None
+
+    def _start(self):
+        worker_name = '%s:%d' % (socket.gethostname(), os.getpid())
+        self.worker_id = self.coordinator.register(name=worker_name, model_hash=self.model.hash())
+        self.heartbeat_thread = threading.Thread(target=self._heartbeat_loop)
+        self.heartbeat_thread.daemon = True
+        self.heartbeat_thread.start()
+        super(CoordinatedFuzzer, self)._start()
+
+    def _heartbeat_loop(self):
+        # tests may take long (e.g. while the host is rebooting), keep the lease alive
+        while not self.heartbeat_stop.wait(self.heartbeat_interval):
+            try:
+                self.coordinator.heartbeat(worker_id=self.worker_id)
+            except Exception as ex:
+                self.logger.warning('Failed to send heartbeat to the coordinator: %s' % (ex))
+
+    def _next_test(self):
+        index = self.coordinator.next_test(worker_id=self.worker_id)
+        if index is None:
+            return False
+        self.session_info.current_index = index
+        return self._goto(index)
+
+    def _store_report(self, report):
+        super(CoordinatedFuzzer, self)._store_report(report)
+        if report.get_status() != Report.PASSED:
+            self.coordinator.report_failure(
+                worker_id=self.worker_id,
+                test=self.model.current_index(),
+                report=report.to_dict(),
+                mutations=[[stage, payload] for stage, payload in self._requested_stages if payload is not None]
+            )
+
+    def stop(self):
+        self.heartbeat_stop.set()
+        if self.worker_id is not None:
+            try:
+                self.coordinator.release(worker_id=self.worker_id)
+            except Exception as ex:
+                # the coordinator exits when the session is done
+                self.logger.warning('Failed to release the lease: %s' % (ex))
+        super(CoordinatedFuzzer, self).stop()
@@ -0,0 +1,154 @@
+'''
+Pre-rendered mutation corpus
+
+All the mutations of a model are rendered once (``umap2kitty --render-corpus``)
+into a corpus file, which is memory-mapped by the fuzzer,
+so a mutation is served with a slice of the file instead of rendering the template.
+
+File layout:
+
+- header: ``<magic:4s> <version:u16> <reserved:u16> <tests:u64> <index offset:u64> <meta offset:u64>``
+- payloads, one after the other
+- index, an entry for each test (so the entry of a test is found by its number):
+  ``<offset:u64> <length:u32> <path:u16> <flags:u16>``
+- meta (json): hash of the model and the stage paths of the tests
+
+Tests whose payload depends on session data from the stack
+(or that may mutate any stage) are flagged as dynamic,
+and are rendered by the fuzzer as usual.
+'''
+import json
+import mmap
+import struct
+
+from kitty.fuzzers import ClientFuzzer
+from umap2.fuzz.client_fuzzer import uses_session_data
+
+
+CORPUS_MAGIC = b'UMC\x00'
+CORPUS_VERSION = 1
+CORPUS_HEADER = struct.Struct('<4sHHQQQ')
+INDEX_ENTRY = struct.Struct('<QIHH')
+
+FLAG_DYNAMIC = 1
+
+
+class CorpusWriter(object):
+    '''
+    Write a corpus file, the tests should be added in order
+    '''
+
+    def __init__(self, path, model_hash):
+        '''
+        :param path: path of the corpus file
+        :param model_hash: hash of the model
+        '''
+        self.model_hash = model_hash
+        self.f = open(path, 'wb')
+        self.f.write(CORPUS_HEADER.pack(CORPUS_MAGIC, CORPUS_VERSION, 0, 0, 0, 0))
+        self.offset = CORPUS_HEADER.size
+        self.index = []
+        self.paths = {}
+
+    def add(self, test, stages, payload):
+        '''
+        :param test: test number
+        :param stages: the stages in the path of the test, the last one is mutated
+        :param payload: the mutation, None if the test is dynamic
+        '''
+        if test != len(self.index):
+            raise Exception('Expected test %d, got test %d' % (len(self.index), test))
+        path_id = self.paths.setdefault(tuple(stages), len(self.paths))
+        if payload is None:
+            self.index.append(INDEX_ENTRY.pack(0, 0, path_id, FLAG_DYNAMIC))
+            return
+        self.f.write(payload)
+        self.index.append(INDEX_ENTRY.pack(self.offset, len(payload), path_id, 0))
+        self.offset += len(payload)
+
+    def close(self):
+        index_offset = self.offset
+        self.f.write(b''.join(self.index))
+        meta_offset = index_offset + len(self.index) * INDEX_ENTRY.size
+        paths = [list(path) for path, _ in sorted(self.paths.items(), key=lambda kv: kv[1])]
+        self.f.write(json.dumps({'model_hash': self.model_hash, 'paths': paths}).encode('utf-8'))
+        self.f.seek(0)
+        self.f.write(CORPUS_HEADER.pack(
+            CORPUS_MAGIC, CORPUS_VERSION, 0, len(self.index), index_offset, meta_offset
+        ))
+        self.f.close()
+
+
+class MutationCorpus(object):
+    '''
+    Memory-mapped corpus file
+    '''
+
+    def __init__(self, path):
+        '''
+        :param path: path of the corpus file
+        '''
+        self.path = path
+        self.f = open(path, 'rb')
+        self.data = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.num_tests, self.index_offset, meta_offset = CORPUS_HEADER.unpack_from(self.data, 0)
+        if magic != CORPUS_MAGIC or version != CORPUS_VERSION:
+            self.close()
+            raise Exception('%s is not a mutation corpus (version %d)' % (path, CORPUS_VERSION))
+        meta = json.loads(self.data[meta_offset:].decode('utf-8'))
+        self.model_hash = meta['model_hash']
+        self.paths = meta['paths']
+
+    def get(self, test):
+        '''
+        :param test: test number
+        :return: tuple of (stages in the path of the test, payload),
+            the payload is None if the test is dynamic
+        '''
+        if not 0 <= test < self.num_tests:
+            raise IndexError('No test %d in the corpus %s' % (test, self.path))
+        offset, length, path_id, flags = INDEX_ENTRY.unpack_from(self.data, self.index_offset + test * INDEX_ENTRY.size)
+        if flags & FLAG_DYNAMIC:
+            return self.paths[path_id], None
+        return self.paths[path_id], self.data[offset:offset + length]
+
+    def get_mutation(self, test, stage):
+        '''
+        :param test: test number
+        :param stage: stage name
+        :return: the mutation of the stage in the test,
+            None if the stage is not mutated in the test or the test is dynamic
+        '''
+        stages, payload = self.get(test)
+        if stages[-1].lower() != stage.lower():
+            return None
+        return payload
+
+    def close(self):
+        self.data.close()
+        self.f.close()
+
+
+def render_corpus(model, path, logger=None):
+    '''
+    Render all the mutations of a model into a corpus file
+
+    :param model: kitty GraphModel
+    :param path: path of the corpus file
+    :param logger: logger (default: None)
+    :return: number of tests in the corpus
+    '''
+    writer = CorpusWriter(path, model.hash())
+    num_tests = model.num_mutations()
+    while model.mutate():
+        test = model.current_index()
+        stages = [edge.dst.name for edge in model.get_sequence()]
+        node = model.get_sequence()[-1].dst
+        payload = None
+        if node.name != ClientFuzzer.STAGE_ANY and not uses_session_data(node):
+            payload = node.render().tobytes()
+        writer.add(test, stages, payload)
+        if logger and test % 1000 == 0:
+            logger.info('Rendered %d/%d mutations' % (test, num_tests))
+    writer.close()
+    return num_tests
@@ -0,0 +1,63 @@
+'''
+Deduplication of fuzz tests by their effective payload
+
+Many mutations render to the same bytes on the wire:
+mutations of fields that are beyond the length that the host requests
+are truncated by the device, some fields (e.g. sizes and counts)
+render the same for different mutations, and each stage is mutated
+the same way in each of the paths that add_stage creates for it.
+
+The stack reports, when the device is disconnected,
+the maximal length that the host requested for each stage
+that was served in a control transfer:
+
+- ``lengths {"<stage>": <length>, ...}``
+
+Before a test runs, the fuzzer hashes the payload of the fuzzed stage,
+truncated to the maximal length that was requested for the stage,
+and skips the test if the same effective payload of the stage was already sent.
+Until a length is known for a stage, its payloads are hashed in full.
+'''
+import hashlib
+
+
+CMD_LENGTHS = 'lengths'
+
+
+class PayloadDeduplicator(object):
+
+    def __init__(self):
+        self.lengths = {}
+        self.seen = set()
+        self.skipped = 0
+
+    def update_lengths(self, lengths):
+        '''
+        :param lengths: dictionary of stage -> length requested by the host
+        '''
+        for stage, length in lengths.items():
+            stage = stage.lower()
+            self.lengths[stage] = max(length, self.lengths.get(stage, 0))
+
+    def effective_payload(self, stage, payload):
+        '''
+        :return: the part of the payload that is sent to the host
+        '''
+        length = self.lengths.get(stage.lower())
+        return payload if length is None else payload[:length]
+
+    def is_duplicate(self, stage, payload):
+        '''
+        Check whether the effective payload of the stage was already sent,
+        and mark it as sent.
+
+        :param stage: stage name
+        :param payload: rendered payload
+        :return: True if the test should be skipped
+        '''
+        key = hashlib.sha1(stage.lower().encode('utf-8') + b'\x00' + self.effective_payload(stage, payload)).digest()
+        if key in self.seen:
+            self.skipped += 1
+            return True
+        self.seen.add(key)
+        return False
@@ -0,0 +1,230 @@
+'''
+Host behavior feedback for the fuzzer
+
+The stack records the sequence of requests the host sends in each test
+(setup packets and data on the other endpoints), and pushes a hash of
+the sequence to the fuzzer over the control channel when the device is
+disconnected at the end of the test:
+
+- ``sequence {"hash": ..., "length": ..., "events": [...]}``
+
+The fuzzer keeps a coverage map of the sequences it has seen,
+and schedules first the fields whose mutations make the host
+behave differently (e.g. request other descriptors,
+send class requests or take another error path).
+
+Only the parts of the request that are decided by the host are hashed
+(the length of the request is omitted, as it usually echoes a length
+from the mutated descriptor), and repeated requests are recorded once,
+so retries of the host do not create new sequences.
+'''
+import hashlib
+import json
+
+from kitty.model.low_level.container import Container
+from umap2.fuzz.client_fuzzer import Umap2ClientFuzzer
+
+
+CMD_SEQUENCE = 'sequence'
+
+
+class RequestSequence(object):
+    '''
+    Sequence of the host requests in the current test (stack side)
+    '''
+
+    def __init__(self):
+        self.events = []
+
+    def reset(self):
+        self.events = []
+
+    def add_request(self, req):
+        '''
+        :type req: :class:`~umap2.core.usb_device.USBDeviceRequest`
+        :param req: request from the host
+        '''
+        self._add(('setup', req.request_type, req.request, req.value, req.index))
+
+    def add_data(self, ep_num):
+        '''
+        :param ep_num: endpoint that data was received on
+        '''
+        self._add(('data', ep_num))
+
+    def _add(self, event):
+        if not self.events or self.events[-1] != event:
+            self.events.append(event)
+
+    def digest(self):
+        '''
+        :return: hash of the sequence (hex string)
+        '''
+        return hashlib.sha1(repr(self.events).encode('ascii')).hexdigest()[:16]
+
+    def to_json(self):
+        return json.dumps({'hash': self.digest(), 'length': len(self.events), 'events': self.events})
+
+
+class FieldGroup(object):
+    '''
+    The tests that mutate a single field, [start, end)
+    '''
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.next = start
+        self.tried = 0
+        self.novel = 0
+        self.misses = 0
+
+    def remaining(self):
+        return self.end - self.next
+
+
+class FeedbackScheduler(object):
+    '''
+    Order the tests by the feedback from the host.
+
+    - A field that produced a new sequence is hot, its next tests run first,
+      until it produces patience tests in a row with known sequences.
+    - Otherwise, each field is probed with its first probe_size tests,
+      so all the fields get a chance to produce new sequences early.
+    - Then the remaining tests run, fields with the highest rate
+      of new sequences first.
+    '''
+
+    def __init__(self, ranges, probe_size=4, patience=8):
+        '''
+        :param ranges: list of [start, end) test ranges, one for each field
+        :param probe_size: number of tests to run from each field before the rest (default: 4)
+        :param patience: number of tests without new sequences before a hot field cools down (default: 8)
+        '''
+        self.groups = [FieldGroup(start, end) for start, end in ranges if end > start]
+        self.probe_size = probe_size
+        self.patience = patience
+        self.hot = []
+        # sequence hash -> first test that produced it
+        self.coverage = {}
+        self.group_of_test = {}
+
+    def next_test(self):
+        '''
+        :return: index of the next test to run, None if all the tests were scheduled
+        '''
+        group = self._pick()
+        if group is None:
+            return None
+        index = group.next
+        group.next += 1
+        group.tried += 1
+        self.group_of_test[index] = group
+        if not group.remaining() and group in self.hot:
+            self.hot.remove(group)
+        return index
+
+    def _pick(self):
+        if self.hot:
+            return self.hot[0]
+        pending = [group for group in self.groups if group.remaining()]
+        if not pending:
+            return None
+        for group in pending:
+            if group.tried < self.probe_size:
+                return group
+        return max(pending, key=lambda g: (float(g.novel) / g.tried, -g.start))
+
+    def report(self, test, sequence_hash):
+        '''
+        :param test: index of the test
+        :param sequence_hash: hash of the request sequence of the host in the test
+        :return: whether the sequence is new
+        '''
+        group = self.group_of_test.pop(test, None)
+        novel = sequence_hash not in self.coverage
+        if novel:
+            self.coverage[sequence_hash] = test
+        if group is None:
+            return novel
+        if novel:
+            group.novel += 1
+            group.misses = 0
+            if group.remaining() and group not in self.hot:
+                self.hot.append(group)
+        else:
+            group.misses += 1
+            if group.misses >= self.patience and group in self.hot:
+                self.hot.remove(group)
+        return novel
+
+
+def get_field_ranges(model):
+    '''
+    :param model: kitty GraphModel
+    :return: list of [start, end) test ranges, one for each fuzzed field
+        (the top level fields of the fuzzed template of each sequence)
+    '''
+    model.num_mutations()
+    ranges = []
+    start = 0
+    for sequence in model._sequences:
+        node = sequence[-1].dst
+        total = node.num_mutations()
+        counts = []
+        if isinstance(node, Container):
+            counts = [field.num_mutations() for field in node._fields]
+        if sum(counts) != total:
+            # the template does not mutate its fields one after the other
+            counts = [total]
+        for count in counts:
+            if count:
+                ranges.append([start, start + count])
+                start += count
+    return ranges
+
+
+class FeedbackFuzzer(Umap2ClientFuzzer):
+    '''
+    Fuzzer that schedules its tests by the request sequences
+    reported by the stack (see :class:`~umap2.fuzz.feedback.FeedbackScheduler`).
+    All the tests of the model are scheduled, the test list option is not used.
+    '''
+
+    def __init__(self, name='FeedbackFuzzer', logger=None, option_line=None, probe_size=4, patience=8):
+        '''
+        :param name: name of the object
+        :param logger: logger for the object (default: None)
+        :param option_line: cmd line options to the fuzzer
+        :param probe_size: number of tests to run from each field before the rest (default: 4)
+        :param patience: number of tests without new sequences before a hot field cools down (default: 8)
+        '''
+        super(FeedbackFuzzer, self).__init__(name, logger, option_line)
+        self.probe_size = probe_size
+        self.patience = patience
+        self.scheduler = None
+
+    def _start(self):
+        self.scheduler = FeedbackScheduler(get_field_ranges(self.model), self.probe_size, self.patience)
+        self.logger.info('Scheduling %d fields by host feedback' % (len(self.scheduler.groups)))
+        super(FeedbackFuzzer, self)._start()
+
+    def _next_test(self):
+        index = self.scheduler.next_test()
+        if index is None:
+            return False
+        self.session_info.current_index = index
+        return self._goto(index)
+
+    def report_sequence(self, payload):
+        '''
+        Called by the controller with the request sequence of the current test
+
+        :param payload: sequence message payload (json)
+        '''
+        sequence = json.loads(payload)
+        test = self.model.current_index()
+        if self.scheduler.report(test, sequence['hash']):
+            self.logger.info('test %d: new request sequence %s (%d requests), %d sequences' % (
+                test, sequence['hash'], sequence['length'], len(self.scheduler.coverage)
+            ))
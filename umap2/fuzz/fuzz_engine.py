@@ -1,7 +1,13 @@
 #!/usr/bin/env python
 '''
 Usage:
-    umap2kitty -s <stage-file> [-d <pre,post>] [-c <count>] [-k <options>]
+    umap2kitty -s <stage-file> [-j <journal>] [-d <pre,post>] [-a] [-c <count>] [-k <options>] [-b <address>]
+               [-w <address>] [-f] [--corpus <file>] [--dedup] [--results <file>]
+    umap2kitty -j <journal> [-d <pre,post>] [-a] [-k <options>] [-b <address>] [--corpus <file>] [--dedup]
+               [--results <file>]
+    umap2kitty -s <stage-file> [-c <count>] --render-corpus <file>
+    umap2kitty -s <stage-file> [-c <count>] --coordinate <address> [--chunk-size <size>] [--session <file>]
+               [--worker-timeout <seconds>]
 
 Options:
     -c --count <count>                  stage count (e.g. how many times a stage might repeat
@@ -9,56 +15,78 @@ Options:
     -d --disconnect-delays=<pre,post>   number of seconds to wait in the post_test before and after
                                         disconnecting the device (might be necessary in order for
                                         failures to be matched with the correct test) [default: 0.0,0.0]
+    -a --adaptive-delays                learn the delays from the timing of the host
+                                        (the -d delays are the initial delays)
     -k --kitty-options <options>        options for the kitty fuzzer, use -k -h to get a full list
     -s --stage-file <stage-file>        path to stage trace from umap emulation run
+    -b --binary <address>               serve the stack over the binary protocol on the given address
+                                        (unix:<path> or <host>:<port>) instead of JSON-RPC
+    -j --journal <journal>              journal the session to this file before and after each test,
+                                        if the file exists, resume its session at the first test
+                                        that was not completed (the stage file is taken from the journal),
+                                        a test that was started and not completed is recorded as a failure
+                                        (not used with -w or -f)
+    -w --coordinator <address>          run as a worker, get the tests from the coordinator at the given address
+    -f --feedback                       schedule first the mutations that change the sequence
+                                        of requests from the host (not used with -w)
+    --corpus <file>                     serve the mutations from a corpus file instead of rendering them
+    --render-corpus <file>              render all the mutations of the model into a corpus file and exit
+    --dedup                             skip tests whose payload (truncated to the length that the host
+                                        requests) was already sent
+    --results <file>                    record the results of the tests in a results file (SQLite),
+                                        use umap2results to query it
+    --coordinate <address>              run a coordinator on the given address, and hand out
+                                        ranges of tests to the workers that connect to it
+    --chunk-size <size>                 number of tests in each range [default: 50]
+    --session <file>                    kitty session file to merge the failure reports of all workers into
+    --worker-timeout <seconds>          time without heartbeats from a worker before its tests are
+                                        re-leased to other workers [default: 30]
 '''
+import os
+
 import docopt
 from kitty.remote.rpc import RpcServer
-from kitty.fuzzers import ClientFuzzer
 from kitty.targets import ClientTarget
 from kitty.interfaces import WebInterface
 from kitty.model import GraphModel
 from kitty.model import Template, Meta, String, UInt32
 
-from templates import audio, cdc, enum, generic, hid, hub, mass_storage
-from templates import smart_card
+from umap2.fuzz.templates import STAGE_MODULES, get_template
 
-from controller import UmapController
+from umap2.fuzz.controller import UmapController
+from umap2.fuzz.client_fuzzer import Umap2ClientFuzzer
+from umap2.fuzz.transport import BinaryFuzzerServer
+from umap2.fuzz.coordinator import FuzzCoordinator, CoordinatorClient, CoordinatedFuzzer, serve_coordinator
+from umap2.fuzz.checkpoint import SessionJournal
+from umap2.fuzz.corpus import MutationCorpus, render_corpus
+from umap2.fuzz.dedup import PayloadDeduplicator
+from umap2.fuzz.feedback import FeedbackFuzzer
+from umap2.fuzz.helpers import StageTrace
+from umap2.fuzz.results import ResultStore
+from umap2.fuzz.timing import AdaptiveTiming
 
 
-def enumerate_templates(module):
+def read_stages(stage_file):
     '''
-    :return: a list of templates that are in a module
+    :param stage_file: filename with stage list (generated by umap2stages)
+    :return: list of the stages in the file
     '''
-    member_names = sorted(dir(module))
-    templates = {}
-    for name in member_names:
-        member = getattr(module, name)
-        if isinstance(member, Template):
-            templates[member.name] = member
-        elif isinstance(member, dict):
-            for k, item in member.items():
-                if isinstance(item, Template):
-                    templates[item.name] = item
-        elif isinstance(member, list):
-            for item in member:
-                if isinstance(item, Template):
-                    templates[item.name] = item
-    return templates
+    return StageTrace(stage_file).stages
 
 
-def get_stages(stage_file):
+def get_stages(stage_file, stages=None):
     '''
     Get a dictionary (stage:count) from a stage file
 
     :param stage_file: filename with stage list (generated by umap2stages)
+    :param stages: list of the stages, if already read (default: None, read the file)
     :return: dictionary of stage:count
     '''
-    with open(stage_file, 'r') as f:
-        stages = [l.rstrip() for l in f.readlines()]
+    if stages is None:
+        return StageTrace(stage_file).get_counts()
     stage_count = {}
     for stage in stages:
-        stage_count[stage] = stages.count(stage)
+        stage_count[stage] = stage_count.get(stage, 0) + 1
     return stage_count
 
 
@@ -104,38 +132,39 @@ def add_stage(g, stage, template, count):
         g.connect(pseudos[-1], template)
 
 
-def get_model(options):
+def get_templates():
+    '''
+    :return: dictionary of stage name -> template, for all the stages that can be fuzzed
+    '''
+    return dict((stage, get_template(stage)) for stage in STAGE_MODULES)
+
+
+def get_model(options, stage_list=None):
     '''
     Get the data model
 
     :param options: options
+    :param stage_list: list of the stages, if already read (default: None, read the stage file)
     :return: session model
     '''
     stage_file = options['--stage-file']
-    stages = get_stages(stage_file)
-    templates = {}
-    templates.update(enumerate_templates(audio))
-    templates.update(enumerate_templates(cdc))
-    templates.update(enumerate_templates(enum))
-    templates.update(enumerate_templates(generic))
-    templates.update(enumerate_templates(hid))
-    templates.update(enumerate_templates(hub))
-    templates.update(enumerate_templates(mass_storage))
-    templates.update(enumerate_templates(smart_card))
+    stages = get_stages(stage_file, stage_list)
     g = GraphModel('usb model (%s)' % (stage_file))
     for stage in stages:
-        if stage in templates:
-            stage_template = templates[stage]
+        # only the templates of the stages in the stage file are built
+        stage_template = get_template(stage)
+        if stage_template is not None:
             stage_count = min(stages[stage], int(options['--count']))
             add_stage(g, stage, stage_template, stage_count)
     return g
 
 
-def get_controller(options):
+def get_controller(options, channel=None):
     '''
     Get the controller
 
     :param options: options
+    :param channel: control channel server (default: None, use the control socket)
     :return: controller
     '''
     try:
@@ -144,40 +173,140 @@ def get_controller(options):
     except ValueError:
         msg = 'Please specify the --disconnect_delays as two comma-separated floats'
         raise Exception(msg)
-    return UmapController(pre_disconnect_delay, post_disconnect_delay)
+    controller = UmapController(pre_disconnect_delay, post_disconnect_delay, channel=channel)
+    if options.get('--adaptive-delays'):
+        controller.set_timing(AdaptiveTiming(pre_disconnect_delay, post_disconnect_delay, logger=controller.logger))
+    return controller
 
 
-def get_fuzzer(options=None):
+def get_fuzzer(options=None, channel=None):
     '''
     Get fuzzer (non-remote)
 
     :param options: options
+    :param channel: control channel server (default: None, use the control socket)
     :return: fuzzer
     '''
     local_options = {
         '--kitty-options': None,
         '--stage-file': None,
         '--count': '2',
-        '--disconnect-delays': '0.0,0.0'
+        '--disconnect-delays': '0.0,0.0',
+        '--coordinator': None,
+        '--feedback': False,
+        '--journal': None,
+        '--adaptive-delays': False,
+        '--corpus': None,
+        '--dedup': False,
+        '--results': None,
     }
     local_options.update(options)
-    fuzzer = ClientFuzzer(name='Umap2', option_line=local_options['--kitty-options'])
+    if local_options['--journal'] and (local_options['--coordinator'] or local_options['--feedback']):
+        # the journal resumes at a test index, the coordinated and feedback fuzzers do not run the tests in order
+        raise Exception('The journal (-j) can not be used with a coordinator (-w) or with feedback (-f)')
+    if local_options['--coordinator']:
+        coordinator = CoordinatorClient(local_options['--coordinator'])
+        fuzzer = CoordinatedFuzzer(coordinator, name='Umap2', option_line=local_options['--kitty-options'])
+    elif local_options['--feedback']:
+        fuzzer = FeedbackFuzzer(name='Umap2', option_line=local_options['--kitty-options'])
+    else:
+        fuzzer = Umap2ClientFuzzer(name='Umap2', option_line=local_options['--kitty-options'])
     fuzzer.set_interface(WebInterface())
 
     target = ClientTarget(name='USBTarget')
-    target.set_controller(get_controller(local_options))
+    controller = get_controller(local_options, channel)
+    # when the host is silent, there is no point in waiting for the mutation request
+    controller.add_silent_callback(target.signal_mutated)
+    if isinstance(fuzzer, FeedbackFuzzer):
+        controller.add_sequence_callback(fuzzer.report_sequence)
+    if local_options['--dedup']:
+        fuzzer.set_dedup(PayloadDeduplicator())
+        controller.add_lengths_callback(fuzzer.report_lengths)
+    if local_options['--results']:
+        controller.add_sequence_callback(fuzzer.report_request_sequence)
+    target.set_controller(controller)
     target.set_mutation_server_timeout(10)
 
-    model = get_model(local_options)
+    journal = None
+    stage_list = None
+    if local_options['--journal']:
+        journal = SessionJournal(local_options['--journal'])
+        if journal.is_resumed():
+            local_options['--stage-file'] = journal.stage_file
+            local_options['--count'] = journal.count
+            stage_list = journal.stages
+        else:
+            stage_list = read_stages(local_options['--stage-file'])
+    model = get_model(local_options, stage_list)
     fuzzer.set_model(model)
     fuzzer.set_target(target)
+    if local_options['--corpus']:
+        fuzzer.set_corpus(MutationCorpus(local_options['--corpus']))
+    if journal:
+        journal.start_session(local_options['--stage-file'], stage_list, local_options['--count'], model.hash())
+        fuzzer.set_journal(journal)
+        if journal.last_test is not None or journal.unfinished is not None:
+            fuzzer.logger.info('Resuming session from %s at test %d (%d tests, %d failures)' % (
+                journal.path, journal.next_test(), journal.tests, len(journal.failures)
+            ))
+            fuzzer.set_test_list('%d-' % (journal.next_test()))
+    if local_options['--results']:
+        results = ResultStore(local_options['--results'])
+        results.start_campaign(
+            os.path.basename(local_options['--stage-file']), local_options['--stage-file'], model.hash()
+        )
+        fuzzer.set_results(results)
+    controller.set_stage_provider(lambda: get_active_stages(fuzzer))
     return fuzzer
 
 
+def get_active_stages(fuzzer):
+    '''
+    :param fuzzer: the fuzzer
+    :return: names of the stages in the sequence of the current test,
+        None if any stage may be fuzzed
+    '''
+    stages = set(edge.dst.name for edge in fuzzer.model.get_sequence())
+    if Umap2ClientFuzzer.STAGE_ANY in stages:
+        return None
+    return sorted(stages)
+
+
+def run_coordinator(options):
+    '''
+    Serve a coordinator for the workers, until all the tests are done (or until it is interrupted)
+
+    :param options: options
+    '''
+    model = get_model(options)
+    coordinator = FuzzCoordinator(
+        model.num_mutations(),
+        model_hash=model.hash(),
+        chunk_size=int(options['--chunk-size']),
+        session_file=options['--session'],
+        logger=model.logger,
+        worker_timeout=float(options['--worker-timeout'])
+    )
+    server = BinaryFuzzerServer(options['--coordinate'], impl=coordinator, logger=model.logger, threaded=True)
+    serve_coordinator(coordinator, server)
+    print(coordinator.get_stats())
+
+
 def main():
     options = docopt.docopt(__doc__)
+    if options['--coordinate']:
+        run_coordinator(options)
+        return
+    if options['--render-corpus']:
+        model = get_model(options)
+        count = render_corpus(model, options['--render-corpus'], model.logger)
+        print('Rendered %d mutations to %s' % (count, options['--render-corpus']))
+        return
     fuzzer = get_fuzzer(options)
-    remote = RpcServer(host='localhost', port=26007, impl=fuzzer)
+    if options['--binary']:
+        remote = BinaryFuzzerServer(options['--binary'], impl=fuzzer, logger=fuzzer.logger)
+    else:
+        remote = RpcServer(host='localhost', port=26007, impl=fuzzer)
     remote.start()
 
 
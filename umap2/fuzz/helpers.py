@@ -2,29 +2,197 @@
 This module contains helpers for fuzzing
 '''
 
-import traceback
+import atexit
 import binascii
 import inspect
+import itertools
+import json
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+
+#: first line of a stage file in JSON-lines format
+STAGE_FILE_HEADER = {'format': 'umap2-stages', 'version': 2}
 
 
 class StageLogger(object):
+    '''
+    Write the stages of an emulation session to a stage file.
 
-    def __init__(self, filename):
+    The file is in JSON-lines format, the header line is followed by a line for each stage::
+
+        {"order": <n>, "time": <seconds since start>, "stage": <name>,
+         "request": {"request_type": .., "request": .., "value": .., "index": .., "length": ..},
+         "latency": <seconds it took to produce the response>}
+
+    The request is null when the stage is not handled in a control request.
+    The line of a stage is added when the stage is done, so a stage that is handled
+    inside another stage is written before it (use the order to sort them).
+    Lines are written in bulk by a background thread.
+    '''
+
+    def __init__(self, filename, flush_interval=0.5):
+        '''
+        :param filename: stage file name
+        :param flush_interval: max time (in seconds) between writes to the file (default: 0.5)
+        '''
         self.filename = filename
+        self.flush_interval = flush_interval
         self.fd = None
+        self.start_time = None
+        self.order = 0
+        self.pending = []
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
 
     def start(self):
-        self.fd = open(self.filename, 'wb')
+        self.fd = open(self.filename, 'w')
+        self.fd.write(json.dumps(STAGE_FILE_HEADER) + '\n')
+        self.start_time = time.time()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._writer_loop)
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.stop)
 
     def stop(self):
         if self.fd:
+            self.stop_event.set()
+            self.thread.join()
+            self.flush()
             self.fd.close()
+            self.fd = None
 
-    def log_stage(self, stage):
-        if self.fd:
-            self.fd.write(stage + '\n')
+    def begin_stage(self, stage, request=None):
+        '''
+        :param stage: stage name
+        :param request: the control request of the stage (default: None)
+        :return: record to pass to end_stage, None if the logger is not started
+        '''
+        if not self.fd:
+            return None
+        with self.lock:
+            order = self.order
+            self.order += 1
+        return (order, time.time(), stage, request)
+
+    def end_stage(self, record):
+        '''
+        :param record: record from begin_stage
+        '''
+        if record is None:
+            return
+        order, start, stage, request = record
+        if request is not None:
+            request = {
+                'request_type': request.request_type,
+                'request': request.request,
+                'value': request.value,
+                'index': request.index,
+                'length': request.length,
+            }
+        line = json.dumps({
+            'order': order,
+            'time': round(start - self.start_time, 6),
+            'stage': stage,
+            'request': request,
+            'latency': round(time.time() - start, 6),
+        })
+        with self.lock:
+            self.pending.append(line)
+
+    def log_stage(self, stage, request=None):
+        self.end_stage(self.begin_stage(stage, request))
+
+    def flush(self):
+        '''
+        Write all the pending stages to the file
+        '''
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if pending and self.fd:
+            self.fd.write('\n'.join(pending) + '\n')
             self.fd.flush()
 
+    def _writer_loop(self):
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+
+
+class StageStats(object):
+    '''
+    Statistics of a stage in a stage file
+    '''
+
+    def __init__(self, first):
+        '''
+        :param first: order of the first occurrence of the stage
+        '''
+        self.count = 0
+        self.first = first
+        self.timed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def add(self, record):
+        self.count += 1
+        if record.get('latency') is not None:
+            self.timed += 1
+            self.total_latency += record['latency']
+            self.max_latency = max(self.max_latency, record['latency'])
+
+    def mean_latency(self):
+        '''
+        :return: mean latency of the stage, None if the stage file has no timing
+        '''
+        if not self.timed:
+            return None
+        return self.total_latency / self.timed
+
+
+class StageTrace(object):
+    '''
+    Stages of a stage file, with their counts and timing, read in one pass.
+    Both the JSON-lines format of StageLogger and the old format
+    (a stage name in each line, without timing) are supported.
+    '''
+
+    def __init__(self, filename):
+        '''
+        :param filename: stage file name
+        '''
+        self.filename = filename
+        self.stats = {}
+        ordered = []
+        with open(filename, 'r') as f:
+            first_line = f.readline()
+            if first_line.startswith('{') and json.loads(first_line).get('format') == STAGE_FILE_HEADER['format']:
+                records = (json.loads(line) for line in f if line.strip())
+            else:
+                lines = itertools.chain([first_line], f)
+                records = ({'order': i, 'stage': line.rstrip()} for i, line in enumerate(lines))
+            for record in records:
+                stage = record['stage']
+                stats = self.stats.get(stage)
+                if stats is None:
+                    stats = self.stats[stage] = StageStats(record['order'])
+                stats.first = min(stats.first, record['order'])
+                stats.add(record)
+                ordered.append((record['order'], stage))
+        ordered.sort()
+        #: the stages, in the order they were handled
+        self.stages = [stage for _, stage in ordered]
+
+    def get_counts(self):
+        '''
+        :return: dictionary of stage:count, in the order of the first occurrence of each stage
+        '''
+        stats = sorted(self.stats.items(), key=lambda item: item[1].first)
+        return OrderedDict((stage, stage_stats.count) for stage, stage_stats in stats)
+
 
 stage_logger = StageLogger('dummy')
 
@@ -42,6 +210,15 @@ def log_stage(stage):
     stage_logger.log_stage(stage)
 
 
+def get_current_request(actor):
+    '''
+    :param actor: USB entity (device, configuration, interface, etc.)
+    :return: the control request that the device is handling, None if there is none
+    '''
+    dev = getattr(getattr(actor, 'app', None), 'dev', None)
+    return getattr(dev, 'current_request', None)
+
+
 def mutable(stage, silent=False):
     def wrap_f(func):
         func_self = None
@@ -58,8 +235,10 @@ def mutable(stage, silent=False):
             response = None
             valid_req = kwargs.get('valid', False)
             info = self.info if not silent else self.debug
+            record = None
             if not valid_req:
-                log_stage(stage)
+                record = stage_logger.begin_stage(stage, get_current_request(self))
+            if not valid_req and self.is_stage_active(stage):
                 session_data = self.get_session_data(stage)
                 data = kwargs.get('fuzzing_data', {})
                 data.update(session_data)
@@ -75,9 +254,11 @@ def mutable(stage, silent=False):
                         info('Calling %s (stage: "%s")' % (func.__name__, stage))
                     response = func(self, *args, **kwargs)
             except Exception as e:
+                stage_logger.end_stage(record)
                 self.logger.error(traceback.format_exc())
                 self.logger.error(''.join(traceback.format_stack()))
                 raise e
+            stage_logger.end_stage(record)
             if response is not None:
                 info('Response: %s' % binascii.hexlify(response))
             return response
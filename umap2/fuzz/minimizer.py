@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+'''
+Minimize the mutations of a failed test
+
+Usage:
+    umap2minimize --session <file> -t <test> -o <output> [-d <pre,post>] [--runs <runs>] [--test-time <seconds>]
+                  [--mutation-timeout <seconds>] [-b <address>]
+    umap2minimize -r <reproducer> -o <output> [-d <pre,post>] [--runs <runs>] [--test-time <seconds>]
+                  [--mutation-timeout <seconds>] [-b <address>]
+
+Options:
+    --session <file>                    kitty session file (of umap2kitty or of a coordinator)
+    -t --test <test>                    number of the failed test in the session
+    -r --reproducer <reproducer>        reproducer file to minimize
+    -o --output <output>                path of the minimal reproducer file
+    -d --disconnect-delays=<pre,post>   number of seconds to wait in the post_test before and after
+                                        disconnecting the device [default: 0.0,0.0]
+    --runs <runs>                       number of times to run each candidate,
+                                        a candidate fails if any of the runs fails [default: 1]
+    --test-time <seconds>               time to wait for the host in each run [default: 3.0]
+    --mutation-timeout <seconds>        time to wait for the stack to request the mutations in each run,
+                                        a run in which they are not requested fails (as in umap2kitty)
+                                        [default: 10.0]
+    -b --binary <address>               serve the stack over the binary protocol on the given address
+                                        (unix:<path> or <host>:<port>) instead of JSON-RPC
+
+The minimizer takes the place of umap2kitty, connect umap2fuzz to it the same way.
+Candidates are run through the normal disconnect / reconnect cycle of the controller.
+First the set of mutated stages is minimized, then the bytes of each mutated payload
+that differ from the default payload of the stage.
+The minimal reproducer can be replayed with ``umap2fuzz -r <output>``.
+'''
+import binascii
+import json
+import threading
+import time
+
+import docopt
+from kitty.data.report import Report
+
+
+def ddmin(items, fails):
+    '''
+    Delta debugging, find a minimal subset of items that still fails
+
+    :param items: list of items, should fail
+    :param fails: callable, returns True if a list of items fails
+    :return: 1-minimal failing list of items (in the original order)
+    '''
+    n = 2
+    while len(items) >= 2:
+        chunk = (len(items) + n - 1) // n
+        subsets = [items[i:i + chunk] for i in range(0, len(items), chunk)]
+        reduced = False
+        for subset in subsets:
+            if fails(subset):
+                items, n, reduced = subset, 2, True
+                break
+        if not reduced and len(subsets) > 2:
+            for i in range(len(subsets)):
+                complement = [item for j, subset in enumerate(subsets) if j != i for item in subset]
+                if fails(complement):
+                    items, n, reduced = complement, max(n - 1, 2), True
+                    break
+        if not reduced:
+            if n >= len(items):
+                break
+            n = min(n * 2, len(items))
+    return items
+
+
+def get_byte_changes(default, payload):
+    '''
+    :param default: default payload of the stage
+    :param payload: mutated payload
+    :return: list of changes, offsets of the bytes that differ,
+        and 'length' if the length of the payload differs
+    '''
+    changes = [i for i in range(min(len(default), len(payload))) if default[i:i + 1] != payload[i:i + 1]]
+    if len(default) != len(payload):
+        changes.append('length')
+    return changes
+
+
+def apply_byte_changes(default, payload, changes):
+    '''
+    :param default: default payload of the stage
+    :param payload: mutated payload
+    :param changes: subset of the changes from get_byte_changes
+    :return: the default payload with the given changes from the mutated payload
+    '''
+    result = bytearray(default)
+    if 'length' in changes:
+        result = result[:len(payload)] + bytearray(payload[len(default):])
+    for i in changes:
+        if i != 'length':
+            result[i] = bytearray(payload)[i]
+    return bytes(result)
+
+
+class Reproducer(object):
+    '''
+    Mutations that reproduce a failure, served to the stack instead of a fuzzer.
+    Each stage is mutated every time the stack requests it.
+    '''
+
+    def __init__(self, mutations, test=None):
+        '''
+        :param mutations: list of (stage, payload) pairs
+        :param test: number of the test that the mutations were taken from (default: None)
+        '''
+        self.mutations = [(stage, payload) for stage, payload in mutations]
+        self.test = test
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        mutations = [(m['stage'], binascii.unhexlify(m['payload'])) for m in data['mutations']]
+        return cls(mutations, data.get('test'))
+
+    def save(self, path):
+        data = {
+            'test': self.test,
+            'mutations': [
+                {'stage': stage, 'payload': binascii.hexlify(payload).decode()}
+                for stage, payload in self.mutations
+            ],
+        }
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=4)
+
+    @classmethod
+    def from_report(cls, report, test):
+        '''
+        :type report: :class:`~kitty.data.report.Report`
+        :param report: failure report from a kitty session
+        :param test: number of the test
+        '''
+        reproducer = report.get('reproducer')
+        if reproducer is not None:
+            # merged by the coordinator, '<index>/<stage>' -> hex payload
+            entries = sorted(reproducer._data_fields.items(), key=lambda kv: int(kv[0].split('/', 1)[0]))
+            mutations = [(k.split('/', 1)[1], binascii.unhexlify(v)) for k, v in entries]
+            return cls(mutations, test)
+        payload = report.get('payload')
+        if payload is None:
+            raise Exception('Report of test %s has no mutations' % (test))
+        stage = report.get('fuzz_path').split('->')[-1]
+        return cls([(stage, binascii.unhexlify(payload.get('hex')))], test)
+
+    def get_mutation(self, stage, data=None):
+        for name, payload in self.mutations:
+            if name == stage:
+                return payload
+        return None
+
+    def get_test_mutations(self):
+        # the stack requests each mutation
+        return None
+
+    def report_mutation(self, stage, test):
+        pass
+
+    def start(self):
+        pass
+
+
+class Minimizer(object):
+    '''
+    Serves the candidate mutations to the stack (in place of the fuzzer),
+    and runs each candidate with the controller.
+    '''
+
+    def __init__(self, controller, reproducer, defaults=None, runs=1, test_time=3.0, mutation_timeout=10.0,
+                 logger=None):
+        '''
+        :type controller: :class:`~umap2.fuzz.controller.UmapController`
+        :param controller: controller (already set up)
+        :type reproducer: :class:`~umap2.fuzz.minimizer.Reproducer`
+        :param reproducer: the mutations of the failed test
+        :param defaults: dictionary of stage -> default payload, for minimizing the bytes (default: None)
+        :param runs: number of times to run each candidate (default: 1)
+        :param test_time: time (in seconds) to wait for the host in each run (default: 3.0)
+        :param mutation_timeout: time (in seconds) to wait for the stack to request the mutations in each run,
+            a run in which they are not requested fails (default: 10.0)
+        :param logger: logger (default: None, the controller's logger)
+        '''
+        self.controller = controller
+        self.reproducer = reproducer
+        self.defaults = defaults if defaults else {}
+        self.runs = runs
+        self.test_time = test_time
+        self.mutation_timeout = mutation_timeout
+        self.logger = logger if logger else controller.logger
+        self.candidate = Reproducer([])
+        self.results = {}
+        self.test_number = 0
+        self.mutated = threading.Event()
+
+    def get_mutation(self, stage, data=None):
+        payload = self.candidate.get_mutation(stage, data)
+        if payload is not None:
+            self.signal_mutated()
+        return payload
+
+    def signal_mutated(self):
+        '''
+        Called when a mutation is served to the stack,
+        or when the host is silent (as kitty's ClientTarget)
+        '''
+        self.mutated.set()
+
+    def get_test_mutations(self):
+        return None
+
+    def report_mutation(self, stage, test):
+        pass
+
+    def start(self):
+        pass
+
+    def run_test(self, mutations):
+        '''
+        Run the mutations once through a disconnect / reconnect cycle
+
+        :return: whether the test failed
+        '''
+        self.candidate = Reproducer(mutations)
+        self.mutated.clear()
+        self.controller.pre_test(self.test_number)
+        start = time.time()
+        self.controller.trigger()
+        # as in kitty's ClientTarget, the test fails if the stack did not request the mutations
+        # (e.g. the host hangs before it gets to the mutated stages)
+        requested = self.mutated.wait(self.mutation_timeout)
+        time.sleep(max(0, start + self.test_time - time.time()))
+        self.controller.post_test()
+        self.candidate = Reproducer([])
+        self.test_number += 1
+        if not requested:
+            self.logger.info('The mutations were not requested by the stack (trigger timed out)')
+            return True
+        return self.controller.get_report().get_status() != Report.PASSED
+
+    def fails(self, mutations):
+        '''
+        :param mutations: list of (stage, payload) pairs
+        :return: whether any run of the mutations failed
+        '''
+        key = tuple(mutations)
+        if key not in self.results:
+            self.results[key] = any(self.run_test(mutations) for _ in range(self.runs))
+            self.logger.info('%s stages, %d bytes: %s' % (
+                [stage for stage, _ in mutations],
+                sum(len(payload) for _, payload in mutations),
+                'failed' if self.results[key] else 'passed'
+            ))
+        return self.results[key]
+
+    def minimize(self):
+        '''
+        :return: minimal reproducer
+        '''
+        mutations = self.reproducer.mutations
+        if not self.fails(mutations):
+            raise Exception('The failure of test %s does not reproduce' % (self.reproducer.test))
+        mutations = ddmin(mutations, self.fails)
+        for i, (stage, payload) in enumerate(mutations):
+            default = self.defaults.get(stage)
+            if default is None:
+                self.logger.info('No default payload for stage %s, keeping the payload' % (stage))
+                continue
+
+            def fails_with(changes):
+                return self.fails(mutations[:i] + [(stage, apply_byte_changes(default, payload, changes))] + mutations[i + 1:])
+
+            changes = ddmin(get_byte_changes(default, payload), fails_with)
+            mutations = mutations[:i] + [(stage, apply_byte_changes(default, payload, changes))] + mutations[i + 1:]
+        return Reproducer(mutations, self.reproducer.test)
+
+
+def get_default_payloads(stages):
+    '''
+    :param stages: stage names
+    :return: dictionary of stage -> default (not mutated) payload of its template
+    '''
+    from umap2.fuzz.templates import get_template
+    templates = dict((stage, get_template(stage)) for stage in stages)
+    return dict((stage, template.render().tobytes()) for stage, template in templates.items() if template is not None)
+
+
+def main():
+    from kitty.data.data_manager import DataManager
+    from kitty.remote.rpc import RpcServer
+    from umap2.fuzz.fuzz_engine import get_controller
+    from umap2.fuzz.transport import BinaryFuzzerServer
+    options = docopt.docopt(__doc__)
+    if options['--reproducer']:
+        reproducer = Reproducer.load(options['--reproducer'])
+    else:
+        test = int(options['--test'])
+        dataman = DataManager(options['--session'])
+        dataman.start()
+        reproducer = Reproducer.from_report(dataman.get_report_by_id(test), test)
+        dataman.stop()
+    controller = get_controller(options)
+    minimizer = Minimizer(
+        controller,
+        reproducer,
+        defaults=get_default_payloads(stage for stage, _ in reproducer.mutations),
+        runs=int(options['--runs']),
+        test_time=float(options['--test-time']),
+        mutation_timeout=float(options['--mutation-timeout'])
+    )
+    # when the host is silent, there is no point in waiting for the mutation request
+    controller.add_silent_callback(minimizer.signal_mutated)
+    if options['--binary']:
+        server = BinaryFuzzerServer(options['--binary'], impl=minimizer, logger=controller.logger)
+    else:
+        server = RpcServer(host='localhost', port=26007, impl=minimizer)
+    thread = threading.Thread(target=server.start)
+    thread.daemon = True
+    thread.start()
+    controller.setup()
+    try:
+        result = minimizer.minimize()
+    finally:
+        controller.teardown()
+    result.save(options['--output'])
+    print('Minimal reproducer (%d runs) saved to %s' % (minimizer.test_number, options['--output']))
+
+
+if __name__ == '__main__':
+    main()
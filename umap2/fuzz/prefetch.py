@@ -0,0 +1,121 @@
+'''
+Prefetching mutation client for the Umap stack
+
+The client fetches all the mutations of a test from the fuzzer
+(:class:`~umap2.fuzz.client_fuzzer.Umap2ClientFuzzer`) in a single RPC call
+before the device is connected, and serves the mutation requests from memory,
+so EP0 responses do not wait for the fuzzer.
+The use of prefetched mutations is reported back to the fuzzer
+by a background thread.
+
+If the fuzzer does not support batched retrieval, or the mutation of the
+current test depends on session data from the stack, the requests are
+forwarded to the fuzzer one by one.
+'''
+import logging
+import threading
+
+from six.moves.queue import Queue
+
+
+class PrefetchingMutationClient(object):
+
+    def __init__(self, fuzzer, logger=None):
+        '''
+        :param fuzzer: RPC client of the fuzzer
+        :param logger: logger (default: None, use the umap2 logger)
+        '''
+        self.fuzzer = fuzzer
+        self.logger = logger if logger else logging.getLogger('umap2')
+        # RPC calls are made by both the stack and the reporter thread
+        self.lock = threading.Lock()
+        self.enabled = True
+        self.test = None
+        self.stages = None
+        self.mutations = None
+        self.index_in_path = 0
+        self.reports = Queue()
+        self.thread = None
+
+    def prefetch(self):
+        '''
+        Fetch the mutations of the current test from the fuzzer.
+        Should be called when the test starts, before the device is connected.
+
+        :return: True if the mutations of the test are served from memory
+        '''
+        self.invalidate()
+        if not self.enabled:
+            return False
+        with self.lock:
+            try:
+                result = self.fuzzer.get_test_mutations()
+            except Exception as ex:
+                self.logger.warning('Batched mutations are not available, requesting mutations one by one (%s)' % ex)
+                self.enabled = False
+                return False
+        if not result or result['mutations'] is None:
+            return False
+        self.test = result['test']
+        self.mutations = result['mutations']
+        self.stages = [stage.lower() for stage in result['stages']]
+        self.logger.debug('Prefetched mutations of test %s for stages: %s' % (self.test, list(self.mutations.keys())))
+        return True
+
+    def invalidate(self):
+        '''
+        Drop the mutations of the current test
+        '''
+        self.test = None
+        self.stages = None
+        self.mutations = None
+        self.index_in_path = 0
+
+    def get_mutation(self, stage, data=None):
+        '''
+        :param stage: stage name
+        :param data: dictionary of session data (default: None)
+        :return: mutation for the stage, None if the stage should not be mutated
+        '''
+        if self.stages is None:
+            with self.lock:
+                return self.fuzzer.get_mutation(stage=stage, data={} if data is None else data)
+        # follow the fuzzing path the same way the fuzzer does
+        last_index = len(self.stages) - 1
+        if self.stages[self.index_in_path] == stage.lower():
+            if self.index_in_path == last_index:
+                for name, payload in self.mutations.items():
+                    if name.lower() == stage.lower():
+                        self._report(name)
+                        return payload
+                return None
+            self.index_in_path += 1
+        return None
+
+    def _report(self, stage):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._report_loop)
+            self.thread.daemon = True
+            self.thread.start()
+        self.reports.put((stage, self.test))
+
+    def _report_loop(self):
+        while True:
+            report = self.reports.get()
+            if report is None:
+                break
+            stage, test = report
+            with self.lock:
+                try:
+                    self.fuzzer.report_mutation(stage=stage, test=test)
+                except Exception as ex:
+                    self.logger.warning('Failed to report mutation of stage %s: %s' % (stage, ex))
+
+    def stop(self):
+        '''
+        Stop the reporter thread, after all the pending reports are sent
+        '''
+        if self.thread:
+            self.reports.put(None)
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+'''
+Query the results of fuzzing campaigns
+
+Usage:
+    umap2results campaigns <db>
+    umap2results tests <db> [-c <campaign>]... [-s <stage>] [-m <hash>] [-q <sequence>] [-f] [-l <limit>]
+    umap2results group <db> <field> [-c <campaign>]... [-s <stage>] [-f]
+    umap2results export <db> <directory> [-c <campaign>]... [-s <stage>] [-m <hash>] [-q <sequence>]
+
+Options:
+    -c --campaign <campaign>    only the tests of this campaign (id)
+    -s --stage <stage>          only the tests that fuzzed this stage
+    -m --mutation <hash>        only the tests with this mutation hash
+    -q --sequence <sequence>    only the tests with this request sequence hash
+    -f --failed                 only the failed tests
+    -l --limit <limit>          max number of tests to list [default: 100]
+
+Commands:
+    campaigns   list the campaigns in the results file
+    tests       list the tests
+    group       count the tests and failures by a field
+                (stage, mutation_hash, sequence_hash, reason or campaign)
+    export      write a reproducer (see umap2fuzz -r) for each failed test into the directory
+
+The results are recorded by ``umap2kitty --results <db>`` (or ``umap2fuzz -s ... --results <db>``),
+each session of the fuzzer is a campaign.
+For each test the results file has the fuzzed stage, the hash and the payload of the mutation
+that was served, the start time and the duration of the test,
+the sequence of requests of the host (see :mod:`umap2.fuzz.feedback`)
+and the failure status.
+'''
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import docopt
+
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS campaigns (
+        id INTEGER PRIMARY KEY,
+        name TEXT,
+        stage_file TEXT,
+        model_hash TEXT,
+        started REAL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS tests (
+        campaign INTEGER,
+        test INTEGER,
+        stage TEXT,
+        mutation_hash TEXT,
+        payload BLOB,
+        start REAL,
+        duration REAL,
+        sequence_hash TEXT,
+        sequence TEXT,
+        failed INTEGER,
+        reason TEXT,
+        PRIMARY KEY (campaign, test)
+    )''',
+    'CREATE INDEX IF NOT EXISTS tests_stage ON tests (stage)',
+    'CREATE INDEX IF NOT EXISTS tests_failed ON tests (failed)',
+    'CREATE INDEX IF NOT EXISTS tests_mutation_hash ON tests (mutation_hash)',
+    'CREATE INDEX IF NOT EXISTS tests_sequence_hash ON tests (sequence_hash)',
+]
+
+TEST_FIELDS = [
+    'campaign', 'test', 'stage', 'mutation_hash', 'payload', 'start', 'duration',
+    'sequence_hash', 'sequence', 'failed', 'reason'
+]
+
+GROUP_FIELDS = ['stage', 'mutation_hash', 'sequence_hash', 'reason', 'campaign']
+
+
+def mutation_hash(payload):
+    '''
+    :param payload: mutation payload
+    :return: hash of the payload (hex string), None if there is no payload
+    '''
+    if payload is None:
+        return None
+    return hashlib.sha1(payload).hexdigest()[:16]
+
+
+class ResultStore(object):
+    '''
+    SQLite file with the results of the tests of fuzzing campaigns.
+    Tests are written in batches, each batch in a single transaction.
+    '''
+
+    def __init__(self, path, batch_size=100, flush_interval=5.0):
+        '''
+        :param path: path of the results file
+        :param batch_size: number of tests to write in a transaction (default: 100)
+        :param flush_interval: max time (in seconds) to keep a test before writing it (default: 5.0)
+        '''
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # the tests are recorded by the thread of the fuzzer
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+        self.campaign = None
+        self.pending = []
+        self.last_flush = time.time()
+
+    def start_campaign(self, name, stage_file, model_hash):
+        '''
+        Start a new campaign, the tests are recorded to it
+
+        :param name: campaign name
+        :param stage_file: path of the stage file
+        :param model_hash: hash of the model
+        :return: id of the campaign
+        '''
+        with self.conn:
+            cursor = self.conn.execute(
+                'INSERT INTO campaigns (name, stage_file, model_hash, started) VALUES (?, ?, ?, ?)',
+                (name, stage_file, model_hash, time.time())
+            )
+        self.campaign = cursor.lastrowid
+        return self.campaign
+
+    def add_test(self, test, stage, payload, start, duration, sequence, failed, reason=None):
+        '''
+        :param test: test number
+        :param stage: the fuzzed stage
+        :param payload: the mutation that was served (None if the stage was not requested)
+        :param start: start time of the test
+        :param duration: duration of the test (in seconds)
+        :param sequence: request sequence of the host (dictionary, see RequestSequence.to_json), or None
+        :param failed: whether the test failed
+        :param reason: failure reason (default: None)
+        '''
+        if self.campaign is None:
+            raise Exception('No campaign was started in %s' % (self.path))
+        self.pending.append((
+            self.campaign,
+            test,
+            stage,
+            mutation_hash(payload),
+            None if payload is None else sqlite3.Binary(payload),
+            start,
+            duration,
+            sequence['hash'] if sequence else None,
+            json.dumps(sequence['events']) if sequence and 'events' in sequence else None,
+            int(bool(failed)),
+            reason,
+        ))
+        if len(self.pending) >= self.batch_size or time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        '''
+        Write the pending tests in a single transaction
+        '''
+        self.last_flush = time.time()
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO tests (%s) VALUES (%s)' % (
+                    ', '.join(TEST_FIELDS), ', '.join('?' * len(TEST_FIELDS))
+                ),
+                pending
+            )
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def get_campaigns(self):
+        '''
+        :return: list of campaigns (sqlite3.Row), with the number of tests and failures of each one
+        '''
+        return self.conn.execute(
+            'SELECT campaigns.*, COUNT(tests.test) AS tests, COALESCE(SUM(tests.failed), 0) AS failures '
+            'FROM campaigns LEFT JOIN tests ON tests.campaign = campaigns.id '
+            'GROUP BY campaigns.id ORDER BY campaigns.id'
+        ).fetchall()
+
+    def _where(self, campaigns=None, stage=None, mutation=None, sequence=None, failed=False):
+        clauses = []
+        params = []
+        if campaigns:
+            clauses.append('campaign IN (%s)' % (', '.join('?' * len(campaigns))))
+            params.extend(int(campaign) for campaign in campaigns)
+        for field, value in [('stage', stage), ('mutation_hash', mutation), ('sequence_hash', sequence)]:
+            if value is not None:
+                clauses.append('%s = ?' % (field))
+                params.append(value)
+        if failed:
+            clauses.append('failed = 1')
+        where = (' WHERE ' + ' AND '.join(clauses)) if clauses else ''
+        return where, params
+
+    def get_tests(self, limit=None, **filters):
+        '''
+        :param limit: max number of tests (default: None, all of them)
+        :param filters: campaigns (list of ids), stage, mutation (hash), sequence (hash), failed (bool)
+        :return: list of tests (sqlite3.Row), ordered by campaign and test number
+        '''
+        where, params = self._where(**filters)
+        query = 'SELECT * FROM tests%s ORDER BY campaign, test' % (where)
+        if limit is not None:
+            query += ' LIMIT %d' % (int(limit))
+        return self.conn.execute(query, params).fetchall()
+
+    def group_by(self, field, **filters):
+        '''
+        :param field: field to group the tests by (one of GROUP_FIELDS)
+        :param filters: same as in get_tests
+        :return: list of (value, tests, failures), the groups with most failures first
+        '''
+        if field not in GROUP_FIELDS:
+            raise Exception('Cannot group by %s (fields: %s)' % (field, ', '.join(GROUP_FIELDS)))
+        where, params = self._where(**filters)
+        return self.conn.execute(
+            'SELECT %s, COUNT(*), SUM(failed) FROM tests%s GROUP BY %s ORDER BY SUM(failed) DESC, COUNT(*) DESC' % (
+                field, where, field
+            ),
+            params
+        ).fetchall()
+
+
+def export_reproducers(store, directory, **filters):
+    '''
+    Write a reproducer file for each failed test that has a mutation
+
+    :param store: ResultStore
+    :param directory: directory to write the reproducers to
+    :param filters: same as in ResultStore.get_tests
+    :return: list of paths of the reproducer files
+    '''
+    from umap2.fuzz.minimizer import Reproducer
+    filters['failed'] = True
+    paths = []
+    for row in store.get_tests(**filters):
+        if row['payload'] is None:
+            continue
+        path = os.path.join(directory, 'campaign%d-test%d.json' % (row['campaign'], row['test']))
+        Reproducer([(row['stage'], bytes(row['payload']))], row['test']).save(path)
+        paths.append(path)
+    return paths
+
+
+def main():
+    options = docopt.docopt(__doc__)
+    if not os.path.exists(options['<db>']):
+        raise Exception('No results file %s' % (options['<db>']))
+    store = ResultStore(options['<db>'])
+    filters = {
+        'campaigns': options['--campaign'],
+        'stage': options['--stage'],
+    }
+    try:
+        if options['campaigns']:
+            print('%-6s %-20s %-16s %-20s %8s %8s' % ('id', 'name', 'model', 'started', 'tests', 'failures'))
+            for row in store.get_campaigns():
+                started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['started']))
+                print('%-6d %-20s %-16s %-20s %8d %8d' % (
+                    row['id'], row['name'], row['model_hash'][:16], started, row['tests'], row['failures']
+                ))
+        elif options['tests']:
+            tests = store.get_tests(
+                limit=int(options['--limit']),
+                mutation=options['--mutation'],
+                sequence=options['--sequence'],
+                failed=options['--failed'],
+                **filters
+            )
+            print('%-8s %-8s %-40s %-16s %-16s %9s  %s' % (
+                'campaign', 'test', 'stage', 'mutation', 'sequence', 'duration', 'status'
+            ))
+            for row in tests:
+                print('%-8d %-8d %-40s %-16s %-16s %9.3f  %s' % (
+                    row['campaign'], row['test'], row['stage'], row['mutation_hash'] or '-',
+                    row['sequence_hash'] or '-', row['duration'],
+                    ('failed: %s' % (row['reason'])) if row['failed'] else 'passed'
+                ))
+        elif options['group']:
+            groups = store.group_by(options['<field>'], failed=options['--failed'], **filters)
+            print('%8s %8s  %s' % ('tests', 'failures', options['<field>']))
+            for value, tests, failures in groups:
+                print('%8d %8d  %s' % (tests, failures, value))
+        elif options['export']:
+            if not os.path.isdir(options['<directory>']):
+                os.makedirs(options['<directory>'])
+            paths = export_reproducers(
+                store, options['<directory>'],
+                mutation=options['--mutation'],
+                sequence=options['--sequence'],
+                **filters
+            )
+            print('Exported %d reproducers to %s' % (len(paths), options['<directory>']))
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+'''
+Templates of the fuzzed stages
+
+The templates are built when their module is imported,
+so the template modules are imported only when one of their stages is needed.
+Each template is a module-level variable with the name of its stage.
+'''
+import importlib
+
+
+#: the module (in umap2.fuzz.templates) of the template of each stage
+STAGE_MODULES = {
+    # audio
+    'audio_header_descriptor': 'audio',
+    'audio_input_terminal_descriptor': 'audio',
+    'audio_output_terminal_descriptor': 'audio',
+    'audio_feature_unit_descriptor': 'audio',
+    'audio_as_interface_descriptor': 'audio',
+    'audio_as_format_type_descriptor': 'audio',
+    'audio_hid_descriptor': 'audio',
+    'audio_report_descriptor': 'audio',
+    'audio_control_interface_descriptor': 'audio',
+    # cdc
+    'cdc_control_interface_descriptor': 'cdc',
+    'cdc_notification': 'cdc',
+    # enum
+    'device_descriptor': 'enum',
+    'device_qualifier_descriptor': 'enum',
+    'configuration_descriptor': 'enum',
+    'other_speed_configuration_descriptor': 'enum',
+    'endpoint_descriptor': 'enum',
+    'string_descriptor': 'enum',
+    'string_descriptor_zero': 'enum',
+    # hid
+    'hid_descriptor': 'hid',
+    'hid_report_descriptor': 'hid',
+    # hub (overrides the hub descriptor of enum)
+    'hub_descriptor': 'hub',
+    # mass_storage
+    'msc_get_max_lun_response': 'mass_storage',
+    'scsi_request_sense_response': 'mass_storage',
+    'scsi_inquiry_response': 'mass_storage',
+    'scsi_mode_sense_6_response': 'mass_storage',
+    'scsi_mode_sense_10_response': 'mass_storage',
+    'scsi_read_format_capacities': 'mass_storage',
+    'scsi_read_capacity_10_response': 'mass_storage',
+    # smart_card
+    'smartcard_GetParameters_response': 'smart_card',
+    'smartcard_ResetParameters_response': 'smart_card',
+    'smartcard_SetParameters_response': 'smart_card',
+    'smartcard_IccPowerOn_response': 'smart_card',
+    'smartcard_XfrBlock_response': 'smart_card',
+    'smartcard_IccPowerOff_response': 'smart_card',
+    'smartcard_GetSlotStatus_response': 'smart_card',
+    'smartcard_IccClock_response': 'smart_card',
+    'smartcard_T0APDU_response': 'smart_card',
+    'smartcard_Escape_response': 'smart_card',
+}
+
+
+def get_template(stage):
+    '''
+    Get the template of a stage, importing only its module
+
+    :param stage: stage name
+    :return: the template of the stage, None if the stage is not fuzzed
+    '''
+    module_name = STAGE_MODULES.get(stage)
+    if module_name is None:
+        return None
+    module = importlib.import_module('%s.%s' % (__name__, module_name))
+    return getattr(module, stage)
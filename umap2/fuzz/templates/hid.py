@@ -24,7 +24,7 @@ from kitty.model import UInt8, LE16, BitField, Static
 from kitty.model import ENC_INT_LE
 from kitty.core import KittyException
 from random import Random
-from generic import DynamicInt, Descriptor
+from umap2.fuzz.templates.generic import DynamicInt, Descriptor
 
 
 opcodes = {
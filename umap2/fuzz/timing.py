@@ -0,0 +1,175 @@
+'''
+Adaptive disconnect / reconnect delays
+
+The stack measures the timing of the host in each test, and pushes it
+to the fuzzer over the control channel when the device is disconnected:
+
+- ``timing {"enumeration": ..., "reaction": ...}``
+
+  - enumeration - time from the connection of the device
+    to the first setup packet of the host (null if the host did not enumerate)
+  - reaction - time from the last mutation that was served
+    to the next request of the host (null if there was none)
+
+The controller keeps each delay at a percentile of the observed times
+(with a margin), instead of fixed delays for the slowest host:
+
+- the delay between the disconnection and the connection in the trigger,
+  and the delay after the disconnection in the post_test,
+  are learned from the enumeration times
+  (the host notices a disconnection as it notices a connection)
+- the delay before the disconnection in the post_test
+  is learned from the reaction times
+
+When the host does not enumerate after a connection, or is silent during a test,
+the delays are widened, and the widening decays over the following tests.
+'''
+import math
+import time
+from collections import deque
+
+
+CMD_TIMING = 'timing'
+
+
+class HostTiming(object):
+    '''
+    Timing of the host in the current test (stack side)
+    '''
+
+    def __init__(self):
+        self.connect_time = None
+        self.first_setup = None
+        self.last_mutation = None
+        self.reaction = None
+
+    def connected(self, now=None):
+        self.connect_time = time.time() if now is None else now
+        self.first_setup = None
+        self.last_mutation = None
+        self.reaction = None
+
+    def setup_packet(self, now=None):
+        now = time.time() if now is None else now
+        if self.connect_time is not None and self.first_setup is None:
+            self.first_setup = now
+        self.host_request(now)
+
+    def host_request(self, now=None):
+        '''
+        Called on any traffic from the host
+        '''
+        if self.last_mutation is not None and self.reaction is None:
+            self.reaction = (time.time() if now is None else now) - self.last_mutation
+
+    def mutation_served(self, now=None):
+        self.last_mutation = time.time() if now is None else now
+        self.reaction = None
+
+    def disconnected(self):
+        '''
+        :return: the timing of the test (dictionary), None if the device was not connected
+        '''
+        if self.connect_time is None:
+            return None
+        result = {
+            'enumeration': None if self.first_setup is None else self.first_setup - self.connect_time,
+            'reaction': self.reaction,
+        }
+        self.connect_time = None
+        return result
+
+
+class DelayEstimator(object):
+    '''
+    A delay that is kept at a percentile of the observed times
+    '''
+
+    def __init__(self, initial, minimum=0.0, maximum=5.0, percentile=95, margin=1.5, window=100, min_samples=5):
+        '''
+        :param initial: delay until there are enough samples
+        :param minimum: minimal delay (default: 0.0)
+        :param maximum: maximal delay (default: 5.0)
+        :param percentile: percentile of the samples to use (default: 95)
+        :param margin: factor of the percentile (default: 1.5)
+        :param window: number of recent samples to keep (default: 100)
+        :param min_samples: number of samples before the initial delay is replaced (default: 5)
+        '''
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.percentile = percentile
+        self.margin = margin
+        self.min_samples = min_samples
+        self.samples = deque(maxlen=window)
+        # set when widened after an anomaly, decays with each sample
+        self.floor = 0.0
+
+    def add(self, sample):
+        self.samples.append(sample)
+        self.floor *= 0.9
+
+    def widen(self):
+        self.floor = min(self.maximum, max(self.value() * 2, 0.05))
+
+    def value(self):
+        if len(self.samples) < self.min_samples:
+            delay = self.initial
+        else:
+            ordered = sorted(self.samples)
+            index = max(0, int(math.ceil(len(ordered) * self.percentile / 100.0)) - 1)
+            delay = ordered[index] * self.margin
+        return min(self.maximum, max(self.minimum, delay, self.floor))
+
+
+class AdaptiveTiming(object):
+    '''
+    The delays of the controller, learned from the timing of the host
+    '''
+
+    def __init__(self, pre_disconnect_delay=0.0, post_disconnect_delay=0.0, reconnect_delay=0.2, maximum=5.0,
+                 logger=None):
+        '''
+        :param pre_disconnect_delay: initial delay before the disconnection in the post_test (default: 0.0)
+        :param post_disconnect_delay: initial delay after the disconnection in the post_test (default: 0.0)
+        :param reconnect_delay: initial delay between the disconnection and the connection (default: 0.2)
+        :param maximum: maximal value of each delay (default: 5.0)
+        :param logger: logger (default: None)
+        '''
+        self.pre_disconnect = DelayEstimator(pre_disconnect_delay, maximum=maximum)
+        self.post_disconnect = DelayEstimator(post_disconnect_delay, maximum=maximum)
+        self.reconnect = DelayEstimator(reconnect_delay, minimum=0.01, maximum=maximum)
+        self.logger = logger
+
+    def update(self, timing):
+        '''
+        :param timing: timing of a test, as reported by the stack
+        '''
+        if timing['enumeration'] is None:
+            self._log('warning', 'host did not enumerate the device, widening the reconnection delays')
+            self.reconnect.widen()
+            self.post_disconnect.widen()
+        else:
+            self.reconnect.add(timing['enumeration'])
+            self.post_disconnect.add(timing['enumeration'])
+        if timing['reaction'] is not None:
+            self.pre_disconnect.add(timing['reaction'])
+
+    def host_silent(self):
+        '''
+        Called when the host was silent during a test
+        '''
+        self._log('warning', 'host is silent, widening the delays')
+        self.pre_disconnect.widen()
+        self.post_disconnect.widen()
+        self.reconnect.widen()
+
+    def get_delays(self):
+        '''
+        :return: tuple of (pre disconnect, post disconnect, reconnect) delays
+        '''
+        return self.pre_disconnect.value(), self.post_disconnect.value(), self.reconnect.value()
+
+    def _log(self, level, msg):
+        if self.logger:
+            getattr(self.logger, level)(msg)
@@ -0,0 +1,368 @@
+'''
+Binary transport for the mutation protocol between the fuzzer (umap2kitty)
+and the stack (umap2fuzz)
+
+An alternative to kitty's JSON-RPC over HTTP: messages are length-prefixed
+binary frames over a single persistent unix or TCP socket.
+Payloads and session data are sent as raw bytes,
+stages are sent as numeric ids (each name is sent once per connection),
+and one-way messages (stage definitions and mutation reports)
+do not wait for a response, so they are pipelined with the requests.
+
+Frame: ``<length:u32> <opcode:u8> <sequence:u32> <body>``,
+responses carry the sequence number of their request.
+
+Addresses are either ``unix:<path>`` or ``<host>:<port>``.
+'''
+import os
+import select
+import socket
+import struct
+import threading
+import traceback
+
+import six
+
+
+FRAME_HEADER = struct.Struct('<IBI')
+
+OP_DEFINE_STAGE = 1
+OP_GET_MUTATION = 2
+OP_GET_TEST_MUTATIONS = 3
+OP_REPORT_MUTATION = 4
+OP_CALL = 5
+OP_RESULT = 0x80
+OP_ERROR = 0x81
+
+# opcodes that do not get a response
+ONE_WAY_OPS = (OP_DEFINE_STAGE, OP_REPORT_MUTATION)
+
+
+def pack_value(value):
+    '''
+    Encode a value (None, bool, int, bytes, text, list or dict with text keys)
+
+    :return: encoded value (bytes)
+    '''
+    if value is None:
+        return b'n'
+    if isinstance(value, bool):
+        return b't' if value else b'f'
+    if isinstance(value, six.integer_types):
+        return b'i' + struct.pack('<q', value)
+    if isinstance(value, (bytes, bytearray)):
+        return b'b' + struct.pack('<I', len(value)) + bytes(value)
+    if isinstance(value, six.text_type):
+        encoded = value.encode('utf-8')
+        return b's' + struct.pack('<I', len(encoded)) + encoded
+    if isinstance(value, (list, tuple)):
+        return b'l' + struct.pack('<I', len(value)) + b''.join(pack_value(v) for v in value)
+    if isinstance(value, dict):
+        return b'd' + struct.pack('<I', len(value)) + b''.join(
+            pack_value(six.text_type(k)) + pack_value(v) for k, v in value.items()
+        )
+    raise ValueError('Cannot encode data of type %s' % type(value))
+
+
+def unpack_value(buff, offset=0):
+    '''
+    Decode a value that was encoded with pack_value
+
+    :return: tuple of (value, offset after the value)
+    '''
+    tag = buff[offset:offset + 1]
+    offset += 1
+    if tag == b'n':
+        return None, offset
+    if tag in (b't', b'f'):
+        return tag == b't', offset
+    if tag == b'i':
+        return struct.unpack_from('<q', buff, offset)[0], offset + 8
+    length = struct.unpack_from('<I', buff, offset)[0]
+    offset += 4
+    if tag == b'b':
+        return bytes(buff[offset:offset + length]), offset + length
+    if tag == b's':
+        return buff[offset:offset + length].decode('utf-8'), offset + length
+    if tag == b'l':
+        result = []
+        for _ in range(length):
+            value, offset = unpack_value(buff, offset)
+            result.append(value)
+        return result, offset
+    if tag == b'd':
+        result = {}
+        for _ in range(length):
+            key, offset = unpack_value(buff, offset)
+            result[key], offset = unpack_value(buff, offset)
+        return result, offset
+    raise ValueError('Invalid value tag: %r' % (tag))
+
+
+def parse_address(address):
+    '''
+    :param address: ``unix:<path>`` or ``<host>:<port>``
+    :return: tuple of (socket family, address)
+    '''
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, port = address.rsplit(':', 1)
+    return socket.AF_INET, (host, int(port))
+
+
+class FrameSocket(object):
+    '''
+    Frame reading and writing over a connected stream socket
+    '''
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buff = bytearray()
+
+    def send_frame(self, opcode, seq, body=b''):
+        self.sock.sendall(FRAME_HEADER.pack(len(body), opcode, seq) + body)
+
+    def _fill(self, size):
+        while len(self.buff) < size:
+            data = self.sock.recv(max(0x10000, size - len(self.buff)))
+            if not data:
+                raise socket.error('connection closed')
+            self.buff += data
+
+    def recv_frame(self):
+        '''
+        :return: tuple of (opcode, sequence, body)
+        :raises: socket.error if the connection was closed
+        '''
+        self._fill(FRAME_HEADER.size)
+        length, opcode, seq = FRAME_HEADER.unpack_from(bytes(self.buff[:FRAME_HEADER.size]))
+        self._fill(FRAME_HEADER.size + length)
+        body = bytes(self.buff[FRAME_HEADER.size:FRAME_HEADER.size + length])
+        del self.buff[:FRAME_HEADER.size + length]
+        return opcode, seq, body
+
+    def shutdown(self):
+        '''
+        Wake up a blocked reader, the socket should still be closed
+        '''
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def close(self):
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+
+class BinaryFuzzerServer(object):
+    '''
+    Serve a fuzzer (:class:`~umap2.fuzz.client_fuzzer.Umap2ClientFuzzer`)
+    over the binary protocol, the equivalent of kitty's RpcServer
+    '''
+
+    def __init__(self, address, impl, logger=None, threaded=False):
+        '''
+        :param address: listening address (``unix:<path>`` or ``<host>:<port>``)
+        :param impl: the fuzzer
+        :param logger: logger (default: None)
+        :param threaded: serve each connection in its own thread,
+            the methods of impl should be thread safe (default: False)
+        '''
+        self.address = address
+        self.impl = impl
+        self.logger = logger
+        self.threaded = threaded
+        self.sock = None
+        self.conns = set()
+        self.stop_event = threading.Event()
+
+    def bind(self):
+        family, addr = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(addr):
+            os.remove(addr)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(addr)
+        self.sock.listen(1)
+
+    def start(self):
+        '''
+        Serving loop, serves one connection at a time (unless threaded)
+        '''
+        if self.sock is None:
+            self.bind()
+        self._log('info', 'Waiting for a client to connect to %s' % (self.address))
+        while not self.stop_event.is_set():
+            try:
+                readable, _, _ = select.select([self.sock], [], [], 0.1)
+                if not readable:
+                    continue
+                conn, _ = self.sock.accept()
+            except (socket.error, ValueError, AttributeError):
+                break
+            if conn.family == socket.AF_INET:
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = FrameSocket(conn)
+            if self.threaded:
+                thread = threading.Thread(target=self.serve, args=(conn,))
+                thread.daemon = True
+                thread.start()
+            else:
+                self.serve(conn)
+        self.close()
+
+    def stop(self):
+        self.stop_event.set()
+        for conn in list(self.conns):
+            conn.shutdown()
+
+    def close(self):
+        if self.sock:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+            self.sock = None
+
+    def serve(self, conn):
+        '''
+        Handle the requests of a single connection until it is closed
+        '''
+        self.conns.add(conn)
+        stages = {}
+        while not self.stop_event.is_set():
+            try:
+                opcode, seq, body = conn.recv_frame()
+            except socket.error:
+                break
+            try:
+                response = OP_RESULT, pack_value(self.handle(stages, opcode, body))
+            except Exception as ex:
+                self._log('error', traceback.format_exc())
+                response = OP_ERROR, pack_value(six.text_type(ex))
+            if opcode in ONE_WAY_OPS:
+                continue
+            try:
+                conn.send_frame(response[0], seq, response[1])
+            except socket.error:
+                break
+        self.conns.discard(conn)
+        conn.close()
+
+    def handle(self, stages, opcode, body):
+        '''
+        :param stages: stage id to name mapping of the connection
+        :param opcode: request opcode
+        :param body: request body
+        :return: result of the request
+        '''
+        if opcode == OP_DEFINE_STAGE:
+            stage_id, name = unpack_value(body)[0]
+            stages[stage_id] = name
+        elif opcode == OP_GET_MUTATION:
+            stage_id, data = unpack_value(body)[0]
+            return self.impl.get_mutation(stage=stages[stage_id], data=data)
+        elif opcode == OP_GET_TEST_MUTATIONS:
+            return self.impl.get_test_mutations()
+        elif opcode == OP_REPORT_MUTATION:
+            stage_id, test = unpack_value(body)[0]
+            self.impl.report_mutation(stage=stages[stage_id], test=test)
+        elif opcode == OP_CALL:
+            method, kwargs = unpack_value(body)[0]
+            if method.startswith('_'):
+                raise Exception('method %s is not allowed' % (method))
+            return getattr(self.impl, method)(**kwargs)
+        else:
+            raise Exception('Unknown opcode: %#x' % (opcode))
+
+    def _log(self, level, msg):
+        if self.logger:
+            getattr(self.logger, level)(msg)
+
+
+class BinaryFuzzerClient(object):
+    '''
+    Stack side of the binary protocol,
+    has the same API as the RpcClient of the fuzzer
+    '''
+
+    def __init__(self, address):
+        '''
+        :param address: address of the fuzzer (``unix:<path>`` or ``<host>:<port>``)
+        '''
+        self.address = address
+        self.conn = None
+        self.seq = 0
+        self.stage_ids = {}
+        self.lock = threading.Lock()
+
+    def connect(self):
+        family, addr = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.connect(addr)
+        if family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.conn = FrameSocket(sock)
+        self.stage_ids = {}
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def _send(self, opcode, body=b''):
+        if self.conn is None:
+            self.connect()
+        self.seq = (self.seq + 1) & 0xffffffff
+        self.conn.send_frame(opcode, self.seq, body)
+        return self.seq
+
+    def _wait(self, seq):
+        # requests are handled in order, so the next response is ours
+        opcode, resp_seq, body = self.conn.recv_frame()
+        if resp_seq != seq:
+            raise Exception('Got response %d while waiting for %d' % (resp_seq, seq))
+        value = unpack_value(body)[0]
+        if opcode == OP_ERROR:
+            raise Exception('Got error from the fuzzer: %s' % (value))
+        return value
+
+    def _request(self, opcode, body=b''):
+        with self.lock:
+            return self._wait(self._send(opcode, body))
+
+    def _stage_id(self, stage):
+        '''
+        :return: id of the stage, the stage is defined on first use
+        '''
+        stage_id = self.stage_ids.get(stage)
+        if stage_id is None:
+            stage_id = len(self.stage_ids)
+            self._send(OP_DEFINE_STAGE, pack_value([stage_id, six.text_type(stage)]))
+            self.stage_ids[stage] = stage_id
+        return stage_id
+
+    def get_mutation(self, stage, data=None):
+        with self.lock:
+            body = pack_value([self._stage_id(stage), {} if data is None else data])
+            return self._wait(self._send(OP_GET_MUTATION, body))
+
+    def get_test_mutations(self):
+        return self._request(OP_GET_TEST_MUTATIONS)
+
+    def report_mutation(self, stage, test):
+        with self.lock:
+            self._send(OP_REPORT_MUTATION, pack_value([self._stage_id(stage), test]))
+
+    def call(self, method, **kwargs):
+        '''
+        Call any other (public) method of the fuzzer
+        '''
+        return self._request(OP_CALL, pack_value([six.text_type(method), kwargs]))
+
+    def start(self):
+        return self.call('start')
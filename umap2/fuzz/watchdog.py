@@ -0,0 +1,138 @@
+'''
+Host watchdog for the Umap2 stack
+
+The watchdog tracks the time since the last setup packet, the last
+data received from the host and the last IN transfer (buffer available),
+and pushes events to the fuzzer over the control channel (see :mod:`umap2.fuzz.channel`):
+
+- ``alive {"since_setup": ..., "since_data": ..., "since_in": ...}`` - the host is active,
+  sent at most once per alive_interval while there is traffic
+- ``silent {"silent_for": ..., "enumerated": ..., "mutated": ...}`` - the host did not
+  send anything for silence_timeout seconds while the device was connected,
+  with whether the enumeration was done (SET_CONFIGURATION) and a mutation was served
+  since the device was connected.
+  A host that is silent after the enumeration may just be idle.
+
+This replaces the heartbeat file (and its mtime granularity),
+so hung hosts are detected within milliseconds.
+'''
+import json
+import threading
+import time
+
+
+CMD_ALIVE = 'alive'
+CMD_SILENT = 'silent'
+
+
+class HostWatchdog(object):
+
+    def __init__(self, channel, silence_timeout=2.0, alive_interval=0.1, check_interval=0.01):
+        '''
+        :type channel: :class:`~umap2.fuzz.channel.ControlChannelClient`
+        :param channel: control channel to push the events on
+        :param silence_timeout: time (in seconds) without host traffic to consider the host silent (default: 2.0)
+        :param alive_interval: minimal time between alive events (default: 0.1)
+        :param check_interval: time between checks (default: 0.01)
+        '''
+        self.channel = channel
+        self.silence_timeout = silence_timeout
+        self.alive_interval = alive_interval
+        self.check_interval = check_interval
+        self.last_setup = 0
+        self.last_data = 0
+        self.last_in = 0
+        self.is_enumerated = False
+        self.is_mutated = False
+        self.armed_time = None
+        self.last_alive_sent = 0
+        self.last_reported = 0
+        self.silent = False
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def setup_packet(self):
+        '''
+        Called when a setup packet is received from the host
+        '''
+        self.last_setup = time.time()
+
+    def data_event(self):
+        '''
+        Called when data is received from the host
+        '''
+        self.last_data = time.time()
+
+    def in_event(self):
+        '''
+        Called when the host reads from an IN endpoint (buffer available)
+        '''
+        self.last_in = time.time()
+
+    def enumerated(self):
+        '''
+        Called when the host sets the configuration of the device
+        '''
+        self.is_enumerated = True
+
+    def mutation_served(self):
+        '''
+        Called when a mutation is served to the host
+        '''
+        self.is_mutated = True
+
+    def arm(self):
+        '''
+        Start watching for host silence (when the device is connected)
+        '''
+        self.silent = False
+        self.is_enumerated = False
+        self.is_mutated = False
+        self.armed_time = time.time()
+
+    def disarm(self):
+        '''
+        Stop watching for host silence (when the device is disconnected)
+        '''
+        self.armed_time = None
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        self.thread = None
+
+    def _loop(self):
+        while not self.stop_event.wait(self.check_interval):
+            self.check()
+
+    def check(self, now=None):
+        '''
+        Check the host activity and push events if needed
+        '''
+        now = time.time() if now is None else now
+        last = max(self.last_setup, self.last_data, self.last_in)
+        if last > self.last_reported and (self.silent or now - self.last_alive_sent >= self.alive_interval):
+            self.silent = False
+            self.last_reported = last
+            self.last_alive_sent = now
+            self.channel.send(CMD_ALIVE, json.dumps({
+                'since_setup': now - self.last_setup if self.last_setup else None,
+                'since_data': now - self.last_data if self.last_data else None,
+                'since_in': now - self.last_in if self.last_in else None,
+            }))
+        if self.armed_time is not None and not self.silent:
+            silent_for = now - max(last, self.armed_time)
+            if silent_for > self.silence_timeout:
+                self.silent = True
+                self.channel.send(CMD_SILENT, json.dumps({
+                    'silent_for': silent_for,
+                    'enumerated': self.is_enumerated,
+                    'mutated': self.is_mutated,
+                }))
@@ -0,0 +1,255 @@
+'''
+asyncio based physical interface API (python 3 only)
+
+An AsyncPhyInterface delivers the traffic from the host as a stream of
+events (setup packets, OUT data and IN buffer availability),
+and its endpoint operations (send_on_endpoint, stall_ep0, ack_status_stage)
+are coroutines.
+
+Device classes can be either:
+
+- Existing (synchronous) device classes, which are used unchanged:
+  they are created with the phy's :func:`~AsyncPhyInterface.sync_phy`
+  adapter, their phy calls are queued while the handler runs,
+  and awaited in order once it returns.
+- Asynchronous device classes, whose handlers (handle_request,
+  handle_data_available and handle_buffer_available) are coroutines
+  that await the phy's operations directly.
+  Long operations (disk I/O, network bridging) in such handlers
+  do not block the servicing of other endpoints and devices.
+
+::
+
+    phy = MyAsyncPhy(app)
+    dev = app.load_device('keyboard', phy.sync_phy())
+    dev.connect()
+    loop.run_until_complete(phy.run())
+'''
+import asyncio
+import inspect
+
+from umap2.phy.iphy import PhyInterface
+
+
+class PhyEvent(object):
+    '''
+    Event from the host side of the phy
+    '''
+
+    setup = 'setup'
+    data = 'data'
+    buffer = 'buffer'
+    connect = 'connect'
+    disconnect = 'disconnect'
+
+    def __init__(self, event_type, ep_num=0, data=b''):
+        '''
+        :param event_type: one of PhyEvent.{setup,data,buffer,connect,disconnect}
+        :param ep_num: endpoint number (default: 0)
+        :param data: setup packet (and data stage) for setup events, received data for data events
+        '''
+        self.type = event_type
+        self.ep_num = ep_num
+        self.data = data
+
+    def __str__(self):
+        return '%s ep=%d len=%d' % (self.type, self.ep_num, len(self.data))
+
+
+class AsyncPhyInterface(PhyInterface):
+    '''
+    This class specifies the API of an asyncio based physical interface.
+    Subclasses push host events with put_event, and implement the
+    endpoint coroutines.
+    '''
+
+    def __init__(self, app, name, idle_timeout=0.001):
+        '''
+        :type app: :class:`~umap2.app.base.Umap2App`
+        :param app: application instance
+        :param name: name of the phy
+        :param idle_timeout: how long to wait for an event before checking should_stop_phy (default: 0.001)
+        '''
+        super(AsyncPhyInterface, self).__init__(app, name)
+        self.idle_timeout = idle_timeout
+        self.events = None
+        self.pending = []
+        self.tasks = set()
+
+    def sync_phy(self):
+        '''
+        :return: a synchronous phy adapter, to be used by existing device classes
+        '''
+        return SyncPhyAdapter(self)
+
+    def get_event_queue(self):
+        if self.events is None:
+            self.events = asyncio.Queue()
+        return self.events
+
+    def put_event(self, event):
+        '''
+        Add a host event to the event stream
+
+        :type event: :class:`~umap2.phy.aphy.PhyEvent`
+        '''
+        self.get_event_queue().put_nowait(event)
+
+    async def next_event(self, timeout=None):
+        '''
+        :param timeout: timeout in seconds (default: None, wait forever)
+        :return: the next host event, None on timeout
+        '''
+        try:
+            return await asyncio.wait_for(self.get_event_queue().get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.next_event()
+
+    async def send_on_endpoint(self, ep_num, data):
+        '''
+        Send data on a specific endpoint
+
+        :param ep_num: number of endpoint
+        :param data: data to send
+        '''
+        raise NotImplementedError('should be implemented in subclass')
+
+    async def stall_ep0(self):
+        '''
+        Stalls control endpoint (0)
+        '''
+        raise NotImplementedError('should be implemented in subclass')
+
+    async def ack_status_stage(self):
+        '''
+        Acknowledge the status stage of the current control request
+        '''
+        raise NotImplementedError('should be implemented in subclass')
+
+    async def poll_buffers(self):
+        '''
+        Called whenever the run loop is idle, subclasses can push buffer events here
+        '''
+        pass
+
+    async def run(self):
+        '''
+        Handle USB events until should_stop_phy returns True
+        '''
+        self.debug('Started run loop')
+        self.stop = False
+        while not self.stop:
+            event = await self.next_event(self.idle_timeout)
+            if event is not None:
+                await self.handle_event(event)
+            else:
+                await self.poll_buffers()
+            if self.app.should_stop_phy():
+                self.stop = True
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.debug('Done with run loop')
+
+    async def handle_event(self, event):
+        '''
+        Dispatch a single host event to the connected device
+        '''
+        self.verbose('Handling event: %s' % (event))
+        if event.type == PhyEvent.connect:
+            return
+        if event.type == PhyEvent.disconnect:
+            self.stop = True
+            return
+        dev = self.connected_device
+        if dev is None:
+            self.debug('No device connected, dropping event: %s' % (event))
+            return
+        if event.type == PhyEvent.setup:
+            self.app.signal_setup_packet_received()
+            await self.call_device(dev.handle_request, event.data)
+        elif event.type == PhyEvent.data:
+            await self.call_device(dev.handle_data_available, event.ep_num, event.data)
+        elif event.type == PhyEvent.buffer:
+            await self.call_device(dev.handle_buffer_available, event.ep_num)
+        else:
+            self.warning('Unknown event type: %s' % (event.type))
+
+    async def call_device(self, handler, *args):
+        '''
+        Call a device handler (synchronous or coroutine)
+        and perform the phy operations that were queued by synchronous devices
+        '''
+        result = handler(*args)
+        if inspect.isawaitable(result):
+            await result
+        await self.flush_pending()
+
+    async def flush_pending(self):
+        while self.pending:
+            op, args = self.pending.pop(0)
+            await op(*args)
+
+    def spawn(self, coro):
+        '''
+        Run a coroutine concurrently with the run loop
+        (e.g. long device operations that should not block EP0)
+        '''
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+
+class SyncPhyAdapter(PhyInterface):
+    '''
+    Synchronous phy API on top of an AsyncPhyInterface.
+    Lets the existing device classes run unchanged:
+    their phy operations are queued and performed by the async phy
+    once the device handler returns.
+    '''
+
+    def __init__(self, aphy):
+        '''
+        :type aphy: :class:`~umap2.phy.aphy.AsyncPhyInterface`
+        :param aphy: the async phy
+        '''
+        super(SyncPhyAdapter, self).__init__(aphy.app, aphy.name)
+        self.aphy = aphy
+
+    def connect(self, usb_device):
+        super(SyncPhyAdapter, self).connect(usb_device)
+        self.aphy.connect(usb_device)
+
+    def disconnect(self):
+        if self.aphy.is_connected():
+            self.aphy.disconnect()
+        return super(SyncPhyAdapter, self).disconnect()
+
+    def set_tap(self, tap):
+        super(SyncPhyAdapter, self).set_tap(tap)
+        self.aphy.set_tap(tap)
+
+    def send_on_endpoint(self, ep_num, data):
+        self.aphy.pending.append((self.aphy.send_on_endpoint, (ep_num, data)))
+
+    def stall_ep0(self):
+        self.aphy.pending.append((self.aphy.stall_ep0, ()))
+
+    def ack_status_stage(self):
+        self.aphy.pending.append((self.aphy.ack_status_stage, ()))
+
+    def run(self):
+        '''
+        Run the async phy's loop until it is done
+        '''
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.aphy.run())
+        finally:
+            loop.close()
@@ -115,6 +115,7 @@ class Max342xPhy(PhyInterface):
 
     def ack_status_stage(self):
         self.verbose('Sending ack!')
+        self.tap_ack()
         self.device.writecmd(self.ack_cmd)
         self.device.readcmd()
 
@@ -151,6 +152,7 @@ class Max342xPhy(PhyInterface):
 
     # HACK: but given the limitations of the MAX chips, it seems necessary
     def send_on_endpoint(self, ep_num, data):
+        self.tap_data_in(ep_num, data)
         if ep_num == 0:
             fifo_reg = Regs.ep0_fifo
             bc_reg = Regs.ep0_byte_count
@@ -188,6 +190,7 @@ class Max342xPhy(PhyInterface):
 
     def stall_ep0(self):
         self.verbose('stalling endpoint 0')
+        self.tap_stall()
         self.write_register(Regs.ep_stalls, 0x23)
 
     def run(self):
@@ -214,11 +217,13 @@ class Max342xPhy(PhyInterface):
                     data_bytes_len = struct.unpack('<H', b[6:])[0]
                     b += self.read_bytes(Regs.ep0_fifo, data_bytes_len)
                 self.app.signal_setup_packet_received()
+                self.tap_setup(b)
                 self.connected_device.handle_request(b)
 
             if irq & PINCTL.out1_data_avail:
                 data = self.read_from_endpoint(1)
                 if data:
+                    self.tap_data_out(1, data)
                     self.connected_device.handle_data_available(1, data)
                 self.clear_irq_bit(Regs.endpoint_irq, PINCTL.out1_data_avail)
 
@@ -194,6 +194,7 @@ class GadgetFsPhy(PhyInterface):
 
     def send_on_endpoint(self, ep_num, data):
         self.debug('send_on_endpoint %d(%d): %s' % (ep_num, len(data), hexlify(data)))
+        self.tap_data_in(ep_num, data)
         address = ep_num | 0x80
         if ep_num == 0:
             self.send_on_ep0(data)
@@ -211,6 +212,7 @@ class GadgetFsPhy(PhyInterface):
 
     def stall_ep0(self):
         self.debug('Stalling EP0')
+        self.tap_stall()
         try:
             if self.req_direction == Request.direction_host_to_device:
                 os.write(self.control_fd, b'')
@@ -278,6 +280,7 @@ class GadgetFsPhy(PhyInterface):
                 self.error('EP0 data have wrong length')
             else:
                 req.data = data
+        self.tap_setup(setup_data + req.data)
         self.connected_device.handle_request(setup_data)
         self.configured = self.connected_device.configuration is not None
 
@@ -334,6 +337,7 @@ class GadgetFsPhy(PhyInterface):
         self.debug('EP0 event type SUSPEND(%#x)' % (GFS_EV_SUSPEND))
 
     def ack_status_stage(self):
+        self.tap_ack()
         os.read(self.control_fd, 0)
         self._setup_endpoints()
 
@@ -397,5 +401,6 @@ class OutEpThread(EndpointThread):
         self.phy.debug('About to read from EP%d' % (self.ep.number))
         buff = os.read(self.ep.fd, self.read_size)
         self.phy.debug('Done reading from EP%d' % (self.ep.number))
+        self.phy.tap_data_out(self.ep.number, buff)
         self.phy.connected_device.handle_data_available(self.ep.number, buff)
 
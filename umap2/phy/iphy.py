@@ -19,6 +19,7 @@ class PhyInterface(object):
         self.logger = logging.getLogger('umap2')
         self.stop = False
         self.connected_device = None
+        self.tap = None
 
     def connect(self, usb_device):
         '''
@@ -69,6 +70,66 @@ class PhyInterface(object):
         '''
         raise NotImplementedError('should be implemented in subclass')
 
+    def set_tap(self, tap):
+        '''
+        Set a tap that will be notified of all the traffic of the phy
+
+        :type tap: :class:`~umap2.phy.tap.PcapTap`
+        :param tap: the tap (None to remove the current tap)
+        '''
+        self.tap = tap
+
+    def _tap_device_info(self, ep_num):
+        '''
+        :return: tuple of (device address, usbmon transfer type of the endpoint)
+        '''
+        dev = self.connected_device
+        devnum = getattr(dev, 'address', 0) if dev else 0
+        xfer_type = 2
+        if ep_num and dev:
+            ep = dev.endpoints.get(ep_num)
+            if ep:
+                # USB transfer type -> usbmon transfer type
+                xfer_type = (2, 0, 3, 1)[ep.transfer_type & 0x03]
+        return devnum, xfer_type
+
+    def tap_setup(self, buf):
+        '''
+        Report a setup packet (and the data stage of OUT requests) to the tap
+        '''
+        if self.tap:
+            self.tap.setup(self._tap_device_info(0)[0], buf)
+
+    def tap_data_in(self, ep_num, data):
+        '''
+        Report data sent by the device to the tap
+        '''
+        if self.tap:
+            devnum, xfer_type = self._tap_device_info(ep_num)
+            self.tap.data_in(devnum, ep_num, xfer_type, data)
+
+    def tap_data_out(self, ep_num, data):
+        '''
+        Report data received from the host to the tap
+        '''
+        if self.tap:
+            devnum, xfer_type = self._tap_device_info(ep_num)
+            self.tap.data_out(devnum, ep_num, xfer_type, data)
+
+    def tap_stall(self):
+        '''
+        Report an EP0 stall to the tap
+        '''
+        if self.tap:
+            self.tap.stall(self._tap_device_info(0)[0])
+
+    def tap_ack(self):
+        '''
+        Report a status stage acknowledgement to the tap
+        '''
+        if self.tap:
+            self.tap.ack(self._tap_device_info(0)[0])
+
     def verbose(self, msg, *args, **kwargs):
         self.logger.verbose('[%s] %s' % (self.name, msg), *args, **kwargs)
 
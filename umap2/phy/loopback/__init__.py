@@ -0,0 +1,3 @@
+'''
+In-process loopback physical layer with a simulated USB host
+'''
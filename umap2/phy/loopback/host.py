@@ -0,0 +1,360 @@
+'''
+Scripted simulated USB host, used by the LoopbackPhy
+
+The host performs a Linux-like enumeration of the connected device
+and then runs a class driver for each of its interfaces.
+Each step of the host script is a single transaction,
+the scripts are generators that yield after each transaction,
+so the phy can check whether it should stop between transactions.
+
+The bus that is passed to the scripts should provide the following API
+(implemented by :class:`~umap2.phy.loopback.loopback_phy.LoopbackPhy`):
+
+- ``control_transfer(setup, data=b'')`` - perform a control transfer,
+  return the response (``b''`` for acknowledged OUT requests)
+  or None if the request was stalled
+- ``data_out(ep_num, data)`` - send data to an OUT endpoint
+- ``data_in(ep_num, timeout=0)`` - read data from an IN endpoint,
+  return None if no data was sent by the device until the timeout
+'''
+import struct
+import logging
+
+from umap2.core.usb import DescriptorType
+from umap2.core.usb_class import USBClass
+
+
+def setup_packet(request_type, request, value, index, length):
+    return struct.pack('<BBHHH', request_type, request, value, index, length)
+
+
+def get_descriptor(dtype, dindex, length, lang_id=0, request_type=0x80):
+    return setup_packet(request_type, 0x06, (dtype << 8) | dindex, lang_id, length)
+
+
+class HostInterface(object):
+    '''
+    Interface of the device, as seen by the host (parsed from the configuration descriptor)
+    '''
+
+    def __init__(self, number, alternate, interface_class, interface_subclass, interface_protocol):
+        self.number = number
+        self.alternate = alternate
+        self.interface_class = interface_class
+        self.interface_subclass = interface_subclass
+        self.interface_protocol = interface_protocol
+        self.endpoints = []
+        self.descriptors = {}
+
+    def get_endpoint(self, direction_in, transfer_type):
+        '''
+        :param direction_in: True for IN endpoint, False for OUT endpoint
+        :param transfer_type: transfer type (see USBEndpoint.transfer_type_*)
+        :return: endpoint number of the first matching endpoint, None if not found
+        '''
+        for address, attributes, _ in self.endpoints:
+            if bool(address & 0x80) == direction_in and (attributes & 0x03) == transfer_type:
+                return address & 0x0f
+        return None
+
+
+def parse_configuration(descriptor):
+    '''
+    :param descriptor: full configuration descriptor
+    :return: list of HostInterface objects
+    '''
+    interfaces = []
+    current = None
+    i = 0
+    while i + 2 <= len(descriptor):
+        dlen, dtype = struct.unpack('BB', descriptor[i:i + 2])
+        if dlen < 2:
+            break
+        desc = descriptor[i:i + dlen]
+        if dtype == DescriptorType.interface and len(desc) >= 9:
+            current = HostInterface(*struct.unpack('BBxBBB', desc[2:8]))
+            interfaces.append(current)
+        elif dtype == DescriptorType.endpoint and len(desc) >= 7 and current:
+            current.endpoints.append(struct.unpack('<BBH', desc[2:6]))
+        elif current:
+            current.descriptors[dtype] = desc
+        i += dlen
+    return interfaces
+
+
+class ClassDriver(object):
+    '''
+    Base class for the class drivers of the simulated host
+    '''
+
+    name = 'ClassDriver'
+
+    def __init__(self):
+        self.logger = logging.getLogger('umap2')
+
+    def run(self, host, bus, iface):
+        '''
+        Generator of class specific transactions for an interface
+
+        :type host: :class:`~umap2.phy.loopback.host.SimulatedHost`
+        :param host: the host
+        :param bus: the bus to perform the transactions on
+        :type iface: :class:`~umap2.phy.loopback.host.HostInterface`
+        :param iface: the interface
+        '''
+        raise NotImplementedError('should be implemented in subclass')
+
+    def debug(self, msg):
+        self.logger.debug('[%s] %s' % (self.name, msg))
+
+
+class HidDriver(ClassDriver):
+    '''
+    Read the report descriptor, set idle and poll the interrupt IN endpoint
+    '''
+
+    name = 'HidDriver'
+
+    def __init__(self, polls=3):
+        super(HidDriver, self).__init__()
+        self.polls = polls
+
+    def run(self, host, bus, iface):
+        report_len = 0xff
+        hid_desc = iface.descriptors.get(DescriptorType.hid)
+        if hid_desc and len(hid_desc) >= 9:
+            report_len = struct.unpack('<H', hid_desc[7:9])[0]
+        host.results['hid_report_descriptor'] = host.control(
+            bus, get_descriptor(DescriptorType.report, 0, report_len, iface.number, request_type=0x81)
+        )
+        yield
+        host.control(bus, setup_packet(0x21, 0x0a, 0, iface.number, 0))
+        yield
+        ep_in = iface.get_endpoint(True, 0x03)
+        if ep_in is not None:
+            reports = host.results.setdefault('hid_reports', [])
+            for _ in range(self.polls):
+                report = host.data_in(bus, ep_in)
+                if report:
+                    reports.append(report)
+                yield
+
+
+class MassStorageDriver(ClassDriver):
+    '''
+    Bulk-only transport, send a few SCSI commands in CBWs and read the CSWs
+    '''
+
+    name = 'MassStorageDriver'
+
+    def __init__(self, timeout=1.0):
+        super(MassStorageDriver, self).__init__()
+        self.timeout = timeout
+        self.tag = 0
+
+    def commands(self):
+        '''
+        :return: list of (name, command block, data transfer length)
+        '''
+        return [
+            ('inquiry', b'\x12\x00\x00\x00\x24\x00', 36),
+            ('test_unit_ready', b'\x00' * 6, 0),
+            ('read_capacity_10', b'\x25' + b'\x00' * 9, 8),
+            ('read_10', b'\x28\x00\x00\x00\x00\x00\x00\x00\x01\x00', 0x200),
+        ]
+
+    def cbw(self, cb, length):
+        self.tag += 1
+        flags = 0x80 if length else 0x00
+        return b'USBC' + struct.pack('<IIBBB', self.tag, length, flags, 0, len(cb)) + cb.ljust(16, b'\x00')
+
+    def run(self, host, bus, iface):
+        host.results['msc_max_lun'] = host.control(bus, setup_packet(0xa1, 0xfe, 0, iface.number, 1))
+        yield
+        ep_out = iface.get_endpoint(False, 0x02)
+        ep_in = iface.get_endpoint(True, 0x02)
+        if ep_out is None or ep_in is None:
+            return
+        for name, cb, length in self.commands():
+            host.data_out(bus, ep_out, self.cbw(cb, length))
+            yield
+            data = b''
+            while len(data) < length:
+                chunk = host.data_in(bus, ep_in, self.timeout)
+                yield
+                if chunk is None:
+                    break
+                data += chunk
+            csw = host.data_in(bus, ep_in, self.timeout)
+            yield
+            status = None
+            if csw and len(csw) == 13 and csw[:4] == b'USBS':
+                tag, residue, status = struct.unpack('<IIB', csw[4:])
+                if tag != self.tag:
+                    self.debug('CSW tag mismatch: %#x != %#x' % (tag, self.tag))
+            host.results['scsi_%s' % name] = (data, status)
+
+
+class SmartCardDriver(ClassDriver):
+    '''
+    Send a few CCID commands on the bulk OUT endpoint and read the responses
+    '''
+
+    name = 'SmartCardDriver'
+
+    def __init__(self, timeout=1.0):
+        super(SmartCardDriver, self).__init__()
+        self.timeout = timeout
+        self.seq = 0
+
+    def commands(self):
+        '''
+        :return: list of (name, message type, data)
+        '''
+        return [
+            ('get_slot_status', 0x65, b''),
+            ('icc_power_on', 0x62, b''),
+            ('xfr_block', 0x6f, b'\x00\xa4\x04\x00\x00'),
+            ('icc_power_off', 0x63, b''),
+        ]
+
+    def run(self, host, bus, iface):
+        ep_out = iface.get_endpoint(False, 0x02)
+        ep_in = iface.get_endpoint(True, 0x02)
+        if ep_out is None or ep_in is None:
+            return
+        for name, msg_type, data in self.commands():
+            msg = struct.pack('<BIBBBBB', msg_type, len(data), 0, self.seq, 0, 0, 0) + data
+            self.seq = (self.seq + 1) & 0xff
+            host.data_out(bus, ep_out, msg)
+            yield
+            host.results['ccid_%s' % name] = host.data_in(bus, ep_in, self.timeout)
+            yield
+
+
+def default_drivers():
+    return {
+        USBClass.HID: HidDriver(),
+        USBClass.MassStorage: MassStorageDriver(),
+        USBClass.SmartCard: SmartCardDriver(),
+    }
+
+
+class SimulatedHost(object):
+    '''
+    Simulated USB host
+    '''
+
+    name = 'SimulatedHost'
+
+    def __init__(self, address=1, drivers=None):
+        '''
+        :param address: address to assign to the device (default: 1)
+        :param drivers: dictionary of interface class: ClassDriver (default: None, use default_drivers())
+        '''
+        self.address = address
+        self.drivers = default_drivers() if drivers is None else drivers
+        self.logger = logging.getLogger('umap2')
+        self.reset()
+
+    def reset(self):
+        '''
+        Reset the host state before a new session
+        '''
+        self.device_descriptor = None
+        self.configuration_descriptor = None
+        self.strings = {}
+        self.interfaces = []
+        self.results = {}
+        self.configured = False
+        self.stats = {
+            'control': 0,
+            'stall': 0,
+            'out': 0,
+            'in': 0,
+            'nak': 0,
+        }
+
+    def control(self, bus, setup, data=b''):
+        self.stats['control'] += 1
+        response = bus.control_transfer(setup, data)
+        if response is None:
+            self.stats['stall'] += 1
+        return response
+
+    def data_out(self, bus, ep_num, data):
+        self.stats['out'] += 1
+        bus.data_out(ep_num, data)
+
+    def data_in(self, bus, ep_num, timeout=0):
+        self.stats['in'] += 1
+        data = bus.data_in(ep_num, timeout)
+        if data is None:
+            self.stats['nak'] += 1
+        return data
+
+    def session(self, bus):
+        '''
+        Generator of a full session - enumeration and class specific traffic
+        '''
+        self.reset()
+        for _ in self.enumerate(bus):
+            yield
+        if not self.configured:
+            return
+        for iface in self.interfaces:
+            driver = self.drivers.get(iface.interface_class)
+            if driver:
+                self.debug('Running %s for interface %d' % (driver.name, iface.number))
+                for _ in driver.run(self, bus, iface):
+                    yield
+
+    def enumerate(self, bus):
+        '''
+        Generator of enumeration transactions, in the order used by Linux
+        '''
+        # first, read the first 64 bytes of the device descriptor
+        self.device_descriptor = self.control(bus, get_descriptor(DescriptorType.device, 0, 64))
+        yield
+        if not self.device_descriptor:
+            self.debug('Device did not respond to the device descriptor request')
+            return
+        self.control(bus, setup_packet(0x00, 0x05, self.address, 0, 0))
+        yield
+        self.device_descriptor = self.control(bus, get_descriptor(DescriptorType.device, 0, 18))
+        yield
+        if not self.device_descriptor or len(self.device_descriptor) < 18:
+            self.debug('Invalid device descriptor')
+            return
+        # bcdUSB >= 2.1 means that the device has a BOS descriptor
+        if struct.unpack('<H', self.device_descriptor[2:4])[0] >= 0x0201:
+            self.control(bus, get_descriptor(DescriptorType.bos, 0, 5))
+            yield
+        header = self.control(bus, get_descriptor(DescriptorType.configuration, 0, 9))
+        yield
+        if not header or len(header) < 4:
+            self.debug('Invalid configuration descriptor')
+            return
+        total_length = struct.unpack('<H', header[2:4])[0]
+        self.configuration_descriptor = self.control(bus, get_descriptor(DescriptorType.configuration, 0, total_length))
+        yield
+        if not self.configuration_descriptor:
+            return
+        self.interfaces = parse_configuration(self.configuration_descriptor)
+        lang_desc = self.control(bus, get_descriptor(DescriptorType.string, 0, 0xff))
+        yield
+        lang_id = 0x0409
+        if lang_desc and len(lang_desc) >= 4:
+            lang_id = struct.unpack('<H', lang_desc[2:4])[0]
+        for index in struct.unpack('BBB', self.device_descriptor[14:17]):
+            if index:
+                s = self.control(bus, get_descriptor(DescriptorType.string, index, 0xff, lang_id))
+                yield
+                if s:
+                    self.strings[index] = s[2:]
+        config_value = struct.unpack('B', self.configuration_descriptor[5:6])[0]
+        self.configured = self.control(bus, setup_packet(0x00, 0x09, config_value, 0, 0)) is not None
+        yield
+
+    def debug(self, msg):
+        self.logger.debug('[%s] %s' % (self.name, msg))
@@ -0,0 +1,161 @@
+'''
+In-process physical layer, connects the device to a simulated USB host
+
+The LoopbackPhy does not need any hardware or kernel module,
+all the transactions are performed synchronously in the run loop,
+so a whole enumeration and class specific traffic run at CPU speed.
+This is useful for regression tests and for benchmarking device classes.
+
+::
+
+    $ umap2emulate -P loopback:once -C mass_storage
+'''
+import time
+from binascii import hexlify
+
+from six.moves.queue import Queue, Empty
+
+from umap2.core.usb import Request
+from umap2.core.usb_device import USBDeviceRequest
+from umap2.phy.iphy import PhyInterface
+from umap2.phy.loopback.host import SimulatedHost
+
+
+class LoopbackPhy(PhyInterface):
+    '''
+    Physical layer that is driven by a :class:`~umap2.phy.loopback.host.SimulatedHost`
+    '''
+
+    def __init__(self, app, host=None, exit_when_done=False, idle_sleep=0.001):
+        '''
+        :type app: :class:`~umap2.app.base.Umap2App`
+        :param app: application instance
+        :type host: :class:`~umap2.phy.loopback.host.SimulatedHost`
+        :param host: the simulated host (default: None, create a new one)
+        :param exit_when_done: stop the run loop when the host session is done (default: False)
+        :param idle_sleep: time to sleep between calls to should_stop_phy when idle (default: 0.001)
+        '''
+        super(LoopbackPhy, self).__init__(app, 'LoopbackPhy')
+        self.host = SimulatedHost() if host is None else host
+        self.exit_when_done = exit_when_done
+        self.idle_sleep = idle_sleep
+        self.session = None
+        self.sessions = 0
+        self.in_queues = {}
+        self.ep0_response = None
+        self.ep0_handled = True
+        self.req = None
+
+    def connect(self, usb_device):
+        super(LoopbackPhy, self).connect(usb_device)
+        self.in_queues = {}
+        self.session = self.host.session(self)
+        self.info('Connected device %s' % self.connected_device.name)
+
+    def disconnect(self):
+        self.session = None
+        return super(LoopbackPhy, self).disconnect()
+
+    def run(self):
+        '''
+        Run the host session, one transaction at a time
+        '''
+        self.debug('Started run loop')
+        self.stop = False
+        while not self.stop:
+            if self.session is not None:
+                try:
+                    next(self.session)
+                except StopIteration:
+                    self.session = None
+                    self.sessions += 1
+                    self.info('Host session done, stats: %s' % (self.host.stats))
+                    if self.exit_when_done:
+                        self.stop = True
+            elif self.idle_sleep:
+                time.sleep(self.idle_sleep)
+            if self.app.should_stop_phy():
+                self.stop = True
+        self.debug('Done with run loop')
+
+    def send_on_endpoint(self, ep_num, data):
+        self.debug('send_on_endpoint %d(%d): %s' % (ep_num, len(data), hexlify(data)))
+        self.tap_data_in(ep_num, data)
+        if ep_num == 0:
+            if self.ep0_handled:
+                self.debug('EP0 already handled for current request, ignoring %d bytes' % (len(data)))
+                return
+            self.ep0_handled = True
+            self.ep0_response = data
+        else:
+            self.in_queues.setdefault(ep_num, Queue()).put(data)
+
+    def stall_ep0(self):
+        self.debug('Stalling EP0')
+        self.tap_stall()
+        self.ep0_handled = True
+        self.ep0_response = None
+
+    def ack_status_stage(self):
+        if not self.ep0_handled:
+            self.ep0_handled = True
+            self.ep0_response = b''
+            self.tap_ack()
+
+    def control_transfer(self, setup, data=b''):
+        '''
+        Perform a control transfer
+
+        :param setup: setup packet (8 bytes)
+        :param data: data stage of OUT requests (default: b'')
+        :return: response (truncated to wLength), b'' for acknowledged OUT requests, None if stalled
+        '''
+        if not self.is_connected():
+            return None
+        self.app.signal_setup_packet_received()
+        req = USBDeviceRequest(setup)
+        self.ep0_handled = False
+        self.ep0_response = None
+        self.tap_setup(setup + data)
+        self.connected_device.handle_request(setup + data)
+        if not self.ep0_handled:
+            if req.get_direction() == Request.direction_host_to_device:
+                self.debug('Request was not handled, acknowledging')
+                self.ep0_response = b''
+            else:
+                self.debug('Request was not handled, no response')
+        self.ep0_handled = True
+        response = self.ep0_response
+        if response is not None:
+            response = response[:req.length]
+        return response
+
+    def data_out(self, ep_num, data):
+        '''
+        Send data to an OUT endpoint of the device
+        '''
+        if self.is_connected():
+            self.tap_data_out(ep_num, data)
+            self.connected_device.handle_data_available(ep_num, data)
+
+    def data_in(self, ep_num, timeout=0):
+        '''
+        Read data from an IN endpoint of the device
+
+        :param ep_num: endpoint number
+        :param timeout: how long to poll the device for data (default: 0, poll once)
+        :return: the data sent by the device, None if there is no data
+        '''
+        queue = self.in_queues.setdefault(ep_num, Queue())
+        end = time.time() + timeout
+        while self.is_connected():
+            if queue.empty():
+                self.connected_device.handle_buffer_available(ep_num)
+            try:
+                return queue.get_nowait()
+            except Empty:
+                pass
+            if time.time() >= end:
+                break
+            time.sleep(0)
+        return None
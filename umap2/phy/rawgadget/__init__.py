@@ -0,0 +1,3 @@
+'''
+Raw Gadget based physical layer (Linux only)
+'''
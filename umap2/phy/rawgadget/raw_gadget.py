@@ -0,0 +1,191 @@
+'''
+Raw Gadget ioctl interface, used by RawGadgetPhy
+
+Raw Gadget is a Linux kernel module (available from v5.7) that exposes the
+gadget subsystem to user-space with full control over enumeration.
+All operations are performed with ioctls on ``/dev/raw-gadget``,
+the structures and request numbers below follow
+``include/uapi/linux/usb/raw_gadget.h``.
+'''
+import os
+import struct
+
+
+UDC_NAME_LENGTH_MAX = 128
+
+# usb_device_speed
+USB_SPEED_UNKNOWN = 0
+USB_SPEED_LOW = 1
+USB_SPEED_FULL = 2
+USB_SPEED_HIGH = 3
+USB_SPEED_WIRELESS = 4
+USB_SPEED_SUPER = 5
+
+# usb_raw_event_type
+USB_RAW_EVENT_INVALID = 0
+USB_RAW_EVENT_CONNECT = 1
+USB_RAW_EVENT_CONTROL = 2
+USB_RAW_EVENT_SUSPEND = 3
+USB_RAW_EVENT_RESUME = 4
+USB_RAW_EVENT_RESET = 5
+USB_RAW_EVENT_DISCONNECT = 6
+
+USB_RAW_IO_FLAGS_ZERO = 0x0001
+
+# struct sizes
+USB_RAW_INIT_SIZE = UDC_NAME_LENGTH_MAX * 2 + 1
+USB_RAW_EVENT_SIZE = 8
+USB_RAW_EP_IO_SIZE = 8
+USB_ENDPOINT_DESCRIPTOR_SIZE = 9
+USB_RAW_EVENT_MAX_DATA = 64
+
+_IOC_NONE = 0
+_IOC_WRITE = 1
+_IOC_READ = 2
+
+
+def _ioc(direction, nr, size):
+    '''
+    Build an ioctl request number (asm-generic encoding) for the 'U' type
+    '''
+    return (direction << 30) | (size << 16) | (ord('U') << 8) | nr
+
+
+USB_RAW_IOCTL_INIT = _ioc(_IOC_WRITE, 0, USB_RAW_INIT_SIZE)
+USB_RAW_IOCTL_RUN = _ioc(_IOC_NONE, 1, 0)
+USB_RAW_IOCTL_EVENT_FETCH = _ioc(_IOC_READ, 2, USB_RAW_EVENT_SIZE)
+USB_RAW_IOCTL_EP0_WRITE = _ioc(_IOC_WRITE, 3, USB_RAW_EP_IO_SIZE)
+USB_RAW_IOCTL_EP0_READ = _ioc(_IOC_READ | _IOC_WRITE, 4, USB_RAW_EP_IO_SIZE)
+USB_RAW_IOCTL_EP_ENABLE = _ioc(_IOC_WRITE, 5, USB_ENDPOINT_DESCRIPTOR_SIZE)
+USB_RAW_IOCTL_EP_DISABLE = _ioc(_IOC_WRITE, 6, 4)
+USB_RAW_IOCTL_EP_WRITE = _ioc(_IOC_WRITE, 7, USB_RAW_EP_IO_SIZE)
+USB_RAW_IOCTL_EP_READ = _ioc(_IOC_READ | _IOC_WRITE, 8, USB_RAW_EP_IO_SIZE)
+USB_RAW_IOCTL_CONFIGURE = _ioc(_IOC_NONE, 9, 0)
+USB_RAW_IOCTL_VBUS_DRAW = _ioc(_IOC_WRITE, 10, 4)
+USB_RAW_IOCTL_EP0_STALL = _ioc(_IOC_NONE, 12, 0)
+USB_RAW_IOCTL_EP_SET_HALT = _ioc(_IOC_WRITE, 13, 4)
+
+
+class IoctlLayer(object):
+    '''
+    Thin wrapper around the OS calls used to talk with the raw-gadget device.
+    Unit tests replace it with a mock that emulates the kernel module.
+    '''
+
+    def open(self, path):
+        return os.open(path, os.O_RDWR)
+
+    def close(self, fd):
+        os.close(fd)
+
+    def ioctl(self, fd, request, arg=0):
+        '''
+        :param fd: file descriptor
+        :param request: ioctl request number
+        :param arg: int or bytearray (mutated in place for _IOR requests)
+        :return: return value of the ioctl
+        '''
+        import fcntl
+        if isinstance(arg, bytearray):
+            return fcntl.ioctl(fd, request, arg, True)
+        return fcntl.ioctl(fd, request, arg)
+
+
+class RawGadgetEvent(object):
+
+    def __init__(self, event_type, data):
+        self.type = event_type
+        self.data = data
+
+    def __str__(self):
+        return 'type=%#x, len=%#x' % (self.type, len(self.data))
+
+
+class RawGadget(object):
+    '''
+    Raw Gadget device, each instance owns a single /dev/raw-gadget file
+    descriptor (i.e. a single emulated device).
+    '''
+
+    def __init__(self, path='/dev/raw-gadget', ioctl_layer=None):
+        '''
+        :param path: path to the raw-gadget device (default: /dev/raw-gadget)
+        :param ioctl_layer: layer for the OS calls (default: IoctlLayer())
+        '''
+        self.path = path
+        self.layer = IoctlLayer() if ioctl_layer is None else ioctl_layer
+        self.fd = None
+
+    def open(self):
+        self.fd = self.layer.open(self.path)
+
+    def close(self):
+        if self.fd is not None:
+            self.layer.close(self.fd)
+        self.fd = None
+
+    def _ioctl(self, request, arg=0):
+        return self.layer.ioctl(self.fd, request, arg)
+
+    def init(self, driver_name, device_name, speed):
+        arg = bytearray(struct.pack(
+            '%ds%dsB' % (UDC_NAME_LENGTH_MAX, UDC_NAME_LENGTH_MAX),
+            driver_name.encode('ascii'),
+            device_name.encode('ascii'),
+            speed
+        ))
+        self._ioctl(USB_RAW_IOCTL_INIT, arg)
+
+    def run(self):
+        self._ioctl(USB_RAW_IOCTL_RUN)
+
+    def event_fetch(self, max_length=USB_RAW_EVENT_MAX_DATA):
+        '''
+        Fetch the next event, blocks until an event is available
+
+        :return: RawGadgetEvent
+        '''
+        arg = bytearray(struct.pack('<II', 0, max_length) + b'\x00' * max_length)
+        self._ioctl(USB_RAW_IOCTL_EVENT_FETCH, arg)
+        event_type, length = struct.unpack('<II', bytes(arg[:USB_RAW_EVENT_SIZE]))
+        data = bytes(arg[USB_RAW_EVENT_SIZE:USB_RAW_EVENT_SIZE + length])
+        return RawGadgetEvent(event_type, data)
+
+    def _ep_io(self, ep, data, flags=0):
+        return bytearray(struct.pack('<HHI', ep, flags, len(data)) + data)
+
+    def ep0_write(self, data):
+        return self._ioctl(USB_RAW_IOCTL_EP0_WRITE, self._ep_io(0, data))
+
+    def ep0_read(self, length):
+        arg = self._ep_io(0, b'\x00' * length)
+        rlen = self._ioctl(USB_RAW_IOCTL_EP0_READ, arg)
+        return bytes(arg[USB_RAW_EP_IO_SIZE:USB_RAW_EP_IO_SIZE + rlen])
+
+    def ep0_stall(self):
+        self._ioctl(USB_RAW_IOCTL_EP0_STALL)
+
+    def ep_enable(self, descriptor):
+        '''
+        :param descriptor: endpoint descriptor (7 or 9 bytes)
+        :return: endpoint handle, used for all other endpoint operations
+        '''
+        arg = bytearray(descriptor[:USB_ENDPOINT_DESCRIPTOR_SIZE].ljust(USB_ENDPOINT_DESCRIPTOR_SIZE, b'\x00'))
+        return self._ioctl(USB_RAW_IOCTL_EP_ENABLE, arg)
+
+    def ep_disable(self, handle):
+        self._ioctl(USB_RAW_IOCTL_EP_DISABLE, handle)
+
+    def ep_write(self, handle, data):
+        return self._ioctl(USB_RAW_IOCTL_EP_WRITE, self._ep_io(handle, data))
+
+    def ep_read(self, handle, length):
+        arg = self._ep_io(handle, b'\x00' * length)
+        rlen = self._ioctl(USB_RAW_IOCTL_EP_READ, arg)
+        return bytes(arg[USB_RAW_EP_IO_SIZE:USB_RAW_EP_IO_SIZE + rlen])
+
+    def configure(self):
+        self._ioctl(USB_RAW_IOCTL_CONFIGURE)
+
+    def vbus_draw(self, power):
+        self._ioctl(USB_RAW_IOCTL_VBUS_DRAW, power)
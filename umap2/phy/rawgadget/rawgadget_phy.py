@@ -0,0 +1,340 @@
+'''
+Emulate a USB device via Raw Gadget (Linux only)
+
+Raw Gadget is a low-level interface to the Linux USB gadget subsystem.
+Unlike GadgetFS it passes every control request (including the enumeration)
+to user-space and requires no patched kernel modules.
+
+Combined with the ``dummy_hcd`` module (which provides a virtual host
+controller connected to a virtual device controller) this allows the local
+kernel to act as the USB host, so the host USB stack can be tested without
+any additional hardware:
+
+::
+
+    $ modprobe dummy_hcd raw_gadget
+    $ umap2emulate -P rawgadget -C keyboard
+
+For a real UDC, specify the driver and device names, e.g.
+``rawgadget:20980000.usb:20980000.usb``.
+If only the driver is specified, the device is looked up in /sys/class/udc.
+
+Event fetching and endpoint I/O ioctls are blocking,
+so like GadgetFsPhy we use a separate thread for events and for each endpoint.
+'''
+import os
+import platform
+import struct
+import threading
+from binascii import hexlify
+
+from six.moves.queue import Queue, Empty
+
+from umap2.core.usb import Request, State
+from umap2.core.usb_device import USBDeviceRequest
+from umap2.core.usb_endpoint import USBEndpoint
+from umap2.phy.iphy import PhyInterface
+from umap2.phy.rawgadget.raw_gadget import RawGadget
+from umap2.phy.rawgadget.raw_gadget import USB_SPEED_FULL
+from umap2.phy.rawgadget.raw_gadget import USB_RAW_EVENT_CONNECT, USB_RAW_EVENT_CONTROL
+from umap2.phy.rawgadget.raw_gadget import USB_RAW_EVENT_SUSPEND, USB_RAW_EVENT_RESUME
+from umap2.phy.rawgadget.raw_gadget import USB_RAW_EVENT_RESET, USB_RAW_EVENT_DISCONNECT
+
+
+DEFAULT_DRIVER_NAME = 'dummy_udc'
+DEFAULT_DEVICE_NAME = 'dummy_udc.0'
+
+
+def find_udc_device(driver_name, udc_dir='/sys/class/udc'):
+    '''
+    Find the UDC device of a driver,
+    UDC devices are named after their driver (e.g. dummy_udc.0, 20980000.usb)
+
+    :param driver_name: name of the UDC driver
+    :param udc_dir: directory of the UDC devices (default: /sys/class/udc)
+    :return: name of the UDC device
+    '''
+    devices = sorted(os.listdir(udc_dir)) if os.path.isdir(udc_dir) else []
+    matches = [d for d in devices if d == driver_name or d.startswith(driver_name + '.')]
+    if len(matches) != 1:
+        raise Exception('Cannot find the UDC device of %s (UDC devices: %s), use rawgadget:<driver>:<device>' % (
+            driver_name, ', '.join(devices) or 'none'
+        ))
+    return matches[0]
+
+
+class RawGadgetPhy(PhyInterface):
+    '''
+    Physical layer based on Raw Gadget
+    '''
+
+    def __init__(self, app, driver_name=DEFAULT_DRIVER_NAME, device_name=None, speed=USB_SPEED_FULL, raw_gadget=None):
+        '''
+        :type app: :class:`~umap2.app.base.Umap2App`
+        :param app: application instance
+        :param driver_name: name of the UDC driver (default: dummy_udc)
+        :param device_name: name of the UDC device
+            (default: None, dummy_udc.0 for dummy_udc, otherwise look it up in /sys/class/udc)
+        :param speed: one of raw_gadget.USB_SPEED_* (default: USB_SPEED_FULL)
+        :type raw_gadget: :class:`~umap2.phy.rawgadget.raw_gadget.RawGadget`
+        :param raw_gadget: raw gadget device (default: None, create a new one)
+        '''
+        super(RawGadgetPhy, self).__init__(app, 'RawGadgetPhy')
+        if raw_gadget is None:
+            if platform.system() != 'Linux':
+                raise Exception('RawGadgetPhy is only supported on Linux')
+            raw_gadget = RawGadget()
+        self.rg = raw_gadget
+        if device_name is None:
+            if driver_name == DEFAULT_DRIVER_NAME:
+                device_name = DEFAULT_DEVICE_NAME
+            else:
+                device_name = find_udc_device(driver_name)
+        self.driver_name = driver_name
+        self.device_name = device_name
+        self.speed = speed
+        self.configured = False
+        self.req_direction = Request.direction_device_to_host
+        self.ep0_handled = True
+        self.event_thread = None
+        self.ep_threads = {}
+        self.in_ep_threads = []
+
+    def connect(self, usb_device):
+        super(RawGadgetPhy, self).connect(usb_device)
+        self.rg.open()
+        self.debug('Opened raw gadget device: %s' % (self.rg.path))
+        self.rg.init(self.driver_name, self.device_name, self.speed)
+        self.rg.run()
+        self.event_thread = EventThread(self)
+        self.event_thread.start()
+        self.info('Connected device %s' % self.connected_device.name)
+
+    def disconnect(self):
+        self._stop_endpoint_threads()
+        if self.event_thread:
+            self.event_thread.stop_evt.set()
+        self.rg.close()
+        if self.event_thread:
+            self.event_thread.join(0.5)
+        self.event_thread = None
+        self.configured = False
+        return super(RawGadgetPhy, self).disconnect()
+
+    def run(self):
+        '''
+        run loop for handling control (endpoint 0) events
+        '''
+        self.debug('Started run loop')
+        self.stop = False
+        while not self.stop:
+            try:
+                event = self.event_thread.events.get(True, 0.001)
+                self._handle_event(event)
+            except Empty:
+                pass
+            if self.app.should_stop_phy():
+                self.stop = True
+            for ept in self.in_ep_threads:
+                if not ept.handling_write():
+                    self.connected_device.handle_buffer_available(ept.ep.number)
+        self.debug('Done with run loop')
+
+    def send_on_endpoint(self, ep_num, data):
+        self.debug('send_on_endpoint %d(%d): %s' % (ep_num, len(data), hexlify(data)))
+        self.tap_data_in(ep_num, data)
+        address = ep_num | 0x80
+        if ep_num == 0:
+            self.send_on_ep0(data)
+        elif address in self.ep_threads:
+            self.ep_threads[address].send(data)
+        else:
+            raise Exception('No IN endpoint %#x (address %#x)' % (ep_num, address))
+
+    def send_on_ep0(self, data):
+        if self.ep0_handled:
+            self.debug('EP0 already handled for current request, ignoring %d bytes' % (len(data)))
+            return
+        self.ep0_handled = True
+        if self.req_direction == Request.direction_host_to_device:
+            # no data stage on OUT requests, just acknowledge
+            self.rg.ep0_read(0)
+        else:
+            self.rg.ep0_write(data)
+            self.debug('Done writing %d bytes to control endpoint (0)' % (len(data)))
+
+    def stall_ep0(self):
+        self.debug('Stalling EP0')
+        self.tap_stall()
+        self.ep0_handled = True
+        self.rg.ep0_stall()
+
+    def ack_status_stage(self):
+        if self.connected_device.state == State.configured and not self.configured:
+            self._setup_endpoints()
+            self.configured = True
+        if not self.ep0_handled:
+            self.ep0_handled = True
+            self.tap_ack()
+            self.rg.ep0_read(0)
+
+    def _handle_event(self, event):
+        if event.type == USB_RAW_EVENT_CONTROL:
+            self._handle_control(event)
+        elif event.type == USB_RAW_EVENT_CONNECT:
+            self.debug('Event CONNECT(%#x)' % (USB_RAW_EVENT_CONNECT))
+        elif event.type == USB_RAW_EVENT_RESET:
+            self.debug('Event RESET(%#x)' % (USB_RAW_EVENT_RESET))
+            self._stop_endpoint_threads()
+            self.configured = False
+        elif event.type == USB_RAW_EVENT_DISCONNECT:
+            self.debug('Event DISCONNECT(%#x)' % (USB_RAW_EVENT_DISCONNECT))
+            self._stop_endpoint_threads()
+            self.configured = False
+        elif event.type == USB_RAW_EVENT_SUSPEND:
+            self.debug('Event SUSPEND(%#x)' % (USB_RAW_EVENT_SUSPEND))
+        elif event.type == USB_RAW_EVENT_RESUME:
+            self.debug('Event RESUME(%#x)' % (USB_RAW_EVENT_RESUME))
+        else:
+            self.warning('Got unknown event type %#x' % (event.type))
+
+    def _handle_control(self, event):
+        self.app.signal_setup_packet_received()
+        setup_data = event.data[:8]
+        req = USBDeviceRequest(setup_data)
+        self.req_direction = req.get_direction()
+        self.ep0_handled = False
+        if self.req_direction == Request.direction_host_to_device and req.length > 0:
+            self.debug('expecting additional data on control ep - %#x bytes' % (req.length))
+            data = self.rg.ep0_read(req.length)
+            # reading the data stage also acknowledges the status stage
+            self.ep0_handled = True
+            if len(data) != req.length:
+                self.error('EP0 data have wrong length')
+            setup_data += data
+        self.tap_setup(setup_data)
+        self.connected_device.handle_request(setup_data)
+        if not self.ep0_handled:
+            if self.req_direction == Request.direction_host_to_device:
+                self.debug('Request was not handled, acknowledging')
+                self.send_on_ep0(b'')
+            else:
+                self.debug('Request was not handled, stalling')
+                self.stall_ep0()
+
+    def _setup_endpoints(self):
+        conf = self.connected_device.configuration
+        power = struct.unpack('B', conf.get_descriptor(valid=True)[8:9])[0] * 2
+        for iface in conf.interfaces:
+            for ep in iface.endpoints:
+                self._setup_endpoint(ep)
+        self.rg.vbus_draw(power)
+        self.rg.configure()
+
+    def _setup_endpoint(self, ep):
+        if ep.address in self.ep_threads:
+            self.ep_threads[ep.address].ep = ep
+            return
+        desc = ep.get_descriptor(usb_type='fullspeed', valid=True)
+        handle = self.rg.ep_enable(desc[:7])
+        self.debug('Enabled endpoint %#x, handle: %d' % (ep.address, handle))
+        if ep.direction == USBEndpoint.direction_out:
+            t = OutEpThread(self, ep, handle)
+        else:
+            t = InEpThread(self, ep, handle)
+            self.in_ep_threads.append(t)
+        self.ep_threads[ep.address] = t
+        t.start()
+
+    def _stop_endpoint_threads(self):
+        for t in self.ep_threads.values():
+            t.stop_evt.set()
+        for ep_address, t in self.ep_threads.items():
+            self.verbose('closing thread for endpoint %#x' % (ep_address))
+            t.join(0.5)
+        self.ep_threads = {}
+        self.in_ep_threads = []
+
+
+class EventThread(threading.Thread):
+    '''Thread for fetching raw gadget events'''
+
+    def __init__(self, phy):
+        super(EventThread, self).__init__()
+        self.daemon = True
+        self.phy = phy
+        self.events = Queue()
+        self.stop_evt = threading.Event()
+
+    def run(self):
+        while not self.stop_evt.is_set():
+            try:
+                event = self.phy.rg.event_fetch()
+            except (OSError, IOError) as err:
+                if not self.stop_evt.is_set():
+                    self.phy.error('Error fetching raw gadget event: %s' % (err))
+                break
+            self.phy.verbose('Got event: %s' % (event))
+            self.events.put(event)
+
+
+class EndpointThread(threading.Thread):
+    '''Thread for endpoint I/O'''
+
+    def __init__(self, phy, ep, handle):
+        super(EndpointThread, self).__init__()
+        self.daemon = True
+        self.phy = phy
+        self.ep = ep
+        self.handle = handle
+        self.stop_evt = threading.Event()
+
+    def run(self):
+        self.phy.debug('Starting thread for EP %#x' % (self.ep.address))
+        while not self.stop_evt.is_set():
+            try:
+                self.io_op()
+            except (OSError, IOError) as err:
+                if self.stop_evt.is_set():
+                    break
+                self.phy.error('Error in EP%d handling thread: %s' % (self.ep.number, err))
+
+
+class InEpThread(EndpointThread):
+
+    def __init__(self, phy, ep, handle):
+        super(InEpThread, self).__init__(phy, ep, handle)
+        self.queue = Queue()
+
+    def send(self, data):
+        self.queue.put(data)
+
+    def handling_write(self):
+        return not self.queue.empty()
+
+    def io_op(self):
+        '''
+        Fetch data from send queue and write to endpoint
+        '''
+        try:
+            data = self.queue.get(True, 0.1)
+            self.phy.rg.ep_write(self.handle, data)
+        except Empty:
+            pass
+
+
+class OutEpThread(EndpointThread):
+
+    def __init__(self, phy, ep, handle):
+        super(OutEpThread, self).__init__(phy, ep, handle)
+        self.read_size = self.ep.max_packet_size
+
+    def io_op(self):
+        '''
+        read data from endpoint and let the device handle it
+        '''
+        buff = self.phy.rg.ep_read(self.handle, self.read_size)
+        self.phy.debug('Done reading %d bytes from EP%d' % (len(buff), self.ep.number))
+        if buff and not self.stop_evt.is_set():
+            self.phy.tap_data_out(self.ep.number, buff)
+            self.phy.connected_device.handle_data_available(self.ep.number, buff)
@@ -0,0 +1,226 @@
+'''
+Traffic taps for the physical layers
+
+A tap is attached to a phy with :func:`~umap2.phy.iphy.PhyInterface.set_tap`,
+and the phy reports all the traffic to it.
+
+The PcapTap writes the traffic in pcap format with
+LINKTYPE_USB_LINUX_MMAPPED (usbmon) headers, so it can be opened directly
+with Wireshark. Events are packed into a preallocated ring buffer,
+and a background thread writes them to the file in bulk,
+so the tap adds very little overhead to the phy's run loop.
+'''
+import atexit
+import logging
+import struct
+import threading
+import time
+import weakref
+
+
+LINKTYPE_USB_LINUX_MMAPPED = 220
+
+PCAP_HEADER = struct.Struct('<IHHiIII')
+PCAP_RECORD_HEADER = struct.Struct('<IIII')
+# struct usbmon_packet (with the mmapped extension), 64 bytes
+USBMON_HEADER = struct.Struct('<QcBBBHccqiiII8siiII')
+
+# usbmon transfer types
+XFER_ISOCHRONOUS = 0
+XFER_INTERRUPT = 1
+XFER_CONTROL = 2
+XFER_BULK = 3
+
+# URB status
+STATUS_OK = 0
+STATUS_EPIPE = -32
+STATUS_EINPROGRESS = -115
+
+EVENT_SUBMIT = b'S'
+EVENT_COMPLETE = b'C'
+
+# taps that are not closed yet, a single atexit hook closes them all
+_open_taps = weakref.WeakSet()
+
+
+def _close_open_taps():
+    for tap in list(_open_taps):
+        tap.close()
+
+
+atexit.register(_close_open_taps)
+
+
+class PcapTap(object):
+    '''
+    Write phy traffic to a pcap file (usbmon format)
+    '''
+
+    def __init__(self, filename, buffer_size=0x400000, flush_interval=0.1, snaplen=0xffff, busnum=1):
+        '''
+        :param filename: pcap file name
+        :param buffer_size: size of the ring buffer in bytes (default: 4MB)
+        :param flush_interval: max time (in seconds) between writes to the file (default: 0.1)
+        :param snaplen: max captured data length per packet (default: 0xffff)
+        :param busnum: bus number to put in the packet headers (default: 1)
+        '''
+        self.filename = filename
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.snaplen = snaplen
+        self.busnum = busnum
+        self.ring = bytearray(buffer_size)
+        self.head = 0  # total bytes written to the ring
+        self.tail = 0  # total bytes flushed to the file
+        self.dropped = 0
+        self.urb_id = 0
+        self.ctrl_urb_id = 0
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.flush_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.fd = open(filename, 'wb')
+        self.fd.write(PCAP_HEADER.pack(0xa1b2c3d4, 2, 4, 0, 0, snaplen, LINKTYPE_USB_LINUX_MMAPPED))
+        self.fd.flush()
+        self.thread = threading.Thread(target=self._writer_loop)
+        self.thread.daemon = True
+        self.thread.start()
+        _open_taps.add(self)
+
+    def setup(self, devnum, buf):
+        '''
+        Setup packet received from the host
+
+        :param devnum: device address
+        :param buf: setup packet (8 bytes) and the data stage of OUT requests
+        '''
+        epnum = 0x80 if (ord(buf[0:1]) & 0x80) else 0x00
+        length = struct.unpack('<H', buf[6:8])[0] if len(buf) >= 8 else 0
+        self._add(
+            EVENT_SUBMIT, XFER_CONTROL, epnum, devnum, STATUS_EINPROGRESS, buf[8:], length,
+            setup=buf[:8], new_urb=True, control=True
+        )
+
+    def data_in(self, devnum, ep_num, xfer_type, data):
+        '''
+        Data sent by the device to the host
+        '''
+        self._add(
+            EVENT_COMPLETE, xfer_type, ep_num | 0x80, devnum, STATUS_OK, data, len(data),
+            new_urb=(ep_num != 0), control=(ep_num == 0)
+        )
+
+    def data_out(self, devnum, ep_num, xfer_type, data):
+        '''
+        Data received by the device from the host
+        '''
+        self._add(EVENT_SUBMIT, xfer_type, ep_num, devnum, STATUS_EINPROGRESS, data, len(data), new_urb=True)
+
+    def stall(self, devnum):
+        '''
+        Control endpoint stalled by the device
+        '''
+        self._add(EVENT_COMPLETE, XFER_CONTROL, 0x80, devnum, STATUS_EPIPE, b'', 0, control=True)
+
+    def ack(self, devnum):
+        '''
+        Status stage acknowledged by the device
+        '''
+        self._add(EVENT_COMPLETE, XFER_CONTROL, 0x00, devnum, STATUS_OK, b'', 0, control=True)
+
+    def _add(
+        self, event_type, xfer_type, epnum, devnum, status, data, length,
+        setup=None, new_urb=False, control=False
+    ):
+        '''
+        :param new_urb: allocate a new URB id for the event (default: False, use the current one)
+        :param control: the event belongs to the current control transfer (default: False)
+        '''
+        data = data[:self.snaplen]
+        caplen = USBMON_HEADER.size + len(data)
+        # events may come from the phy thread and the stack thread,
+        # the URB ids are allocated under the lock that orders the records
+        with self.lock:
+            if new_urb:
+                self.urb_id += 1
+                if control:
+                    self.ctrl_urb_id = self.urb_id
+            urb_id = self.ctrl_urb_id if control else self.urb_id
+            now = time.time()
+            ts_sec = int(now)
+            ts_usec = int((now - ts_sec) * 1000000)
+            usbmon = USBMON_HEADER.pack(
+                urb_id, event_type, xfer_type, epnum, devnum & 0x7f, self.busnum,
+                b'\x00' if setup is not None else b'-',
+                b'\x00' if data else (b'<' if epnum & 0x80 else b'>'),
+                ts_sec, ts_usec, status, length, len(data),
+                setup if setup is not None else b'\x00' * 8,
+                0, 0, 0, 0
+            )
+            self._put(PCAP_RECORD_HEADER.pack(ts_sec, ts_usec, caplen, caplen) + usbmon + data)
+
+    def _put(self, record):
+        '''
+        Append a record to the ring buffer, called with the lock held
+        '''
+        size = len(record)
+        if self.head - self.tail + size > self.buffer_size:
+            self.dropped += 1
+            return
+        offset = self.head % self.buffer_size
+        first = min(size, self.buffer_size - offset)
+        self.ring[offset:offset + first] = record[:first]
+        if first < size:
+            self.ring[:size - first] = record[first:]
+        self.head += size
+        if self.head - self.tail > self.buffer_size // 2:
+            self.flush_event.set()
+
+    def _get_pending(self):
+        with self.lock:
+            head = self.head
+        # only flush (under write_lock) advances the tail, so the data can be copied without the lock
+        start = self.tail % self.buffer_size
+        end = start + (head - self.tail)
+        if end <= self.buffer_size:
+            pending = bytes(self.ring[start:end])
+        else:
+            pending = bytes(self.ring[start:]) + bytes(self.ring[:end - self.buffer_size])
+        return head, pending
+
+    def flush(self):
+        '''
+        Write all the pending events to the file
+        '''
+        with self.write_lock:
+            if self.fd is None:
+                return
+            head, pending = self._get_pending()
+            if pending:
+                self.fd.write(pending)
+                self.fd.flush()
+            with self.lock:
+                self.tail = head
+
+    def _writer_loop(self):
+        while not self.stop_event.is_set():
+            self.flush_event.wait(self.flush_interval)
+            self.flush_event.clear()
+            self.flush()
+
+    def close(self):
+        '''
+        Stop the writer thread and write all the pending events
+        '''
+        if self.fd is None:
+            return
+        _open_taps.discard(self)
+        self.stop_event.set()
+        self.flush_event.set()
+        self.thread.join()
+        self.flush()
+        with self.write_lock:
+            self.fd.close()
+            self.fd = None
+        if self.dropped:
+            logging.getLogger('umap2').warning('[PcapTap] dropped %d events, ring buffer was full' % (self.dropped))
@@ -0,0 +1,3 @@
+'''
+Recording and replay of host sessions
+'''
@@ -0,0 +1,106 @@
+'''
+Record the traffic of a host session to a trace file
+
+The RecordingPhy wraps any other phy. Calls from the device to the phy
+(IN data, stalls, status stage acks) are recorded and forwarded to the
+wrapped phy, and the wrapped phy is connected to a proxy of the device,
+which records the calls from the host side (setup packets and OUT data)
+before forwarding them to the device.
+
+::
+
+    $ umap2emulate -P record:/tmp/keyboard.trace:fd:/dev/ttyUSB0 -C keyboard
+'''
+from umap2.phy.iphy import PhyInterface
+from umap2.phy.trace.trace import TraceWriter, RecordType
+
+
+class DeviceProxy(object):
+    '''
+    Proxy of the USB device, records the host's requests
+    '''
+
+    def __init__(self, phy, device):
+        self._phy = phy
+        self._device = device
+
+    def __getattr__(self, name):
+        return getattr(self._device, name)
+
+    def handle_request(self, buf):
+        self._phy.record(RecordType.setup, 0, buf)
+        self._device.handle_request(buf)
+
+    def handle_data_available(self, ep_num, data):
+        self._phy.record(RecordType.data_out, ep_num, data)
+        self._device.handle_data_available(ep_num, data)
+
+
+class RecordingPhy(PhyInterface):
+    '''
+    Physical layer wrapper that records the session to a trace file
+    '''
+
+    def __init__(self, app, phy, filename, record_empty_in=False):
+        '''
+        :type app: :class:`~umap2.app.base.Umap2App`
+        :param app: application instance
+        :type phy: :class:`~umap2.phy.iphy.PhyInterface`
+        :param phy: the wrapped phy
+        :param filename: trace file name (records are appended to it)
+        :param record_empty_in: record empty IN packets on non-control endpoints (default: False).
+            Some devices send an empty packet whenever the host polls them,
+            which would bloat the trace.
+        '''
+        super(RecordingPhy, self).__init__(app, 'RecordingPhy')
+        self.phy = phy
+        self.filename = filename
+        self.record_empty_in = record_empty_in
+        self.writer = None
+        self.running = False
+
+    def set_tap(self, tap):
+        super(RecordingPhy, self).set_tap(tap)
+        self.phy.set_tap(tap)
+
+    def record(self, rtype, ep, data=b''):
+        if self.writer:
+            self.writer.write(rtype, ep, data)
+
+    def connect(self, usb_device):
+        super(RecordingPhy, self).connect(usb_device)
+        if self.writer is None:
+            self.writer = TraceWriter(self.filename)
+            self.info('Recording session to %s' % (self.filename))
+        self.record(RecordType.connect, 0)
+        self.phy.connect(DeviceProxy(self, usb_device))
+
+    def disconnect(self):
+        self.record(RecordType.disconnect, 0)
+        if self.phy.is_connected():
+            self.phy.disconnect()
+        # reconnections during the run loop (e.g. when fuzzing) are recorded to the same session
+        if not self.running and self.writer:
+            self.writer.close()
+            self.writer = None
+        return super(RecordingPhy, self).disconnect()
+
+    def run(self):
+        self.running = True
+        try:
+            self.phy.run()
+        finally:
+            self.running = False
+
+    def send_on_endpoint(self, ep_num, data):
+        if data or ep_num == 0 or self.record_empty_in:
+            self.record(RecordType.data_in, ep_num, data)
+        self.phy.send_on_endpoint(ep_num, data)
+
+    def stall_ep0(self):
+        self.record(RecordType.stall, 0)
+        self.phy.stall_ep0()
+
+    def ack_status_stage(self):
+        self.record(RecordType.ack, 0)
+        self.phy.ack_status_stage()
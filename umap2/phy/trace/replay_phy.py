@@ -0,0 +1,148 @@
+'''
+Replay a recorded host session into a device
+
+The ReplayPhy feeds the host side of a trace (setup packets and OUT data)
+into the device, either at the original timing or as fast as possible,
+and compares the device responses with the recorded ones.
+This allows offline regression testing of device logic against
+real host behavior.
+
+::
+
+    $ umap2emulate -P replay:/tmp/keyboard.trace:original -C keyboard
+'''
+import time
+from binascii import hexlify
+
+from umap2.phy.iphy import PhyInterface
+from umap2.phy.trace.trace import RecordType, TraceRecord, read_trace
+
+
+class ReplayDiff(object):
+    '''
+    Difference between the recorded and the actual device response
+    '''
+
+    def __init__(self, index, expected, actual):
+        '''
+        :param index: index of the expected record in the trace (None for unexpected responses)
+        :param expected: the recorded response (None if the device sent an unexpected response)
+        :param actual: the actual response (None if the device did not respond)
+        '''
+        self.index = index
+        self.expected = expected
+        self.actual = actual
+
+    def __str__(self):
+        def fmt(record):
+            if record is None:
+                return 'nothing'
+            return '%s (%s)' % (record, hexlify(record.data))
+        return 'record %s: expected %s, got %s' % (self.index, fmt(self.expected), fmt(self.actual))
+
+
+class ReplayPhy(PhyInterface):
+    '''
+    Physical layer that replays a recorded trace
+    '''
+
+    speed_max = 'max'
+    speed_original = 'original'
+
+    def __init__(self, app, filename, speed=speed_max, poll_timeout=0.5):
+        '''
+        :type app: :class:`~umap2.app.base.Umap2App`
+        :param app: application instance
+        :param filename: trace file name
+        :param speed: replay speed - 'max' or 'original' (default: 'max')
+        :param poll_timeout: how long to poll the device for recorded IN data (default: 0.5)
+        '''
+        super(ReplayPhy, self).__init__(app, 'ReplayPhy')
+        if speed not in (self.speed_max, self.speed_original):
+            raise Exception('Unsupported replay speed: %s' % speed)
+        self.filename = filename
+        self.speed = speed
+        self.poll_timeout = poll_timeout
+        self.records = read_trace(filename)
+        self.responses = []
+        self.diffs = []
+        self.replayed = 0
+
+    def run(self):
+        '''
+        Replay the trace, then stop
+        '''
+        self.debug('Started replay of %d records' % (len(self.records)))
+        self.stop = False
+        self.responses = []
+        self.diffs = []
+        self.replayed = 0
+        session_start = time.time()
+        for i, record in enumerate(self.records):
+            if self.stop or self.app.should_stop_phy():
+                break
+            if record.type == RecordType.start:
+                session_start = time.time()
+            elif self.speed == self.speed_original:
+                delay = session_start + record.timestamp / 1000000.0 - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            self._replay_record(i, record)
+            self.replayed += 1
+        for response in self.responses:
+            self.diffs.append(ReplayDiff(None, None, response))
+        self.responses = []
+        self.stop = True
+        for diff in self.diffs:
+            self.warning('Diff: %s' % (diff))
+        self.info('Replayed %d records, %d diffs' % (self.replayed, len(self.diffs)))
+
+    def _replay_record(self, index, record):
+        if not self.is_connected():
+            return
+        if record.type == RecordType.setup:
+            self.app.signal_setup_packet_received()
+            self.tap_setup(record.data)
+            self.connected_device.handle_request(record.data)
+        elif record.type == RecordType.data_out:
+            self.tap_data_out(record.ep, record.data)
+            self.connected_device.handle_data_available(record.ep, record.data)
+        elif record.type in RecordType.device_types:
+            actual = self._get_response(record.ep)
+            if actual != record:
+                self.diffs.append(ReplayDiff(index, record, actual))
+        else:
+            self.debug('Trace record: %s' % (record))
+
+    def _get_response(self, ep_num):
+        '''
+        Get the first device response on an endpoint.
+        If there is none, poll the device for data on non-control endpoints.
+        '''
+        end = time.time() + self.poll_timeout
+        while True:
+            for i, response in enumerate(self.responses):
+                if response.ep == ep_num:
+                    return self.responses.pop(i)
+            if ep_num == 0 or time.time() >= end:
+                return None
+            self.connected_device.handle_buffer_available(ep_num)
+            time.sleep(0)
+
+    def _add_response(self, rtype, ep_num, data=b''):
+        self.responses.append(TraceRecord(rtype, ep_num, 0, data))
+
+    def send_on_endpoint(self, ep_num, data):
+        self.verbose('send_on_endpoint %d(%d): %s' % (ep_num, len(data), hexlify(data)))
+        self.tap_data_in(ep_num, data)
+        # empty IN packets on non-control endpoints are not recorded by default
+        if data or ep_num == 0:
+            self._add_response(RecordType.data_in, ep_num, data)
+
+    def stall_ep0(self):
+        self.tap_stall()
+        self._add_response(RecordType.stall, 0)
+
+    def ack_status_stage(self):
+        self.tap_ack()
+        self._add_response(RecordType.ack, 0)
@@ -0,0 +1,140 @@
+'''
+Compact binary trace of a host session, used by RecordingPhy and ReplayPhy
+
+The trace file starts with a header (magic and version),
+followed by a sequence of records.
+Each record has a fixed size header followed by its data:
+
+::
+
+    +------+----+-----------+--------+------+
+    | type | ep | timestamp | length | data |
+    |  B   | B  |    Q      |   I    | ...  |
+    +------+----+-----------+--------+------+
+
+The timestamp is the number of microseconds since the start of the session.
+Each session starts with a START record, its data is the start time
+(seconds since epoch, as a double).
+The file is only appended to, and each record is flushed once written,
+so a trace is usable even if umap2 was killed in the middle of a session.
+'''
+import struct
+import time
+
+
+TRACE_MAGIC = b'U2TR'
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct('<4sB')
+RECORD_HEADER = struct.Struct('<BBQI')
+
+
+class RecordType(object):
+    '''
+    Types of trace records
+    '''
+    start = 0x00
+    connect = 0x01
+    disconnect = 0x02
+    # host -> device
+    setup = 0x10
+    data_out = 0x11
+    # device -> host
+    data_in = 0x20
+    stall = 0x21
+    ack = 0x22
+
+    names = {
+        start: 'START',
+        connect: 'CONNECT',
+        disconnect: 'DISCONNECT',
+        setup: 'SETUP',
+        data_out: 'OUT',
+        data_in: 'IN',
+        stall: 'STALL',
+        ack: 'ACK',
+    }
+
+    host_types = (setup, data_out)
+    device_types = (data_in, stall, ack)
+
+
+class TraceRecord(object):
+
+    def __init__(self, rtype, ep, timestamp, data):
+        '''
+        :param rtype: record type (one of RecordType)
+        :param ep: endpoint number
+        :param timestamp: microseconds since the start of the session
+        :param data: record data
+        '''
+        self.type = rtype
+        self.ep = ep
+        self.timestamp = timestamp
+        self.data = data
+
+    def __eq__(self, other):
+        return (self.type, self.ep, self.data) == (other.type, other.ep, other.data)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __str__(self):
+        return '%s ep=%d ts=%d len=%d' % (
+            RecordType.names.get(self.type, '%#x' % self.type), self.ep, self.timestamp, len(self.data)
+        )
+
+
+class TraceWriter(object):
+    '''
+    Append records to a trace file
+    '''
+
+    def __init__(self, filename):
+        '''
+        :param filename: trace file name, created if it does not exist
+        '''
+        self.filename = filename
+        self.fd = open(filename, 'ab')
+        if self.fd.tell() == 0:
+            self.fd.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION))
+        self.start_time = time.time()
+        self.write(RecordType.start, 0, struct.pack('<d', self.start_time))
+
+    def write(self, rtype, ep, data=b''):
+        timestamp = int((time.time() - self.start_time) * 1000000)
+        self.fd.write(RECORD_HEADER.pack(rtype, ep, timestamp, len(data)) + data)
+        self.fd.flush()
+
+    def close(self):
+        if self.fd:
+            self.fd.close()
+            self.fd = None
+
+
+def read_trace(filename):
+    '''
+    Read all records from a trace file.
+    A truncated last record (e.g. if umap2 was killed while writing it) is ignored.
+
+    :param filename: trace file name
+    :return: list of TraceRecord
+    '''
+    with open(filename, 'rb') as f:
+        buff = f.read()
+    if len(buff) < TRACE_HEADER.size:
+        raise Exception('Trace file %s is too short' % (filename))
+    magic, version = TRACE_HEADER.unpack_from(buff, 0)
+    if magic != TRACE_MAGIC:
+        raise Exception('%s is not a umap2 trace file' % (filename))
+    if version != TRACE_VERSION:
+        raise Exception('Unsupported trace version %d' % (version))
+    records = []
+    offset = TRACE_HEADER.size
+    while offset + RECORD_HEADER.size <= len(buff):
+        rtype, ep, timestamp, length = RECORD_HEADER.unpack_from(buff, offset)
+        offset += RECORD_HEADER.size
+        if offset + length > len(buff):
+            break
+        records.append(TraceRecord(rtype, ep, timestamp, buff[offset:offset + length]))
+        offset += length
+    return records
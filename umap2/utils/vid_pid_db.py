@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+'''
+Build a compact VID:PID database for umap2vsscan
+
+Usage:
+    umap2vsdb -o <output> [-u <usb_ids>] [<db_file>...]
+
+Options:
+    -o --output <output>    path of the database file to write
+    -u --usb-ids <usb_ids>  usb.ids file to import (http://www.linux-usb.org/usb.ids)
+
+The entries of the python db files (a db list of DBEntry objects, like data/vid_pid_db.py,
+one entry in each line) are merged into the database: their drivers are added to the entries of usb.ids,
+and their names are used where usb.ids has none.
+
+Example:
+    $ umap2vsdb -o vid_pid.db -u usb.ids data/vid_pid_db.py
+    $ umap2vsscan -P fd:/dev/ttyUSB0 -d vid_pid.db
+
+File layout:
+
+- header: ``<magic:4s> <version:u16> <reserved:u16> <records:u32> <strings:u32> <string table offset:u32>``
+- records, sorted by vid:pid, each record is
+  ``<vid:u16> <pid:u16> <vendor:u32> <product:u32> <driver for each OS:u32 * 4>``,
+  the names and drivers are indices in the string table (0 is the empty string)
+- string table: offsets (u32) of the strings and of the end of the last string,
+  followed by the strings (utf-8)
+
+The file is memory-mapped, and an entry (and its strings) is read only when it is accessed.
+'''
+import ast
+import importlib
+import io
+import mmap
+import os
+import re
+import struct
+import sys
+
+import docopt
+
+
+DB_MAGIC = b'UVP\x00'
+DB_VERSION = 1
+DB_HEADER = struct.Struct('<4sHHIII')
+DB_RECORD = struct.Struct('<HHIIIIII')
+STRING_OFFSET = struct.Struct('<I')
+
+#: the operating systems that a record has a driver field for (values of umap2.apps.vsscan.OS)
+DRIVER_OS = ['Linux', 'Windows', 'OSX', 'QNX']
+
+
+def load_db_module(db_file):
+    '''
+    :param db_file: python db file, with a db member which is a list of DBEntry objects
+    :return: the db list
+    '''
+    dirpath, filename = os.path.split(os.path.abspath(db_file))
+    modulename = filename[:-3]
+    if dirpath in sys.path:
+        sys.path.remove(dirpath)
+    sys.path.insert(0, dirpath)
+    return importlib.import_module(modulename).db
+
+
+def parse_usb_ids(f):
+    '''
+    Parse the vendors and products of a usb.ids file
+
+    :param f: file object (text)
+    :return: generator of (vid, pid, vendor name, product name)
+    '''
+    vendor_re = re.compile(r'^([0-9a-fA-F]{4})\s+(.*)$')
+    product_re = re.compile(r'^\t([0-9a-fA-F]{4})\s+(.*)$')
+    vid = None
+    vendor_name = None
+    for line in f:
+        line = line.rstrip('\r\n')
+        if not line or line.startswith('#'):
+            continue
+        match = vendor_re.match(line)
+        if match:
+            vid, vendor_name = int(match.group(1), 16), match.group(2)
+            continue
+        match = product_re.match(line)
+        if match:
+            if vid is not None:
+                yield vid, int(match.group(1), 16), vendor_name, match.group(2)
+        elif not line.startswith('\t'):
+            # other lists (device classes, languages, etc.) follow the vendors
+            vid = None
+
+
+def parse_db_file(f):
+    '''
+    Parse the entries of a python db file (like data/vid_pid_db.py) without importing it,
+    each entry should be in a single line
+
+    :param f: file object (text)
+    :return: generator of (vid, pid, vendor name, product name, {os: driver})
+    '''
+    arg_names = ['vid', 'pid', 'vendor_name', 'product_name', 'drivers']
+    for line in f:
+        line = line.strip()
+        if not line.startswith('DBEntry('):
+            continue
+        call = ast.parse(line.rstrip(','), mode='eval').body
+        args = dict(zip(arg_names, call.args))
+        args.update((kw.arg, kw.value) for kw in call.keywords)
+        drivers = {}
+        if 'drivers' in args:
+            for key, value in zip(args['drivers'].keys, args['drivers'].values):
+                # the keys are attributes of the OS class, e.g. OS.LINUX
+                os_name = DRIVER_OS[[name.upper() for name in DRIVER_OS].index(key.attr)]
+                drivers[os_name] = ast.literal_eval(value)
+        yield (
+            ast.literal_eval(args['vid']),
+            ast.literal_eval(args['pid']),
+            ast.literal_eval(args['vendor_name']) if 'vendor_name' in args else '',
+            ast.literal_eval(args['product_name']) if 'product_name' in args else '',
+            drivers,
+        )
+
+
+class VidPidDBWriter(object):
+    '''
+    Collect entries and write them as a compact database
+    '''
+
+    def __init__(self):
+        # (vid, pid) -> [vendor name, product name, {os: driver}]
+        self.entries = {}
+
+    def add(self, vid, pid, vendor_name='', product_name='', drivers=None):
+        '''
+        Add an entry, or merge it into the entry of the same vid:pid
+
+        :param vid: vendor id
+        :param pid: product id
+        :param vendor_name: vendor name (default: '')
+        :param product_name: product name (default: '')
+        :param drivers: dictionary of os -> driver (default: None)
+        '''
+        entry = self.entries.setdefault((vid, pid), ['', '', {}])
+        entry[0] = entry[0] or vendor_name
+        entry[1] = entry[1] or product_name
+        for os_name, driver in (drivers or {}).items():
+            if os_name not in DRIVER_OS:
+                raise Exception('No driver field for OS %s (%04x:%04x)' % (os_name, vid, pid))
+            entry[2][os_name] = driver
+
+    def write(self, path):
+        '''
+        :param path: path of the database file
+        :return: number of entries
+        '''
+        strings = ['']
+        string_ids = {'': 0}
+
+        def string_id(s):
+            if s not in string_ids:
+                string_ids[s] = len(strings)
+                strings.append(s)
+            return string_ids[s]
+
+        records = []
+        for (vid, pid), (vendor_name, product_name, drivers) in sorted(self.entries.items()):
+            records.append(DB_RECORD.pack(
+                vid, pid, string_id(vendor_name), string_id(product_name),
+                *[string_id(drivers.get(os_name, '')) for os_name in DRIVER_OS]
+            ))
+        encoded = [s.encode('utf-8') for s in strings]
+        offsets = []
+        offset = 0
+        for s in encoded:
+            offsets.append(offset)
+            offset += len(s)
+        offsets.append(offset)
+        strings_offset = DB_HEADER.size + len(records) * DB_RECORD.size
+        with open(path, 'wb') as f:
+            f.write(DB_HEADER.pack(DB_MAGIC, DB_VERSION, 0, len(records), len(strings), strings_offset))
+            f.write(b''.join(records))
+            f.write(b''.join(STRING_OFFSET.pack(o) for o in offsets))
+            f.write(b''.join(encoded))
+        return len(records)
+
+
+class VidPidDB(object):
+    '''
+    Memory-mapped VID:PID database, a sequence of DBEntry objects (sorted by vid:pid)
+    that are created when they are accessed
+    '''
+
+    def __init__(self, path):
+        '''
+        :param path: path of the database file
+        '''
+        self.path = path
+        self.f = open(path, 'rb')
+        self.data = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.num_records, self.num_strings, self.strings_offset = DB_HEADER.unpack_from(self.data, 0)
+        if magic != DB_MAGIC or version != DB_VERSION:
+            self.close()
+            raise Exception('%s is not a VID:PID database (version %d)' % (path, DB_VERSION))
+        self.text_offset = self.strings_offset + (self.num_strings + 1) * STRING_OFFSET.size
+
+    def __len__(self):
+        return self.num_records
+
+    def get_string(self, index):
+        '''
+        :param index: index in the string table
+        :return: the string
+        '''
+        if not index:
+            return ''
+        start, end = struct.unpack_from('<II', self.data, self.strings_offset + index * STRING_OFFSET.size)
+        return self.data[self.text_offset + start:self.text_offset + end].decode('utf-8')
+
+    def get_vid_pid(self, index):
+        '''
+        :param index: index of the record
+        :return: tuple of (vid, pid) of the record
+        '''
+        return struct.unpack_from('<HH', self.data, DB_HEADER.size + index * DB_RECORD.size)
+
+    def __getitem__(self, index):
+        from umap2.apps.vsscan import DBEntry
+        if index < 0:
+            index += self.num_records
+        if not 0 <= index < self.num_records:
+            raise IndexError('No entry %d in %s' % (index, self.path))
+        fields = DB_RECORD.unpack_from(self.data, DB_HEADER.size + index * DB_RECORD.size)
+        vid, pid, vendor, product = fields[:4]
+        drivers = {}
+        for os_name, driver in zip(DRIVER_OS, fields[4:]):
+            if driver:
+                drivers[os_name] = self.get_string(driver)
+        return DBEntry(vid, pid, self.get_string(vendor), self.get_string(product), drivers=drivers)
+
+    def find(self, vid, pid):
+        '''
+        :return: index of the entry of vid:pid, None if it is not in the database
+        '''
+        lo, hi = 0, self.num_records
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.get_vid_pid(mid) < (vid, pid):
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.num_records and self.get_vid_pid(lo) == (vid, pid):
+            return lo
+        return None
+
+    def close(self):
+        self.data.close()
+        self.f.close()
+
+
+def main():
+    options = docopt.docopt(__doc__)
+    writer = VidPidDBWriter()
+    if options['--usb-ids']:
+        with io.open(options['--usb-ids'], 'r', encoding='utf-8', errors='replace') as f:
+            for vid, pid, vendor_name, product_name in parse_usb_ids(f):
+                writer.add(vid, pid, vendor_name, product_name)
+    for db_file in options['<db_file>']:
+        with io.open(db_file, 'r', encoding='utf-8') as f:
+            for vid, pid, vendor_name, product_name, drivers in parse_db_file(f):
+                writer.add(vid, pid, vendor_name, product_name, drivers)
+    count = writer.write(options['--output'])
+    print('Wrote %d entries to %s' % (count, options['--output']))
+
+
+if __name__ == '__main__':
+    main()